@@ -13,6 +13,7 @@ if __name__ == "__main__":
     argparser.add_argument("-u","--upload", help = "Upload output to database API",action="store_true")
     argparser.add_argument("-P","--include_prono", help = "Concatenate series_prono to output series",action="store_true")
     argparser.add_argument("-v","--verbose", help = "log to stdout",action="store_true")
+    argparser.add_argument("-w","--max_workers", help = "Maximum number of concurrent series download/upload requests",type=int)
     args = argparser.parse_args()
     if args.verbose:
         root = logging.getLogger()
@@ -24,12 +25,12 @@ if __name__ == "__main__":
         root.addHandler(handler)
     t_config = yaml.load(open(args.config_file),yaml.CLoader)
     topology = analysis.Topology(t_config)
-    topology.batchProcessInput(include_prono=args.include_prono)
+    topology.batchProcessInput(include_prono=args.include_prono,max_workers=args.max_workers)
     if args.csv is not None:
         topology.saveData(args.csv,pivot=args.pivot)
     if args.json is not None:
         topology.saveData(args.json,format="json",pivot=args.pivot)
     if args.upload:
-        uploaded = topology.uploadData()
+        uploaded = topology.uploadData(max_workers=args.max_workers)
         if args.include_prono:
             uploaded_prono = topology.uploadDataAsProno()
\ No newline at end of file
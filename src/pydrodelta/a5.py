@@ -1,11 +1,27 @@
 from jsonschema import validate as json_validate
+from jsonschema.validators import validator_for
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+import asyncio
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+try:
+    import ijson
+except ImportError:
+    ijson = None
 import pandas
+import numpy as np
 import pydrodelta.util as util
+from pydrodelta.cache import MetadataCache, arraysToDataFrame
 import json
 import os
 from datetime import datetime
 import yaml
+import logging
 
 config_file = open("%s/config/config.yml" % os.environ["PYDRODELTA_DIR"]) # "src/pydrodelta/config/config.json")
 config = yaml.load(config_file,yaml.CLoader)
@@ -180,7 +196,8 @@ schemas = {
                         "description": "tabla a la que pertenece la serie de salida",
                         "enum": [
                             "series",
-                            "series_areal"
+                            "series_areal",
+                            "series_rast"
                         ],
                         "defaultValue": "series"
                     },
@@ -288,7 +305,8 @@ schemas = {
                         "description": "tabla a la que pertenece la serie de entrada",
                         "enum": [
                             "series",
-                            "series_areal"
+                            "series_areal",
+                            "series_rast"
                         ],
                         "defaultValue": "series"
                     },
@@ -361,7 +379,8 @@ schemas = {
                         "description": "tabla de la serie simulada",
                         "enum": [
                             "series",
-                            "series_areal"
+                            "series_areal",
+                            "series_rast"
                         ],
                         "defaultValue": "series"
                     },
@@ -1220,10 +1239,95 @@ schemas = {
 serie_schema = open("%s/data/schemas/yaml/serie.yml" % os.environ["PYDRODELTA_DIR"])
 serie_schema = yaml.load(serie_schema,yaml.CLoader)
 
-def validate(instance,classname):
+validators = {}
+validators_lock = threading.Lock()
+
+def getValidator(classname : str):
+    """
+    returns compiled jsonschema validator of class classname. Validators are built once and cached, since building them (schema check and $ref resolution) dominates the validation time of small instances
+    """
     if classname not in schemas["components"]["schemas"].keys():
         raise Exception("Invalid class")
-    return json_validate(instance,schema=schemas) #[classname])
+    with validators_lock:
+        if classname not in validators:
+            schema = {
+                "$ref": "#/components/schemas/%s" % classname,
+                "components": schemas["components"]
+            }
+            validator_class = validator_for(schema)
+            validator_class.check_schema(schema)
+            validators[classname] = validator_class(schema)
+        return validators[classname]
+
+def validate(instance,classname):
+    getValidator(classname).validate(instance)
+
+def validateObservaciones(data,column : str="valor",check_monotonic : bool=True,raise_on_error : bool=True) -> pandas.DataFrame:
+    """
+    Validates observations against the Observacion contract column-wise (instead of row by row): timestart must be a non-null date, timeend (if not null) must be a date, valor must be non-null and numeric (or string), tipo (if present) must be one of puntual, areal, raster, series_id (if present) must be an integer and, if check_monotonic, timestamps must be strictly increasing (within each series_id, if present)
+
+    :param data: list of observations [{timestart: str, valor: float,...},...] or DataFrame with datetime index and values in column
+    :param column: values column (only for DataFrame input)
+    :param check_monotonic: check that timestamps are strictly increasing
+    :param raise_on_error: raise an exception if offending rows are found
+    :returns: report of offending rows: DataFrame with columns row (position in data), timestart, valor and error
+    """
+    if isinstance(data,pandas.DataFrame):
+        if column not in data.columns:
+            raise Exception("column %s not found in data" % column)
+        obs = pandas.DataFrame({"timestart": pandas.Series(data.index), "valor": data[column].reset_index(drop=True)})
+        if "series_id" in data.columns:
+            obs["series_id"] = data["series_id"].values
+    else:
+        obs = pandas.DataFrame.from_records(data) if len(data) else pandas.DataFrame(columns=["timestart","valor"])
+        for key in ["timestart","valor"]:
+            if key not in obs.columns:
+                raise Exception("Invalid Observacion: missing required property %s" % key)
+    errors = pandas.Series("",index=obs.index,dtype=object)
+    def flag(mask,message):
+        errors[mask] = errors[mask] + ("%s; " % message)
+    # timestart
+    if pandas.api.types.is_datetime64_any_dtype(obs["timestart"]):
+        dates = obs["timestart"]
+        flag(dates.isna(),"timestart is null")
+    else:
+        is_date = obs["timestart"].map(lambda x: isinstance(x,(str,datetime)))
+        flag(obs["timestart"].isna(),"timestart is null")
+        flag(~is_date & obs["timestart"].notna(),"timestart is not a string")
+        dates = pandas.to_datetime(obs["timestart"].where(is_date),utc=True,errors="coerce")
+        flag(dates.isna() & is_date,"invalid timestart")
+    # valor
+    flag(obs["valor"].isna(),"valor is null")
+    if not pandas.api.types.is_numeric_dtype(obs["valor"]) or pandas.api.types.is_bool_dtype(obs["valor"]):
+        is_valid_type = obs["valor"].map(lambda x: isinstance(x,(int,float,str,np.integer,np.floating)) and not isinstance(x,(bool,np.bool_)))
+        flag(~is_valid_type & obs["valor"].notna(),"valor is not a number")
+    # timeend, tipo, series_id
+    if "timeend" in obs.columns:
+        flag(obs["timeend"].notna() & ~obs["timeend"].map(lambda x: isinstance(x,(str,datetime))),"timeend is not a string")
+    if "tipo" in obs.columns:
+        flag(obs["tipo"].notna() & ~obs["tipo"].isin(["puntual","areal","raster"]),"invalid tipo")
+    if "series_id" in obs.columns and not pandas.api.types.is_integer_dtype(obs["series_id"]):
+        is_int = obs["series_id"].map(lambda x: isinstance(x,(int,np.integer)) and not isinstance(x,(bool,np.bool_)))
+        flag(obs["series_id"].notna() & ~is_int,"series_id is not an integer")
+    # monotonic
+    if check_monotonic and len(obs) > 1:
+        dates_ns = pandas.Series(pandas.DatetimeIndex(dates).asi8,index=obs.index)[dates.notna().values]
+        if "series_id" in obs.columns:
+            groups = obs["series_id"][dates_ns.index].values
+            previous = dates_ns.groupby(groups,dropna=False).cummax().groupby(groups,dropna=False).shift()
+        else:
+            previous = dates_ns.cummax().shift()
+        flag(((dates_ns <= previous) & previous.notna()).reindex(obs.index,fill_value=False),"timestart not increasing")
+    offending = errors != ""
+    report = pandas.DataFrame({
+        "row": np.flatnonzero(offending.values),
+        "timestart": obs["timestart"][offending].reset_index(drop=True),
+        "valor": obs["valor"][offending].reset_index(drop=True),
+        "error": errors[offending].str.rstrip("; ").values
+    })
+    if len(report) and raise_on_error:
+        raise Exception("Invalid Observacion: %i offending rows:\n%s" % (len(report),report.head(20).to_string(index=False)))
+    return report
 
 # CLASSES
 
@@ -1259,42 +1363,472 @@ class Observacion():
             "tag": self.tag
         }
             
-# CRUD
+class ObservacionesArrays():
+    """
+    Columnar buffer of observations: timestart (int64 UTC nanoseconds) and valor (float64) are stored in preallocated arrays whose capacity is doubled when full. Timestamp strings are buffered and converted to int64 in vectorized blocks of block_size rows
 
-def readSeries(tipo="puntual",series_id=None,area_id=None,estacion_id=None,escena_id=None,var_id=None,proc_id=None,unit_id=None,fuentes_id=None,tabla=None,id_externo=None,geom=None,include_geom=None,no_metadata=None,date_range_before=None,date_range_after=None,getMonthlyStats=None,getStats=None,getPercentiles=None,percentil=None,use_proxy=False):
-    if date_range_before is not None:
-        date_range_before = date_range_before if isinstance(date_range_before,str) else date_range_before.isoformat()
-    if date_range_after is not None:
-        date_range_after =date_range_after if isinstance(date_range_after,str) else date_range_after.isoformat()
-    params = locals()
-    del params["use_proxy"]
-    del params["tipo"]
-    response = requests.get("%s/obs/%s/series" % (config["api"]["url"], tipo),
-        params = params,
-        headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-        proxies = config["proxy_dict"] if use_proxy else None
-    )
-    if response.status_code != 200:
-        raise Exception("request failed: %s" % response.text)
-    json_response = response.json()
-    return json_response
+    :param capacity: initial capacity
+    :param block_size: number of timestamp strings buffered before conversion
+    """
+    def __init__(self,capacity : int=4096,block_size : int=65536):
+        self.timestart = np.empty(capacity,dtype=np.int64)
+        self.valor = np.empty(capacity,dtype=np.float64)
+        self.size = 0
+        self.block_size = block_size
+        self.pending = []
+        self.pending_start = 0
+    def __len__(self):
+        return self.size
+    def append(self,timestart : str,valor):
+        if self.size == len(self.valor):
+            self.grow()
+        self.valor[self.size] = np.nan if valor is None else valor
+        self.pending.append(timestart)
+        self.size += 1
+        if len(self.pending) >= self.block_size:
+            self.flush()
+    def grow(self):
+        capacity = max(2 * len(self.valor),1)
+        for key in ["timestart","valor"]:
+            column = np.empty(capacity,dtype=getattr(self,key).dtype)
+            column[:self.size] = getattr(self,key)[:self.size]
+            setattr(self,key,column)
+    def flush(self):
+        if len(self.pending):
+            self.timestart[self.pending_start:self.size] = util.tryParseAndLocalizeDates(self.pending).asi8
+        self.pending = []
+        self.pending_start = self.size
+    def finish(self):
+        """
+        converts pending timestamps and trims arrays to size
+        """
+        self.flush()
+        self.timestart = self.timestart[:self.size].copy()
+        self.valor = self.valor[:self.size].copy()
+        return self
+    def toDataFrame(self,tag : str=None) -> pandas.DataFrame:
+        """
+        returns DataFrame with valor (and tag) columns indexed by timestart, sorted by timestart
+        """
+        order = np.argsort(self.timestart,kind="stable")
+        return arraysToDataFrame(self.timestart[order],self.valor[order],tag=tag)
+
+def parseSerieStream(stream) -> dict:
+    """
+    Parses a5 serie response incrementally from file-like stream (requires ijson). observaciones are read straight into an ObservacionesArrays buffer, without building the intermediate list of dict
+    returns serie metadata with observaciones: ObservacionesArrays
+    """
+    builder = ijson.ObjectBuilder()
+    observaciones = ObservacionesArrays()
+    row = None
+    for prefix, event, value in ijson.parse(stream,use_float=True):
+        if prefix == "observaciones.item":
+            if event == "start_map":
+                row = {}
+            elif event == "end_map":
+                observaciones.append(row.get("timestart"),row.get("valor"))
+        elif prefix in ("observaciones.item.timestart","observaciones.item.valor"):
+            row[prefix.split(".")[-1]] = value
+        elif prefix.startswith("observaciones") or (prefix == "" and event == "map_key" and value == "observaciones"):
+            continue
+        else:
+            builder.event(event,value)
+    serie = builder.value
+    serie["observaciones"] = observaciones.finish()
+    return serie
 
-def readSerie(series_id,timestart=None,timeend=None,tipo="puntual",use_proxy=False):
-    params = {}
-    if timestart is not None and timeend is not None:
-        params = {
-            "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
-            "timeend": timeend if isinstance(timeend,str) else timeend.isoformat()
+def parseCorridaStream(stream) -> dict:
+    """
+    Parses a5 corrida response incrementally from file-like stream (requires ijson). pronosticos tuples [timestart,timeend,valor,qualifier] of the first series are read straight into an ObservacionesArrays buffer. pronosticos of the other series are skipped
+    returns corrida with series[0]["pronosticos"]: ObservacionesArrays
+    """
+    builder = ijson.ObjectBuilder()
+    pronosticos = ObservacionesArrays()
+    series_count = 0
+    row = None
+    for prefix, event, value in ijson.parse(stream,use_float=True):
+        if prefix == "series.item" and event == "start_map":
+            series_count += 1
+        if prefix == "series.item.pronosticos.item" and series_count == 1:
+            if event == "start_array":
+                row = []
+            elif event == "end_array":
+                pronosticos.append(row[0],row[2] if len(row) > 2 else None)
+        elif prefix == "series.item.pronosticos.item.item" and series_count == 1:
+            row.append(value)
+        elif prefix.startswith("series.item.pronosticos") or (prefix == "series.item" and event == "map_key" and value == "pronosticos"):
+            continue
+        else:
+            builder.event(event,value)
+    corrida = builder.value
+    if "series" in corrida and len(corrida["series"]):
+        corrida["series"][0]["pronosticos"] = pronosticos.finish()
+    return corrida
+
+def parseCorridaResponse(json_response : dict,series_id : int,cal_id : int) -> dict:
+    """
+    Extracts first series from a5 corrida response and reshapes pronosticos tuples into list of dict (unless already parsed into ObservacionesArrays)
+    returns Corridas object { series_id: int, cor_id: int, forecast_date: str, pronosticos: [{timestart:str,valor:float},...]}
+    """
+    if "series" not in json_response:
+        logging.warning("series %i from cal_id %i not found" % (series_id,cal_id))
+        return {
+            "forecast_date": json_response["forecast_date"],
+            "cal_id": json_response["cal_id"],
+            "cor_id": json_response["cor_id"],
+            "series_id": series_id,
+            "qualifier": None,
+            "pronosticos": []
+        }
+    if not len(json_response["series"]):
+        logging.warning("series %i from cal_id %i not found" % (series_id,cal_id))
+        return {
+            "forecast_date": json_response["forecast_date"],
+            "cal_id": json_response["cal_id"],
+            "cor_id": json_response["cor_id"],
+            "series_id": series_id,
+            "qualifier": None,
+            "pronosticos": []
         }
-    response = requests.get("%s/obs/%s/series/%i" % (config["api"]["url"], tipo, series_id),
-        params = params,
-        headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-        proxies = config["proxy_dict"] if use_proxy else None
-    )
-    if response.status_code != 200:
-        raise Exception("request failed: %s" % response.text)
-    json_response = response.json()
-    return json_response
+    if "pronosticos" not in json_response["series"][0]:
+        logging.warning("pronosticos from series %i from cal_id %i not found" % (series_id,cal_id))
+        return {
+            "forecast_date": json_response["forecast_date"],
+            "cal_id": json_response["cal_id"],
+            "cor_id": json_response["cor_id"],
+            "series_id": json_response["series"][0]["series_id"],
+            "qualifier": json_response["series"][0]["qualifier"],
+            "pronosticos": []
+        }
+    if not len(json_response["series"][0]["pronosticos"]):
+        logging.warning("pronosticos from series %i from cal_id %i is empty" % (series_id,cal_id))
+        return {
+            "forecast_date": json_response["forecast_date"],
+            "cal_id": json_response["cal_id"],
+            "cor_id": json_response["cor_id"],
+            "series_id": json_response["series"][0]["series_id"],
+            "qualifier": json_response["series"][0]["qualifier"],
+            "pronosticos": []
+        }
+    if not isinstance(json_response["series"][0]["pronosticos"],ObservacionesArrays):
+        json_response["series"][0]["pronosticos"] = [ { "timestart": x[0], "valor": x[2]} for x in json_response["series"][0] ["pronosticos"]] # "series_id": series_id, "timeend": x[1] "qualifier":x[3]
+    return {
+        "forecast_date": json_response["forecast_date"],
+        "cal_id": json_response["cal_id"],
+        "cor_id": json_response["cor_id"],
+        "series_id": json_response["series"][0]["series_id"],
+        "qualifier": json_response["series"][0]["qualifier"],
+        "pronosticos": json_response["series"][0]["pronosticos"]
+    }
+
+# CLIENT
+
+class A5Client():
+    """
+    a5 API client. Owns a pooled, keep-alive requests.Session so that successive calls reuse connections and auth headers. GET requests (and connection errors of any request) are retried with exponential backoff on 5xx responses and timeouts
+
+    :param url: api url. Defaults to config["api"]["url"]
+    :param token: api token. Defaults to config["api"]["token"]
+    :param proxy_dict: proxies to use when use_proxy=True. Defaults to config["proxy_dict"]
+    :param pool_size: maximum number of connections kept alive in the pool (should be >= number of concurrent workers)
+    :param max_retries: maximum number of retries
+    :param backoff_factor: backoff factor (seconds) between retries: backoff_factor * 2 ** (retry_number - 1)
+    :param timeout: default timeout (seconds) of each request. Either a float or a (connect, read) tuple. None waits forever
+    :param stream: default response mode of readSerie and readSerieProno. If True, responses are parsed incrementally into ObservacionesArrays (requires ijson)
+    """
+    def __init__(self,url : str=None,token : str=None,proxy_dict : dict=None,pool_size : int=10,max_retries : int=3,backoff_factor : float=0.5,timeout=None,stream : bool=False):
+        self.url = url if url is not None else config["api"]["url"]
+        self.token = token if token is not None else config["api"]["token"]
+        self.proxy_dict = proxy_dict if proxy_dict is not None else config["proxy_dict"] if "proxy_dict" in config else None
+        self.timeout = timeout
+        if stream and ijson is None:
+            raise Exception("stream mode requires ijson. Install it with: pip install ijson")
+        self.stream = stream
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': 'Bearer ' + self.token})
+        retry = Retry(
+            total = max_retries,
+            connect = max_retries,
+            read = max_retries,
+            status = max_retries,
+            backoff_factor = backoff_factor,
+            status_forcelist = [500, 502, 503, 504],
+            raise_on_status = False
+        )
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+    def close(self):
+        self.session.close()
+    def request(self,method : str,path : str,params : dict=None,json=None,use_proxy=False,timeout=None,stream=False):
+        """
+        sends request to api url + path using the pooled session. Returns requests.Response. If stream, the body is not downloaded until response.raw is read
+        """
+        return self.session.request(method, "%s/%s" % (self.url, path),
+            params = params,
+            json = json,
+            proxies = self.proxy_dict if use_proxy else None,
+            timeout = timeout if timeout is not None else self.timeout,
+            stream = stream
+        )
+    def readStream(self,response : requests.Response,parse_function):
+        """
+        parses body of streamed response with parse_function (parseSerieStream or parseCorridaStream) and releases the connection
+        """
+        with response:
+            if response.status_code != 200:
+                raise Exception("request failed: %s" % response.text)
+            response.raw.decode_content = True
+            return parse_function(response.raw)
+    def readSeries(self,tipo="puntual",series_id=None,area_id=None,estacion_id=None,escena_id=None,var_id=None,proc_id=None,unit_id=None,fuentes_id=None,tabla=None,id_externo=None,geom=None,include_geom=None,no_metadata=None,date_range_before=None,date_range_after=None,getMonthlyStats=None,getStats=None,getPercentiles=None,percentil=None,use_proxy=False,timeout=None):
+        if date_range_before is not None:
+            date_range_before = date_range_before if isinstance(date_range_before,str) else date_range_before.isoformat()
+        if date_range_after is not None:
+            date_range_after =date_range_after if isinstance(date_range_after,str) else date_range_after.isoformat()
+        params = locals()
+        del params["self"]
+        del params["use_proxy"]
+        del params["tipo"]
+        del params["timeout"]
+        response = self.request("GET","obs/%s/series" % tipo,
+            params = params,
+            use_proxy = use_proxy,
+            timeout = timeout
+        )
+        if response.status_code != 200:
+            raise Exception("request failed: %s" % response.text)
+        json_response = response.json()
+        return json_response
+    def readSerie(self,series_id,timestart=None,timeend=None,tipo="puntual",use_proxy=False,timeout=None,stream : bool=None):
+        """
+        Reads serie with observaciones from a5 API
+
+        :param stream: parse response incrementally, returning observaciones as ObservacionesArrays instead of list of dict. Defaults to self.stream
+        """
+        stream = stream if stream is not None else self.stream
+        params = {}
+        if timestart is not None and timeend is not None:
+            params = {
+                "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
+                "timeend": timeend if isinstance(timeend,str) else timeend.isoformat()
+            }
+        response = self.request("GET","obs/%s/series/%i" % (tipo, series_id),
+            params = params,
+            use_proxy = use_proxy,
+            timeout = timeout,
+            stream = stream
+        )
+        if stream:
+            return self.readStream(response,parseSerieStream)
+        if response.status_code != 200:
+            raise Exception("request failed: %s" % response.text)
+        json_response = response.json()
+        return json_response
+    def readObservaciones(self,series_id,timestart,timeend,tipo="puntual",use_proxy=False,timeout=None) -> list:
+        """
+        Reads observations of one or many series (series_id: int or list of int) in a single request
+        returns list of observaciones [{series_id: int, timestart: str, valor: float},...]
+        """
+        response = self.request("GET","obs/%s/observaciones" % tipo,
+            params = {
+                "series_id": ",".join([str(x) for x in series_id]) if isinstance(series_id,(list,tuple)) else series_id,
+                "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
+                "timeend": timeend if isinstance(timeend,str) else timeend.isoformat()
+            },
+            use_proxy = use_proxy,
+            timeout = timeout
+        )
+        if response.status_code != 200:
+            raise Exception("request failed: %s" % response.text)
+        json_response = response.json()
+        return json_response
+    def readSeriesObservaciones(self,series_ids : list,timestart,timeend,tipo="puntual",batch_size : int=50,use_proxy=False,timeout=None) -> dict:
+        """
+        Reads many series (metadata and observaciones) using two requests (readSeries + readObservaciones) per batch of batch_size series
+        returns dict of series { series_id: { id: int, estacion: dict, ..., observaciones: [{timestart: str, valor: float},...]},...}
+        """
+        series_ids = list(dict.fromkeys(series_ids))
+        if not len(series_ids):
+            return {}
+        batch_size = batch_size or len(series_ids)
+        series = {}
+        for i in range(0,len(series_ids),batch_size):
+            batch = series_ids[i:i+batch_size]
+            metadata = self.readSeries(tipo=tipo,series_id=",".join([str(x) for x in batch]),use_proxy=use_proxy,timeout=timeout)
+            metadata = metadata["rows"] if isinstance(metadata,dict) and "rows" in metadata else metadata
+            metadata = {int(x["id"]): x for x in metadata}
+            for series_id in batch:
+                if series_id not in metadata:
+                    raise Exception("series %i not found" % series_id)
+                series[series_id] = dict(metadata[series_id])
+                series[series_id]["observaciones"] = []
+            for observacion in self.readObservaciones(batch,timestart,timeend,tipo=tipo,use_proxy=use_proxy,timeout=timeout):
+                if int(observacion["series_id"]) in series:
+                    series[int(observacion["series_id"])]["observaciones"].append(observacion)
+        return series
+    def createObservaciones(self,data,series_id : int,column="valor",tipo="puntual", timeSupport=None,use_proxy=False,timeout=None,chunk_size : int=None,chunk_retries : int=0,raise_on_error=True):
+        """
+        Creates (upserts) observations into a5 API
+
+        :param chunk_size: maximum number of observations per request. If None, all observations are sent in a single request
+        :param chunk_retries: number of times a failed chunk is sent again (only failed chunks are retried)
+        :param raise_on_error: if False, chunks that still fail after retries are logged and the observations created by the other chunks are returned
+        :returns: list of created observations
+        """
+        if isinstance(data,pandas.DataFrame):
+            # observations are uploaded sorted by time (see observacionesDataFrameToList)
+            data = data.sort_index()
+            validateObservaciones(data,column)
+            data = observacionesDataFrameToList(data,series_id,column,timeSupport)
+        else:
+            validateObservaciones(data)
+        path = "obs/%s/series/%i/observaciones" % (tipo, series_id) if series_id is not None else "obs/%s/observaciones" % tipo
+        chunk_size = chunk_size if chunk_size is not None else max(len(data),1)
+        chunks = [data[i:i+chunk_size] for i in range(0,len(data),chunk_size)] if len(data) else [data]
+        created = []
+        for i, chunk in enumerate(chunks):
+            for attempt in range(chunk_retries + 1):
+                try:
+                    response = self.request("POST",path,
+                        json = {
+                            "observaciones": chunk
+                        },
+                        use_proxy = use_proxy,
+                        timeout = timeout
+                    )
+                    if response.status_code != 200:
+                        raise Exception("request failed: %s" % response.text)
+                    created.extend(response.json())
+                    break
+                except Exception as e:
+                    if attempt < chunk_retries:
+                        logging.warning("createObservaciones: chunk %i/%i of series %s failed, retrying: %s" % (i + 1,len(chunks),str(series_id),str(e)))
+                        continue
+                    if raise_on_error:
+                        raise
+                    logging.error("createObservaciones: chunk %i/%i of series %s failed: %s" % (i + 1,len(chunks),str(series_id),str(e)))
+        return created
+    def createCorrida(self,data,cal_id=None,use_proxy=False,timeout=None):
+        validate(data,"Corrida")
+        cal_id = cal_id if cal_id is not None else data["cal_id"] if "cal_id" in data else None
+        if cal_id is None:
+            raise Exception("Missing parameter cal_id")
+        response = self.request("POST","sim/calibrados/%i/corridas" % cal_id,
+            json = data,
+            use_proxy = use_proxy,
+            timeout = timeout
+        )
+        logging.debug("createCorrida: POST %s" % response.url)
+        if response.status_code != 200:
+            raise Exception("request failed: status: %i, message: %s" % (response.status_code, response.text))
+        json_response = response.json()
+        return json_response
+    def readVar(self,var_id,use_proxy=False,timeout=None):
+        response = self.request("GET","obs/variables/%i" % var_id,
+            use_proxy = use_proxy,
+            timeout = timeout
+        )
+        if response.status_code != 200:
+            raise Exception("request failed: %s" % response.text)
+        json_response = response.json()
+        return json_response
+    def readSerieProno(self,series_id,cal_id,timestart=None,timeend=None,use_proxy=False,cor_id=None,forecast_date=None,qualifier=None,timeout=None,stream : bool=None):
+        """
+        Reads prono serie from a5 API
+        if forecast_date is not None, cor_id is overwritten by first corridas match
+        if stream (defaults to self.stream), the response is parsed incrementally and pronosticos is returned as ObservacionesArrays
+        returns Corridas object { series_id: int, cor_id: int, forecast_date: str, pronosticos: [{timestart:str,valor:float},...]}
+        """
+        stream = stream if stream is not None else self.stream
+        params = {}
+        if forecast_date is not None:
+            corridas_response = self.request("GET","sim/calibrados/%i/corridas" % cal_id,
+                params = {
+                    "forecast_date": forecast_date if isinstance(forecast_date,str) else forecast_date.isoformat()
+                },
+                use_proxy = use_proxy,
+                timeout = timeout
+            )
+            if corridas_response.status_code != 200:
+                raise Exception("request failed: %s" % corridas_response.text)
+            corridas = corridas_response.json()
+            if len(corridas):
+                cor_id = corridas[0]["cor_id"]
+            else:
+                logging.warning("series %i from cal_id %i at forecast_date %s not found" % (series_id,cal_id,forecast_date))
+                return {
+                "series_id": series_id,
+                "pronosticos": []
+            }
+        if timestart is not None and timeend is not None:
+            params = {
+                "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
+                "timeend": timeend if isinstance(timeend,str) else timeend.isoformat(),
+                "series_id": series_id
+            }
+        if qualifier is not None:
+            params["qualifier"] = qualifier
+        path = "sim/calibrados/%i/corridas/last" % cal_id
+        if cor_id is not None:
+            path = "sim/calibrados/%i/corridas/%i" % (cal_id, cor_id)
+        response = self.request("GET",path,
+            params = params,
+            use_proxy = use_proxy,
+            timeout = timeout,
+            stream = stream
+        )
+        if stream:
+            return parseCorridaResponse(self.readStream(response,parseCorridaStream),series_id,cal_id)
+        if response.status_code != 200:
+            raise Exception("request failed: %s" % response.text)
+        json_response = response.json()
+        return parseCorridaResponse(json_response,series_id,cal_id)
+
+metadata_cache = MetadataCache(
+    path = os.path.join(os.environ["PYDRODELTA_DIR"],config["metadata_cache"]["path"]) if "metadata_cache" in config and config["metadata_cache"] is not None and "path" in config["metadata_cache"] else None,
+    maxsize = config["metadata_cache"]["maxsize"] if "metadata_cache" in config and config["metadata_cache"] is not None and "maxsize" in config["metadata_cache"] else 1024
+)
+
+default_client = None
+default_client_lock = threading.Lock()
+
+def getDefaultClient() -> A5Client:
+    """
+    returns the module-level A5Client, creating it from config on first use. Optional pool_size, max_retries, backoff_factor, timeout and stream are read from config["api"]
+    """
+    global default_client
+    if default_client is None:
+        with default_client_lock:
+            if default_client is None:
+                default_client = A5Client(
+                    pool_size = config["api"]["pool_size"] if "pool_size" in config["api"] else 10,
+                    max_retries = config["api"]["max_retries"] if "max_retries" in config["api"] else 3,
+                    backoff_factor = config["api"]["backoff_factor"] if "backoff_factor" in config["api"] else 0.5,
+                    timeout = config["api"]["timeout"] if "timeout" in config["api"] else None,
+                    stream = config["api"]["stream"] if "stream" in config["api"] else False
+                )
+    return default_client
+
+def setDefaultClient(client : A5Client):
+    """
+    replaces the module-level A5Client used by readSerie, readSeries, readSerieProno, readVar, createObservaciones and createCorrida
+    """
+    global default_client
+    default_client = client
+
+# CRUD
+
+def readSeries(tipo="puntual",series_id=None,area_id=None,estacion_id=None,escena_id=None,var_id=None,proc_id=None,unit_id=None,fuentes_id=None,tabla=None,id_externo=None,geom=None,include_geom=None,no_metadata=None,date_range_before=None,date_range_after=None,getMonthlyStats=None,getStats=None,getPercentiles=None,percentil=None,use_proxy=False,timeout=None):
+    return getDefaultClient().readSeries(tipo=tipo,series_id=series_id,area_id=area_id,estacion_id=estacion_id,escena_id=escena_id,var_id=var_id,proc_id=proc_id,unit_id=unit_id,fuentes_id=fuentes_id,tabla=tabla,id_externo=id_externo,geom=geom,include_geom=include_geom,no_metadata=no_metadata,date_range_before=date_range_before,date_range_after=date_range_after,getMonthlyStats=getMonthlyStats,getStats=getStats,getPercentiles=getPercentiles,percentil=percentil,use_proxy=use_proxy,timeout=timeout)
+
+def readSerie(series_id,timestart=None,timeend=None,tipo="puntual",use_proxy=False,timeout=None,stream : bool=None):
+    return getDefaultClient().readSerie(series_id,timestart,timeend,tipo=tipo,use_proxy=use_proxy,timeout=timeout,stream=stream)
+
+def readObservaciones(series_id,timestart,timeend,tipo="puntual",use_proxy=False,timeout=None):
+    return getDefaultClient().readObservaciones(series_id,timestart,timeend,tipo=tipo,use_proxy=use_proxy,timeout=timeout)
+
+def readSeriesObservaciones(series_ids : list,timestart,timeend,tipo="puntual",batch_size : int=50,use_proxy=False,timeout=None):
+    return getDefaultClient().readSeriesObservaciones(series_ids,timestart,timeend,tipo=tipo,batch_size=batch_size,use_proxy=use_proxy,timeout=timeout)
 
 def observacionesDataFrameToList(data : pandas.DataFrame,series_id : int,column="valor",timeSupport=None):
     # data: dataframe con índice tipo datetime y valores en columna "column"
@@ -1317,7 +1851,7 @@ def observacionesListToDataFrame(data: list, tag: str=None):
         raise Exception("empty list")
     data = pandas.DataFrame.from_dict(data)
     data["valor"] = data["valor"].astype(float)
-    data.index = data["timestart"].apply(util.tryParseAndLocalizeDate)
+    data.index = util.tryParseAndLocalizeDates(data["timestart"]).rename("timestart")
     data.sort_index(inplace=True)
     if tag is not None:
         data["tag"] = tag
@@ -1338,140 +1872,172 @@ def createEmptyObsDataFrame(extra_columns : dict=None):
     data.index = data["timestart"]
     return data [cnames]
 
-def createObservaciones(data,series_id : int,column="valor",tipo="puntual", timeSupport=None,use_proxy=False):
-    if isinstance(data,pandas.DataFrame):
-        data = observacionesDataFrameToList(data,series_id,column,timeSupport)
-    [validate(x,"Observacion") for x in data]
-    url = "%s/obs/%s/series/%i/observaciones" % (config["api"]["url"], tipo, series_id) if series_id is not None else "%s/obs/%s/observaciones" % (config["api"]["url"], tipo)
-    response = requests.post(url, json = {
-            "observaciones": data
-        }, headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-        proxies = config["proxy_dict"] if use_proxy else None
-    )
-    if response.status_code != 200:
-        raise Exception("request failed: %s" % response.text)
-    json_response = response.json()
-    return json_response
+def createObservaciones(data,series_id : int,column="valor",tipo="puntual", timeSupport=None,use_proxy=False,timeout=None,chunk_size : int=None,chunk_retries : int=0,raise_on_error=True):
+    return getDefaultClient().createObservaciones(data,series_id,column=column,tipo=tipo,timeSupport=timeSupport,use_proxy=use_proxy,timeout=timeout,chunk_size=chunk_size,chunk_retries=chunk_retries,raise_on_error=raise_on_error)
 
-def createCorrida(data,cal_id=None,use_proxy=False):
-    validate(data,"Corrida")
-    cal_id = cal_id if cal_id is not None else data["cal_id"] if "cal_id" in data else None
-    if cal_id is None:
-        raise Exception("Missing parameter cal_id")
-    url = "%s/sim/calibrados/%i/corridas" % (config["api"]["url"], cal_id)
-    response = requests.post(url, json = data, headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-        proxies = config["proxy_dict"] if use_proxy else None
-    )
-    print(response.url)
-    if response.status_code != 200:
-        raise Exception("request failed: status: %i, message: %s" % (response.status_code, response.text))
-    json_response = response.json()
-    return json_response
+def createCorrida(data,cal_id=None,use_proxy=False,timeout=None):
+    return getDefaultClient().createCorrida(data,cal_id=cal_id,use_proxy=use_proxy,timeout=timeout)
 
-def readVar(var_id,use_proxy=False):
-    response = requests.get("%s/obs/variables/%i" % (config["api"]["url"], var_id),
-        headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-        proxies = config["proxy_dict"] if use_proxy else None
-    )
-    if response.status_code != 200:
-        raise Exception("request failed: %s" % response.text)
-    json_response = response.json()
-    return json_response
+def readVar(var_id,use_proxy=False,timeout=None,use_cache=True):
+    """
+    Reads variable metadata from a5 API. If use_cache=True, it is first looked up in metadata_cache, and the response is stored there
+    """
+    if use_cache:
+        var = metadata_cache.get("var",var_id)
+        if var is not None:
+            return var
+    var = getDefaultClient().readVar(var_id,use_proxy=use_proxy,timeout=timeout)
+    metadata_cache.set("var",var_id,var)
+    return var
 
-def readSerieProno(series_id,cal_id,timestart=None,timeend=None,use_proxy=False,cor_id=None,forecast_date=None,qualifier=None):
+def readSerieProno(series_id,cal_id,timestart=None,timeend=None,use_proxy=False,cor_id=None,forecast_date=None,qualifier=None,timeout=None,stream : bool=None):
     """
     Reads prono serie from a5 API
     if forecast_date is not None, cor_id is overwritten by first corridas match
+    if stream, pronosticos is returned as ObservacionesArrays (see A5Client.readSerieProno)
     returns Corridas object { series_id: int, cor_id: int, forecast_date: str, pronosticos: [{timestart:str,valor:float},...]}
     """
-    params = {}
-    if forecast_date is not None:
-        corridas_response = requests.get("%s/sim/calibrados/%i/corridas" % (config["api"]["url"], cal_id),
-            params = {
-                "forecast_date": forecast_date if isinstance(forecast_date,str) else forecast_date.isoformat()
-            },
-            headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-            proxies = config["proxy_dict"] if use_proxy else None
+    return getDefaultClient().readSerieProno(series_id,cal_id,timestart,timeend,use_proxy=use_proxy,cor_id=cor_id,forecast_date=forecast_date,qualifier=qualifier,timeout=timeout,stream=stream)
+
+# ASYNC CLIENT
+
+class AsyncA5Client():
+    """
+    asyncio a5 API client (requires aiohttp). Use as async context manager so that the underlying aiohttp.ClientSession is opened and closed:
+
+        async with AsyncA5Client(max_concurrency=100) as client:
+            series = await asyncio.gather(*[client.aread_serie(series_id,timestart,timeend) for series_id in series_ids])
+
+    :param url: api url. Defaults to config["api"]["url"]
+    :param token: api token. Defaults to config["api"]["token"]
+    :param proxy_dict: proxies to use when use_proxy=True. Defaults to config["proxy_dict"]
+    :param max_concurrency: maximum number of requests in flight
+    :param timeout: default total timeout (seconds) of each request. None waits forever
+    """
+    def __init__(self,url : str=None,token : str=None,proxy_dict : dict=None,max_concurrency : int=100,timeout : float=None):
+        if aiohttp is None:
+            raise Exception("AsyncA5Client requires aiohttp. Install it with: pip install aiohttp")
+        self.url = url if url is not None else config["api"]["url"]
+        self.token = token if token is not None else config["api"]["token"]
+        self.proxy_dict = proxy_dict if proxy_dict is not None else config["proxy_dict"] if "proxy_dict" in config else None
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.semaphore = None
+        self.session = None
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.session = aiohttp.ClientSession(
+            headers = {'Authorization': 'Bearer ' + self.token},
+            connector = aiohttp.TCPConnector(limit=self.max_concurrency)
         )
-        if corridas_response.status_code != 200:
-            raise Exception("request failed: %s" % corridas_response.text)
-        corridas = corridas_response.json()
-        if len(corridas):
-            cor_id = corridas[0]["cor_id"]
-        else:
-            print("Warning: series %i from cal_id %i at forecast_date %s not found" % (series_id,cal_id,forecast_date))
-            return {
-            "series_id": series_id,
-            "pronosticos": []
-        }
-    if timestart is not None and timeend is not None:
-        params = {
-            "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
-            "timeend": timeend if isinstance(timestart,str) else timeend.isoformat(),
-            "series_id": series_id
-        }
-    if qualifier is not None:
-        params["qualifier"] = qualifier
-    url = "%s/sim/calibrados/%i/corridas/last" % (config["api"]["url"], cal_id)
-    if cor_id is not None:
-        url = "%s/sim/calibrados/%i/corridas/%i" % (config["api"]["url"], cal_id, cor_id)
-    response = requests.get(url,
-        params = params,
-        headers = {'Authorization': 'Bearer ' + config["api"]["token"]},
-        proxies = config["proxy_dict"] if use_proxy else None
-    )
-    if response.status_code != 200:
-        raise Exception("request failed: %s" % response.text)
-    json_response = response.json()
-    if "series" not in json_response:
-        print("Warning: series %i from cal_id %i not found" % (series_id,cal_id))
-        return {
-            "forecast_date": json_response["forecast_date"],
-            "cal_id": json_response["cal_id"],
-            "cor_id": json_response["cor_id"],
-            "series_id": series_id,
-            "qualifier": None,
-            "pronosticos": []
-        }
-    if not len(json_response["series"]):
-        print("Warning: series %i from cal_id %i not found" % (series_id,cal_id))
-        return {
-            "forecast_date": json_response["forecast_date"],
-            "cal_id": json_response["cal_id"],
-            "cor_id": json_response["cor_id"],
-            "series_id": series_id,
-            "qualifier": None,
-            "pronosticos": []
-        }
-    if "pronosticos" not in json_response["series"][0]:
-        print("Warning: pronosticos from series %i from cal_id %i not found" % (series_id,cal_id))
-        return {
-            "forecast_date": json_response["forecast_date"],
-            "cal_id": json_response["cal_id"],
-            "cor_id": json_response["cor_id"],
-            "series_id": json_response["series"][0]["series_id"],
-            "qualifier": json_response["series"][0]["qualifier"],
-            "pronosticos": []
-        }
-    if not len(json_response["series"][0]["pronosticos"]):
-        print("Warning: pronosticos from series %i from cal_id %i is empty" % (series_id,cal_id))
-        return {
-            "forecast_date": json_response["forecast_date"],
-            "cal_id": json_response["cal_id"],
-            "cor_id": json_response["cor_id"],
-            "series_id": json_response["series"][0]["series_id"],
-            "qualifier": json_response["series"][0]["qualifier"],
-            "pronosticos": []
-        }
-    json_response["series"][0]["pronosticos"] = [ { "timestart": x[0], "valor": x[2]} for x in json_response["series"][0] ["pronosticos"]] # "series_id": series_id, "timeend": x[1] "qualifier":x[3]
-    return {
-        "forecast_date": json_response["forecast_date"],
-        "cal_id": json_response["cal_id"],
-        "cor_id": json_response["cor_id"],
-        "series_id": json_response["series"][0]["series_id"],
-        "qualifier": json_response["series"][0]["qualifier"],
-        "pronosticos": json_response["series"][0]["pronosticos"]
-    }
+        return self
+    async def __aexit__(self,exc_type,exc,tb):
+        await self.session.close()
+        self.session = None
+    async def request(self,method : str,path : str,params : dict=None,use_proxy=False,timeout=None):
+        """
+        sends request to api url + path. Returns (status, parsed json body or response text if status != 200)
+        """
+        if self.session is None:
+            raise Exception("AsyncA5Client session not open. Use: async with AsyncA5Client() as client")
+        url = "%s/%s" % (self.url, path)
+        proxy = None
+        if use_proxy and self.proxy_dict is not None:
+            proxy = self.proxy_dict["https"] if url.startswith("https") else self.proxy_dict["http"]
+        params = {k: str(v) for k, v in params.items() if v is not None} if params is not None else None
+        timeout = timeout if timeout is not None else self.timeout
+        async with self.semaphore:
+            async with self.session.request(method, url, params=params, proxy=proxy, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status != 200:
+                    return response.status, await response.text()
+                return response.status, await response.json(content_type=None)
+    async def aread_serie(self,series_id,timestart=None,timeend=None,tipo="puntual",use_proxy=False,timeout=None):
+        """
+        async version of readSerie
+        """
+        params = {}
+        if timestart is not None and timeend is not None:
+            params = {
+                "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
+                "timeend": timeend if isinstance(timeend,str) else timeend.isoformat()
+            }
+        status, json_response = await self.request("GET","obs/%s/series/%i" % (tipo, series_id),params=params,use_proxy=use_proxy,timeout=timeout)
+        if status != 200:
+            raise Exception("request failed: %s" % json_response)
+        return json_response
+    async def aread_var(self,var_id,use_proxy=False,timeout=None):
+        """
+        async version of readVar
+        """
+        status, json_response = await self.request("GET","obs/variables/%i" % var_id,use_proxy=use_proxy,timeout=timeout)
+        if status != 200:
+            raise Exception("request failed: %s" % json_response)
+        return json_response
+    async def aread_serie_prono(self,series_id,cal_id,timestart=None,timeend=None,use_proxy=False,cor_id=None,forecast_date=None,qualifier=None,timeout=None):
+        """
+        async version of readSerieProno
+        """
+        params = {}
+        if forecast_date is not None:
+            status, corridas = await self.request("GET","sim/calibrados/%i/corridas" % cal_id,
+                params = {
+                    "forecast_date": forecast_date if isinstance(forecast_date,str) else forecast_date.isoformat()
+                },
+                use_proxy = use_proxy,
+                timeout = timeout
+            )
+            if status != 200:
+                raise Exception("request failed: %s" % corridas)
+            if len(corridas):
+                cor_id = corridas[0]["cor_id"]
+            else:
+                logging.warning("series %i from cal_id %i at forecast_date %s not found" % (series_id,cal_id,forecast_date))
+                return {
+                "series_id": series_id,
+                "pronosticos": []
+            }
+        if timestart is not None and timeend is not None:
+            params = {
+                "timestart": timestart if isinstance(timestart,str) else timestart.isoformat(),
+                "timeend": timeend if isinstance(timeend,str) else timeend.isoformat(),
+                "series_id": series_id
+            }
+        if qualifier is not None:
+            params["qualifier"] = qualifier
+        path = "sim/calibrados/%i/corridas/last" % cal_id
+        if cor_id is not None:
+            path = "sim/calibrados/%i/corridas/%i" % (cal_id, cor_id)
+        status, json_response = await self.request("GET",path,params=params,use_proxy=use_proxy,timeout=timeout)
+        if status != 200:
+            raise Exception("request failed: %s" % json_response)
+        return parseCorridaResponse(json_response,series_id,cal_id)
+
+async def aread_serie(series_id,timestart=None,timeend=None,tipo="puntual",use_proxy=False,timeout=None,client : AsyncA5Client=None):
+    """
+    async version of readSerie. If client is None, opens a single-use AsyncA5Client
+    """
+    if client is not None:
+        return await client.aread_serie(series_id,timestart,timeend,tipo=tipo,use_proxy=use_proxy,timeout=timeout)
+    async with AsyncA5Client() as client:
+        return await client.aread_serie(series_id,timestart,timeend,tipo=tipo,use_proxy=use_proxy,timeout=timeout)
+
+async def aread_serie_prono(series_id,cal_id,timestart=None,timeend=None,use_proxy=False,cor_id=None,forecast_date=None,qualifier=None,timeout=None,client : AsyncA5Client=None):
+    """
+    async version of readSerieProno. If client is None, opens a single-use AsyncA5Client
+    """
+    if client is not None:
+        return await client.aread_serie_prono(series_id,cal_id,timestart,timeend,use_proxy=use_proxy,cor_id=cor_id,forecast_date=forecast_date,qualifier=qualifier,timeout=timeout)
+    async with AsyncA5Client() as client:
+        return await client.aread_serie_prono(series_id,cal_id,timestart,timeend,use_proxy=use_proxy,cor_id=cor_id,forecast_date=forecast_date,qualifier=qualifier,timeout=timeout)
+
+async def aread_var(var_id,use_proxy=False,timeout=None,client : AsyncA5Client=None):
+    """
+    async version of readVar. If client is None, opens a single-use AsyncA5Client
+    """
+    if client is not None:
+        return await client.aread_var(var_id,use_proxy=use_proxy,timeout=timeout)
+    async with AsyncA5Client() as client:
+        return await client.aread_var(var_id,use_proxy=use_proxy,timeout=timeout)
 
 ## EJEMPLO
 '''
@@ -1497,8 +2063,7 @@ filled_df = util.serieFillNulls(reg_df,reg_df2)
 # convierte de dataframe a lista de dict
 obs_list = a5.observacionesDataFrameToList(obs_df,series_id=serie["id"])
 # valida observaciones
-for x in obs_list:
-    a5.validate(x,"Observacion")
+a5.validateObservaciones(obs_list)
 # sube observaciones a la api a5
 upserted = a5.createObservaciones(obs_df,series_id=serie["id"])
 '''
\ No newline at end of file
@@ -1,5 +1,7 @@
 import pydrodelta.a5 as a5
 import pydrodelta.util as util
+from pydrodelta.cache import ObservacionesCache, StateCache
+from pydrodelta.scheduler import TaskGraph
 from datetime import timedelta, datetime 
 import json
 import numpy as np
@@ -13,6 +15,11 @@ import dateutil.parser
 import sys
 import click
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from functools import partial
+import asyncio
+import threading
 
 schema = open("%s/data/schemas/json/topology.json" % os.environ["PYDRODELTA_DIR"])
 #schema = open("%s/data/schemas/yaml/topology.yml" % os.environ["PYDRODELTA_DIR"])
@@ -32,12 +39,27 @@ config_file.close()
 logging.basicConfig(filename="%s/%s" % (os.environ["PYDRODELTA_DIR"],config["log"]["filename"]), level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
 logging.FileHandler("%s/%s" % (os.environ["PYDRODELTA_DIR"],config["log"]["filename"]),"w+")
 
+def takeSnapshot(data,keep_original_data="eager"):
+    """
+    returns snapshot of data according to keep_original_data: deep copy (eager), copy-on-write util.DataSnapshot (lazy) or None (false)
+    """
+    if data is None or keep_original_data is False or keep_original_data == "false":
+        return None
+    if keep_original_data == "lazy":
+        return util.DataSnapshot(data)
+    return data.copy(deep=True)
+
 class SeriesData(pandas.DataFrame):
     def __init__(self, *args, **kwargs):
         super(SeriesData, self).__init__(*args, **kwargs)
 
 class NodeSerie():
+    keep_original_data = "eager"
     def __init__(self,params):
+        self._data = None
+        self._store = None
+        self._store_row = None
+        self._original_data = None
         self.series_id = params["series_id"]
         self.type = params["tipo"] if "tipo" in params else "puntual"
         self.lim_outliers = params["lim_outliers"] if "lim_outliers" in params else None
@@ -49,16 +71,102 @@ class NodeSerie():
         self.metadata = None
         self.outliers_data = None
         self.jumps_data = None
-    def loadData(self,timestart,timeend):
+    def loadData(self,timestart,timeend,cache=None):
+        """
+        Loads series data from a5 API. If cache (ObservacionesCache) is not None, downloads only the time ranges missing from the cache
+        """
         logging.debug("Load data for series_id: %i" % (self.series_id))
-        self.metadata = a5.readSerie(self.series_id,timestart,timeend,tipo=self.type)
-        if len(self.metadata["observaciones"]):
-            self.data = a5.observacionesListToDataFrame(self.metadata["observaciones"],tag="obs")
+        if cache is not None:
+            metadata, data = cache.readSerie(self.series_id,timestart,timeend,tipo=self.type)
+            self.setLoadedData(metadata,data)
+        else:
+            self.setLoadedData(a5.readSerie(self.series_id,timestart,timeend,tipo=self.type))
+    async def aloadData(self,timestart,timeend,client=None):
+        logging.debug("Async load data for series_id: %i" % (self.series_id))
+        self.setLoadedData(await a5.aread_serie(self.series_id,timestart,timeend,tipo=self.type,client=client))
+    def setLoadedData(self,metadata,data=None):
+        """
+        sets self.metadata and self.data. If data is None, it is parsed from metadata["observaciones"]
+        """
+        self.metadata = metadata
+        if data is None and isinstance(self.metadata["observaciones"],a5.ObservacionesArrays):
+            data = self.metadata["observaciones"].toDataFrame(tag="obs")
+        elif data is None and len(self.metadata["observaciones"]):
+            data = a5.observacionesListToDataFrame(self.metadata["observaciones"],tag="obs")
+        if data is not None and len(data):
+            self.data = data
         else:
             logging.warning("No data found for series_id=%i" % self.series_id)
             self.data = a5.createEmptyObsDataFrame(extra_columns={"tag":"str"})
-        self.original_data = self.data.copy(deep=True)
-        del self.metadata["observaciones"]
+        self.data["tag"] = util.encodeTags(self.data["tag"])
+        self.original_data = self.data
+        if "observaciones" in self.metadata:
+            del self.metadata["observaciones"]
+    @property
+    def data(self):
+        """
+        series data (DataFrame). If the series is kept in a ColumnarStore (see setStore), it is read from the store and the frame is shared with later reads: to change it, assign a new frame (or a shallow copy with replaced columns) to data instead of adding columns to it in place
+        """
+        if self._store is not None:
+            return self._store.getRow(self._store_row)
+        return self._data
+    @data.setter
+    def data(self,data):
+        if self._store is not None:
+            self.protectOriginalData()
+            if self._store.canStore(data):
+                self._store.setRow(self._store_row,data)
+                return
+            # data can't be stored (not aligned to the grid or extra columns): release row and keep DataFrame. Copy it, since it may view the store row, which will be reused
+            if isinstance(data,(pandas.DataFrame,pandas.Series)):
+                data = data.copy()
+            self._store.release(self._store_row)
+            self._store = None
+            self._store_row = None
+        self._data = data
+    @property
+    def original_data(self):
+        """
+        snapshot of data taken at load time (or before adjust / linear combination). Depending on keep_original_data it is a deep copy (eager), a copy-on-write snapshot (lazy) or not kept (false)
+        """
+        if isinstance(self._original_data,util.DataSnapshot):
+            self.protectOriginalData()
+            return self._original_data.data
+        return self._original_data
+    @original_data.setter
+    def original_data(self,data):
+        self._original_data = takeSnapshot(data,self.keep_original_data)
+    def protectOriginalData(self):
+        """
+        copies the lazy original_data snapshot if it views the current data. Must be called before mutating data in place
+        """
+        if isinstance(self._original_data,util.DataSnapshot) and (self._store is not None or self._original_data.data is self._data):
+            self._original_data.protect()
+    def setStore(self,store : util.ColumnarStore):
+        """
+        moves data into store (if it can be stored, see ColumnarStore.canStore). Afterwards data is read from and written to the store row, until data that can't be stored is assigned
+        """
+        if self._store is store or not store.canStore(self._data):
+            return
+        if self._store is not None:
+            self._store.release(self._store_row)
+        self._store_row = store.allocate()
+        store.setRow(self._store_row,self._data)
+        self._store = store
+        self._data = None
+    def getProcessParams(self) -> dict:
+        """
+        returns the attributes used by the processing stages (removeOutliers, detectJumps, applyOffset, applyMovingAverage), to rebuild the series in a worker process (see processVariableSeries)
+        """
+        return {
+            "series_id": self.series_id,
+            "type": self.type,
+            "lim_outliers": self.lim_outliers,
+            "lim_jump": self.lim_jump,
+            "x_offset": self.x_offset,
+            "y_offset": self.y_offset,
+            "moving_average": self.moving_average
+        }
     def getThresholds(self):
         if self.metadata is None:
             logging.warn("Metadata missing, unable to set thesholds")
@@ -74,7 +182,10 @@ class NodeSerie():
     def removeOutliers(self):
         if self.lim_outliers is None:
             return False
-        self.outliers_data = util.removeOutliers(self.data,self.lim_outliers)
+        self.protectOriginalData()
+        data = self.data
+        self.outliers_data = util.removeOutliers(data,self.lim_outliers)
+        self.data = data
         if len(self.outliers_data):
             return True
         else:
@@ -89,39 +200,116 @@ class NodeSerie():
             return False
     def applyMovingAverage(self):
         if self.moving_average is not None:
-            # self.data["valor"] = util.serieMovingAverage(self.data,self.moving_average)
             self.data = util.serieMovingAverage(self.data,self.moving_average,tag_column = "tag")
-    def applyTimedeltaOffset(self,row,x_offset):
-        return row.name + x_offset
     def applyOffset(self):
+        """
+        shifts data by x_offset and adds y_offset. data is replaced by a new frame instead of being modified in place, so that a lazy original_data snapshot is not copied. Does nothing if both offsets are zero
+        """
+        shift = self.x_offset != timedelta(0) if isinstance(self.x_offset,timedelta) else self.x_offset != 0
+        if not shift and self.y_offset == 0 and self.data.index.name == "timestart":
+            return
+        # shallow copy: the index and the offset columns are replaced, not written into
+        data = self.data.copy(deep=False)
         if isinstance(self.x_offset,timedelta):
-            self.data.index = self.data.apply(lambda row: self.applyTimedeltaOffset(row,self.x_offset), axis=1) # for x in self.data.index]
-            self.data.index.rename("timestart",inplace=True)
+            data.index = util.offsetIndex(data.index,self.x_offset).rename("timestart")
         elif self.x_offset != 0:
-            self.data["valor"] = self.data["valor"].shift(self.x_offset, axis = 0) 
-            self.data["tag"] = self.data["tag"].shift(self.x_offset, axis = 0) 
+            data["valor"] = data["valor"].shift(self.x_offset, axis = 0) 
+            data["tag"] = data["tag"].shift(self.x_offset, axis = 0) 
         if self.y_offset != 0:
-            self.data["valor"] = self.data["valor"] + self.y_offset
-    def regularize(self,timestart,timeend,time_interval,time_offset,interpolation_limit,inline=True,interpolate=False):
-        data = util.serieRegular(self.data,time_interval,timestart,timeend,time_offset,interpolation_limit=interpolation_limit,tag_column="tag",interpolate=interpolate)
+            data["valor"] = data["valor"] + self.y_offset
+        self.data = data
+    def regularize(self,timestart,timeend,time_interval,time_offset,interpolation_limit,inline=True,interpolate=False,time_grid=None,store=None):
+        """
+        regularizes data to time grid. If inline and store (ColumnarStore) is set, the regularized data is kept in the store
+        """
+        data = util.serieRegular(self.data,time_interval,timestart,timeend,time_offset,interpolation_limit=interpolation_limit,tag_column="tag",interpolate=interpolate,time_grid=time_grid)
         if inline:
             self.data = data
+            if store is not None:
+                self.setStore(store)
         else:
             return data
-    def fillNulls(self,other_data,fill_value=None,x_offset=0,y_offset=0,inline=False):
-        data = util.serieFillNulls(self.data,other_data,fill_value=fill_value,shift_by=x_offset,bias=y_offset,tag_column="tag")
+    def processIncremental(self,state : dict,time_grid : util.TimeGrid,interpolation_limit=None,interpolate=False,store : util.ColumnarStore=None) -> tuple:
+        """
+        runs removeOutliers, detectJumps, applyOffset, regularize and applyMovingAverage. regularize and applyMovingAverage are run only from the first step of time_grid that may differ from the previous run (see getChangeStart). The steps before are taken from state. The incremental moving average is computed with util.MovingAverage. Returns (new state, first processed step)
+
+        :param state: state returned by the previous run, or None to process the whole series
+        """
+        self.removeOutliers()
+        self.detectJumps()
+        self.applyOffset()
+        processed = self.data
+        start, context = self.getChangeStart(state,processed,time_grid) if state is not None else (0, None)
+        if start == 0:
+            regularized = util.serieRegular(processed,time_grid.time_interval,time_grid.timestart,time_grid.timeend,time_grid.time_offset,interpolation_limit=interpolation_limit,tag_column="tag",interpolate=interpolate,time_grid=time_grid)
+            data = util.serieMovingAverage(regularized,self.moving_average,tag_column="tag") if self.moving_average is not None else regularized
+        else:
+            previous = util.unpackDataFrame(state["regularized"])
+            if start < len(time_grid):
+                # the tail is regularized from the last valid observation before start, so that each step has the same neighbours as in the whole series
+                tail_grid = time_grid.slice(int(np.searchsorted(time_grid.values,context,"left")))
+                tail = util.serieRegular(processed[processed.index.asi8 >= context],time_grid.time_interval,time_grid.timestart,time_grid.timeend,time_grid.time_offset,interpolation_limit=interpolation_limit,tag_column="tag",interpolate=interpolate,time_grid=tail_grid)
+                tail = tail.iloc[start - (len(time_grid) - len(tail_grid)):]
+            else:
+                tail = previous.iloc[start:]
+            regularized = util.concatRegular(previous.iloc[:start],tail,time_grid)
+            if self.moving_average is not None:
+                # the moving average of a step reaches back one window: the window is seeded with the regularized steps before start and only the steps from start are averaged
+                moving_average = util.MovingAverage(self.moving_average)
+                if start < len(time_grid):
+                    window_start = int(np.searchsorted(time_grid.values,time_grid.values[start] - moving_average.window,"right"))
+                    moving_average.seed(time_grid.values[window_start:start],regularized["valor"].values[window_start:start])
+                averaged = util.serieMovingAverage(regularized.iloc[start:],self.moving_average,tag_column="tag",moving_average=moving_average)
+                data = util.concatRegular(util.unpackDataFrame(state["data"]).iloc[:start],averaged,time_grid)
+            else:
+                data = regularized
+        self.data = data
+        if store is not None:
+            self.setStore(store)
+        return {
+            "processed": util.packDataFrame(processed),
+            "regularized": util.packDataFrame(regularized),
+            "data": util.packDataFrame(data) if self.moving_average is not None else None
+        }, start
+    def getChangeStart(self,state : dict,processed : pandas.DataFrame,time_grid : util.TimeGrid) -> tuple:
+        """
+        returns (start, context). start is the first step of time_grid whose regularized value may differ from the previous run: the step before the last valid observation preceding the first changed observation (or the first new step of the grid), since regularize interpolates between neighbouring observations. context is the time (int64 nanoseconds) of the last valid observation before start. start is 0 if there is no valid observation before, and len(time_grid) if nothing changed
+
+        :param state: state returned by processIncremental in the previous run
+        :param processed: data after removeOutliers and applyOffset
+        """
+        length = len(state["regularized"]["index"]["values"])
+        change = util.firstChange(processed,util.unpackDataFrame(state["processed"]))
+        if length < len(time_grid):
+            change = time_grid.values[length] if change is None else min(change,time_grid.values[length])
+        if change is None:
+            return len(time_grid), None
+        if not processed.index.is_unique or not processed.index.is_monotonic_increasing:
+            return 0, None
+        valid = processed.index.asi8[processed["valor"].notna().values]
+        position = np.searchsorted(valid,change,"left")
+        if position == 0:
+            return 0, None
+        start = max(int(np.searchsorted(time_grid.values,valid[position - 1],"left")) - 1,0)
+        position = np.searchsorted(valid,time_grid.values[start],"left")
+        if start == 0 or position == 0:
+            return 0, None
+        return start, int(valid[position - 1])
+    def fillNulls(self,other_data,fill_value=None,x_offset=0,y_offset=0,inline=False,time_grid=None):
+        data = util.serieFillNulls(self.data,other_data,fill_value=fill_value,shift_by=x_offset,bias=y_offset,tag_column="tag",time_grid=time_grid)
         if inline:
             self.data = data
         else:
             return data
     def toCSV(self,include_series_id=False):
         if include_series_id:
-            data = self.data
+            # shallow copy: data may be the frame shared by the columnar store
+            data = self.data.copy(deep=False)
             data["series_id"] = self.series_id
-            return data.to_csv()
-        return self.data.to_csv()
+            return util.decodeTags(data).to_csv()
+        return util.decodeTags(self.data).to_csv()
     def toList(self,include_series_id=False,timeSupport=None,remove_nulls=False,max_obs_date:datetime=None):
-        data = self.data[self.data.index <= max_obs_date] if max_obs_date is not None else self.data.copy(deep=True)
+        data = util.decodeTags(self.data[self.data.index <= max_obs_date] if max_obs_date is not None else self.data.copy(deep=True))
         data["timestart"] = data.index
         data["timeend"] = [x + timeSupport for x in data["timestart"]] if timeSupport is not None else data["timestart"]
         data["timestart"] = [x.isoformat() for x in data["timestart"]]
@@ -148,15 +336,27 @@ class NodeSerieProno(NodeSerie):
         self.name = "cal_id: %i, %s" % (self.cal_id if self.cal_id is not None else 0, self.qualifier if self.qualifier is not None else "main")
         self.plot_params = params["plot_params"] if "plot_params" in params else None
         self.metadata = None
-    def loadData(self,timestart,timeend):
+    def loadData(self,timestart,timeend,cache=None):
+        """
+        Loads forecast data from a5 API. Forecasts are not cached: cache is ignored
+        """
         logging.debug("Load prono data for series_id: %i, cal_id: %i" % (self.series_id, self.cal_id))
-        self.metadata = a5.readSerieProno(self.series_id,self.cal_id,timestart,timeend,qualifier=self.qualifier)
-        if len(self.metadata["pronosticos"]):
+        self.setLoadedData(a5.readSerieProno(self.series_id,self.cal_id,timestart,timeend,qualifier=self.qualifier))
+    async def aloadData(self,timestart,timeend,client=None):
+        logging.debug("Async load prono data for series_id: %i, cal_id: %i" % (self.series_id, self.cal_id))
+        self.setLoadedData(await a5.aread_serie_prono(self.series_id,self.cal_id,timestart,timeend,qualifier=self.qualifier,client=client))
+    def setLoadedData(self,metadata):
+        self.metadata = metadata
+        if isinstance(self.metadata["pronosticos"],a5.ObservacionesArrays) and len(self.metadata["pronosticos"]):
+            self.data = self.metadata["pronosticos"].toDataFrame(tag="prono")
+        elif len(self.metadata["pronosticos"]):
             self.data = a5.observacionesListToDataFrame(self.metadata["pronosticos"],tag="prono")
         else:
             logging.warning("No data found for series_id=%i, cal_id=%i" % (self.series_id, self.cal_id))
             self.data = a5.createEmptyObsDataFrame()
-        self.original_data = self.data.copy(deep=True)
+        if "tag" in self.data.columns:
+            self.data["tag"] = util.encodeTags(self.data["tag"])
+        self.original_data = self.data
         del self.metadata["pronosticos"]
         self.metadata = NodeSeriePronoMetadata(self.metadata)
     def setData(self,data):
@@ -179,7 +379,7 @@ class NodeSeriePronoMetadata:
         }
 
 class DerivedNodeSerie:
-    def __init__(self,params,topology):
+    def __init__(self,params,topology=None):
         self.series_id = params["series_id"] if params["series_id"] else None
         if "derived_from" in params:
             self.derived_from = DerivedOrigin(params["derived_from"],topology)
@@ -190,14 +390,27 @@ class DerivedNodeSerie:
         else:
             self.interpolated_from = None
         self.data = None
-    def deriveTag(self,row,tag_column,tag="derived"):
-        if row[tag_column] is None:
-            return tag
-        else:
-            return "%s,%s" % (row[tag_column], tag)
-    def deriveOffsetIndex(self,row,x_offset):
-        return row.name + x_offset
-    def derive(self,keep_index=True):
+    def setOrigins(self,topology):
+        """
+        sets the origin variables of derived_from or interpolated_from from the nodes of topology
+        """
+        if self.derived_from is not None:
+            self.derived_from.setOrigin(topology)
+        if self.interpolated_from is not None:
+            self.interpolated_from.setOrigin(topology)
+    def getOrigins(self) -> list:
+        """
+        returns the origin variables of derived_from or interpolated_from
+        """
+        if self.derived_from is not None:
+            return [self.derived_from.origin]
+        if self.interpolated_from is not None:
+            return [self.interpolated_from.origin_1,self.interpolated_from.origin_2]
+        return []
+    def derive(self,keep_index=True,time_grid=None):
+        """
+        derives data from origin (derived_from or interpolated_from). If both origins of interpolated_from are aligned to time_grid, they are combined by position instead of by index join
+        """
         if self.derived_from is not None:
             logging.debug("Deriving %i from %s" % (self.series_id, self.derived_from.origin.name))
             if not len(self.derived_from.origin.data):
@@ -207,11 +420,11 @@ class DerivedNodeSerie:
             self.data = self.derived_from.origin.data[["valor","tag"]] # self.derived_from.origin.series[0].data[["valor",]]
             if isinstance(self.derived_from.x_offset,timedelta):
                 self.data["valor"] = self.data["valor"] + self.derived_from.y_offset
-                self.data.index = self.data.apply(lambda row: self.deriveOffsetIndex(row,self.derived_from.x_offset),axis=1)# for x in self.data.index]
-                self.data["tag"] = self.data.apply(lambda row: self.deriveTag(row,"tag"),axis=1) # ["derived" if x is None else "%s,derived" % x for x in self.data.tag]
+                self.data.index = util.offsetIndex(self.data.index,self.derived_from.x_offset)
+                self.data["tag"] = util.appendTag(self.data["tag"],"derived",missing="derived") # ["derived" if x is None else "%s,derived" % x for x in self.data.tag]
             else:
                 self.data["valor"] = self.data["valor"].shift(self.derived_from.x_offset, axis = 0) + self.derived_from.y_offset
-            self.data["tag"] = self.data.apply(lambda row: self.deriveTag(row,"tag"),axis=1) #["derived" if x is None else "%s,derived" % x for x in self.data.tag]
+            self.data["tag"] = util.appendTag(self.data["tag"],"derived",missing="derived") #["derived" if x is None else "%s,derived" % x for x in self.data.tag]
             if hasattr(self.derived_from.origin,"max_obs_date"):
                 self.max_obs_date = self.derived_from.origin.max_obs_date
         elif self.interpolated_from is not None:
@@ -221,16 +434,20 @@ class DerivedNodeSerie:
                 self.data = a5.createEmptyObsDataFrame()
                 return
             self.data = self.interpolated_from.origin_1.data[["valor","tag"]] # self.interpolated_from.origin_1.series[0].data[["valor",]]
-            self.data = self.data.join(self.interpolated_from.origin_2.data[["valor","tag"]],how='left',rsuffix="_other") # self.data.join(self.interpolated_from.origin_2.series[0].data[["valor",]],how='left',rsuffix="_other")
+            if time_grid is not None and time_grid.isAligned(self.data) and time_grid.isAligned(self.interpolated_from.origin_2.data):
+                self.data["valor_other"] = self.interpolated_from.origin_2.data["valor"].values
+                self.data["tag_other"] = self.interpolated_from.origin_2.data["tag"].values
+            else:
+                self.data = self.data.join(self.interpolated_from.origin_2.data[["valor","tag"]],how='left',rsuffix="_other") # self.data.join(self.interpolated_from.origin_2.series[0].data[["valor",]],how='left',rsuffix="_other")
             self.data["valor"] = self.data["valor"] * (1 - self.interpolated_from.interpolation_coefficient) + self.data["valor_other"] * self.interpolated_from.interpolation_coefficient
-            self.data["tag"] = self.data.apply(lambda row: self.deriveTag(row,"tag","interpolated"),axis=1) #["interpolated" if x is None else "%s,interpolated" % x for x in self.data.tag]
+            self.data["tag"] = util.appendTag(self.data["tag"],"interpolated",missing="interpolated") #["interpolated" if x is None else "%s,interpolated" % x for x in self.data.tag]
             del self.data["valor_other"]
             del self.data["tag_other"]
             if isinstance(self.interpolated_from.x_offset,timedelta):
                 if keep_index:
                     self.data = util.applyTimeOffsetToIndex(self.data,self.interpolated_from.x_offset)
                 else:
-                    self.data.index = self.data.apply(lambda row: self.deriveOffsetIndex(row,self.interpolated_from.x_offset),axis=1) # for x in self.data.index]
+                    self.data.index = util.offsetIndex(self.data.index,self.interpolated_from.x_offset)
             else:
                 self.data[["valor","tag"]] = self.data[["valor","tag"]].shift(self.interpolated_from.x_offset, axis = 0)    
             if hasattr(self.interpolated_from.origin_1,"max_obs_date"):
@@ -238,12 +455,12 @@ class DerivedNodeSerie:
             
     def toCSV(self,include_series_id=False):
         if include_series_id:
-            data = self.data
+            data = self.data.copy(deep=False)
             data["series_id"] = self.series_id
-            return data.to_csv()
-        return self.data.to_csv()
+            return util.decodeTags(data).to_csv()
+        return util.decodeTags(self.data).to_csv()
     def toList(self,include_series_id=False,timeSupport=None):
-        data = self.data
+        data = util.decodeTags(self.data)
         data["timestart"] = data.index
         data["timeend"] = [x + timeSupport for x in data["timestart"]] if timeSupport is not None else data["timestart"]
         data["timestart"] = [x.isoformat() for x in data["timestart"]]
@@ -274,14 +491,44 @@ class NodeVariable:
         self.interpolation_limit = params["interpolation_limit"] if "interpolation_limit" in params else None # in rows
         if self.interpolation_limit is not None and self.interpolation_limit <= 0:
             raise("Invalid interpolation_limit: must be greater than 0")
+        self.keep_original_data = node._topology.keep_original_data if node is not None and node._topology is not None else "eager"
         self.data = None
         self.original_data = None
         self.adjust_results = None
         self._node = node
         self.name = "%s_%s" % (self._node.name, self.id)
         self.time_interval = util.interval2timedelta(params["time_interval"]) if "time_interval" in params else self._node.time_interval
+    @property
+    def original_data(self):
+        """
+        snapshot of data taken at derive time (see NodeSerie.original_data)
+        """
+        if isinstance(self._original_data,util.DataSnapshot):
+            self.protectOriginalData()
+            return self._original_data.data
+        return self._original_data
+    @original_data.setter
+    def original_data(self,data):
+        self._original_data = takeSnapshot(data,self.keep_original_data)
+    def protectOriginalData(self):
+        """
+        copies the lazy original_data snapshots (of the variable and of its series) that view the current data. Must be called before mutating data in place
+        """
+        for snapshot in [self._original_data] + [getattr(serie,"_original_data",None) for serie in (getattr(self,"series",None) or []) + (getattr(self,"series_prono",None) or [])]:
+            if isinstance(snapshot,util.DataSnapshot) and snapshot.data is self.data:
+                snapshot.protect()
+    def setKeepOriginalData(self,keep_original_data):
+        """
+        sets keep_original_data of the variable and its series
+        """
+        self.keep_original_data = keep_original_data
+        for series in [self.series, self.series_prono, self.series_sim, self.series_output]:
+            if series is not None:
+                for serie in series:
+                    if isinstance(serie,NodeSerie):
+                        serie.keep_original_data = keep_original_data
     def getData(self,include_series_id=False):
-        data = self.data[["valor","tag"]] # self.concatenateProno(inline=False) if include_prono else self.data[["valor","tag"]] # self.series[0].data            
+        data = util.decodeTags(self.data[["valor","tag"]]) # self.concatenateProno(inline=False) if include_prono else self.data[["valor","tag"]] # self.series[0].data            
         if include_series_id:
             data["series_id"] = self.series_output.series_id if type(self.series_output) == NodeSerie else self.series_output[0].series_id if type(self.series_output) == list else None
         return data
@@ -307,7 +554,7 @@ class NodeVariable:
         """
         returns data of self.series_output as csv
         """
-        data = self.mergeOutputData()
+        data = util.decodeTags(self.mergeOutputData())
         return data.to_csv(header=include_header) # self.series[0].toCSV()
     def toSerie(self,include_series_id=False,use_node_id=False):
         """
@@ -324,7 +571,7 @@ class NodeVariable:
         """
         returns self.data as list of dict
         """
-        data = self.data[self.data.valor.notnull()].copy()
+        data = util.decodeTags(self.data[self.data.valor.notnull()].copy())
         data.loc[:,"timestart"] = data.index
         data.loc[:,"timeend"] = [x + self.time_support for x in data["timestart"]] if self.time_support is not None else data["timestart"]
         data.loc[:,"timestart"] = [x.isoformat() for x in data["timestart"]]
@@ -341,7 +588,7 @@ class NodeVariable:
             self.setOutputData()
         list = []
         for serie in self.series_output:
-            data = serie.data[serie.data.valor.notnull()].copy()
+            data = util.decodeTags(serie.data[serie.data.valor.notnull()].copy())
             #data.loc[:,"timestart"] = data.index.copy()
             data.reset_index(inplace=True)
             data["timeend"] = data["timestart"] + self.time_support if self.time_support is not None else data["timestart"].copy() # [x + self.time_support for x in data.loc[:,"timestart"]] if self.time_support is not None else data.loc[:,"timestart"].copy()
@@ -357,23 +604,25 @@ class NodeVariable:
     def adjust(self,plot=True,error_band=True):
         truth_data = self.series[self.adjust_from["truth"]].data
         sim_data = self.series[self.adjust_from["sim"]].data
-        self.series[self.adjust_from["sim"]].original_data = sim_data.copy(deep=True)
+        self.series[self.adjust_from["sim"]].original_data = sim_data
         try:
             adj_serie, tags, model = util.adjustSeries(sim_data,truth_data,method=self.adjust_from["method"],plot=plot,tag_column="tag",title=self.name)
         except ValueError:
             logging.warning("No observations found to estimate coefficients. Skipping adjust")
             return
         # self.series[self.adjust_from["sim"]].data["valor"] = adj_serie
+        self.protectOriginalData()
         self.data.loc[:,"valor"] = adj_serie
-        self.data.loc[:,"tag"] = tags
+        self.data["tag"] = tags
         self.adjust_results = model
         if error_band:
             self.data.loc[:,"error_band_01"] = adj_serie + self.adjust_results["quant_Err"][0.001]
             self.data.loc[:,"error_band_99"] = adj_serie + self.adjust_results["quant_Err"][0.999]     
     def apply_linear_combination(self,plot=True,series_index=0):
-        self.series[series_index].original_data = self.series[series_index].data.copy(deep=True)
+        self.series[series_index].original_data = self.series[series_index].data
+        self.protectOriginalData()
         #self.series[series_index].data.loc[:,"valor"] = util.linearCombination(self.pivotData(),self.linear_combination,plot=plot)
-        self.data.loc[:,"valor"],  self.data.loc[:,"tag"] = util.linearCombination(self.pivotData(),self.linear_combination,plot=plot,tag_column="tag")
+        self.data.loc[:,"valor"], self.data["tag"] = util.linearCombination(self.pivotData(),self.linear_combination,plot=plot,tag_column="tag")
     def applyMovingAverage(self):
         for serie in self.series:
             if isinstance(serie,NodeSerie) and serie.moving_average is not None:
@@ -391,36 +640,42 @@ class NodeVariable:
                 logging.warning("No observations found to estimate coefficients. Skipping adjust")
                 return
             # self.series[self.adjust_from["sim"]].data["valor"] = adj_serie
-            serie_prono.data.loc[:,"valor"] = adj_serie
-            serie_prono.data.loc[:,"tag"] = tags
+            # shallow copy with replaced columns: serie_prono.data may be the frame shared by the columnar store
+            data = serie_prono.data.copy(deep=False)
+            data["valor"] = adj_serie
+            data["tag"] = tags
             serie_prono.adjust_results = model
             if error_band:
-                serie_prono.data.loc[:,"error_band_01"] = adj_serie + serie_prono.adjust_results["quant_Err"][0.001]
-                serie_prono.data.loc[:,"error_band_99"] = adj_serie + serie_prono.adjust_results["quant_Err"][0.999]     
+                data["error_band_01"] = adj_serie + serie_prono.adjust_results["quant_Err"][0.001]
+                data["error_band_99"] = adj_serie + serie_prono.adjust_results["quant_Err"][0.999]
+            serie_prono.data = data
     def setOutputData(self):
         if self.series_output is not None:
             for serie in self.series_output:
                 serie.data = self.data[["valor","tag"]]
                 serie.applyOffset()
-    def uploadData(self,include_prono=False):
+    def getUploadTasks(self,include_prono=False):
         """
-        Uploads series_output to a5 API
+        returns list of upload tasks (serie, obs_list) of series_output
         """
-        if self.series_output is not None:
-            if self.series_output[0].data is None:
-                self.setOutputData()
-            obs_created = []
-            for serie in self.series_output:
-                obs_list = serie.toList(remove_nulls=True,max_obs_date=None if include_prono else self.max_obs_date if hasattr(self,"max_obs_date") else None) # include_series_id=True)
-                try:
-                    created = a5.createObservaciones(obs_list,series_id=serie.series_id)
-                    obs_created.extend(created)
-                except Exception as e:
-                    logging.error(str(e))
-            return obs_created
-        else:
+        if self.series_output is None:
             logging.warning("Missing output series for node #%i, variable %i, skipping upload" % (self._node.id,self.id))
             return []
+        if self.series_output[0].data is None:
+            self.setOutputData()
+        return [(serie, serie.toList(remove_nulls=True,max_obs_date=None if include_prono else self.max_obs_date if hasattr(self,"max_obs_date") else None)) for serie in self.series_output] # include_series_id=True)
+    def uploadData(self,include_prono=False,chunk_size=None,chunk_retries=0):
+        """
+        Uploads series_output to a5 API
+        """
+        obs_created = []
+        for serie, obs_list in self.getUploadTasks(include_prono):
+            try:
+                created = a5.createObservaciones(obs_list,series_id=serie.series_id,tipo=serie.type,chunk_size=chunk_size,chunk_retries=chunk_retries)
+                obs_created.extend(created)
+            except Exception as e:
+                logging.error(str(e))
+        return obs_created
     def pivotData(self,include_prono=True):
         data = self.series[0].data[["valor",]]
         for serie in self.series:
@@ -491,6 +746,7 @@ class NodeVariable:
         logging.info("interpolation limit:%s" % str(interpolation_limit))
         if interpolation_limit is not None and interpolation_limit <= 0:
             return
+        self.protectOriginalData()
         self.data = util.interpolateData(self.data,column="valor",tag_column="tag",interpolation_limit=interpolation_limit,extrapolate=extrapolate)
     def saveData(self,output,format="csv"): #,include_prono=False):
         """
@@ -498,9 +754,9 @@ class NodeVariable:
         """
         # data = self.concatenateProno(inline=False) if include_prono else self.data
         if format=="csv":
-            return self.data.to_csv(output)
+            return util.decodeTags(self.data).to_csv(output)
         else:
-            return json.dump(self.data.to_dict(orient="records"),output)
+            return json.dump(util.decodeTags(self.data).to_dict(orient="records"),output)
     def plot(self):
         data = self.data[["valor",]]
         pivot_series = self.pivotData()
@@ -545,31 +801,30 @@ class ObservedNodeVariable(NodeVariable):
         super().__init__(params,node=node)
         self.series = [NodeSerie(x) for x in params["series"]]
         self.series_prono = [NodeSerieProno(x) for x in params["series_prono"]] if "series_prono" in params else None
-    def loadData(self,timestart,timeend,include_prono=True,forecast_timeend=None):
-        logging.debug("Load data for observed node: %i" % (self.id))
+        self.setKeepOriginalData(self.keep_original_data)
+    def getLoadTasks(self,timestart,timeend,include_prono=True,forecast_timeend=None):
+        """
+        returns list of load tasks (serie, timestart, timeend, error message) in order of priority
+        """
+        tasks = []
         if self.series is not None:
             for serie in self.series:
-                try:
-                    serie.loadData(timestart,timeend)
-                except Exception as e:
-                    raise "Node %s, Variable: %i, series_id %i: failed loadData: %s" % (self._node.id,self.id,serie.series_id,str(e))
-        elif self.derived_from is not None:
-            self.series = []
-            # self.series[0] = util.se
+                tasks.append((serie,timestart,timeend,"Node %s, Variable: %i, series_id %i: failed loadData" % (str(self._node.id),self.id,serie.series_id)))
         if include_prono and self.series_prono is not None and len(self.series_prono):
             for serie in self.series_prono:
-                if forecast_timeend is not None:
-                    try:
-                        serie.loadData(timestart,forecast_timeend)
-                    except Exception as e:
-                        raise "Node %s, Variable: %i, series_id %i, cal_id %: failed loadData: %s" % (self._node.id,self.id,serie.series_id,serie.cal_id,str(e))
-                else:
-                    try:
-                        serie.loadData(timestart,timeend)
-                    except Exception as e:
-                        raise "Node %s, Variable: %i, series_id %i, cal_id %: failed loadData: %s" % (self._node.id,self.id,serie.series_id,serie.cal_id,str(e))
-        if self.data is None and len(self.series):
+                tasks.append((serie,timestart,forecast_timeend if forecast_timeend is not None else timeend,"Node %s, Variable: %i, series_id %i, cal_id %s: failed loadData" % (str(self._node.id),self.id,serie.series_id,str(serie.cal_id))))
+        return tasks
+    def setDataFromSeries(self):
+        if self.data is None and self.series is not None and len(self.series):
             self.data = self.series[0].data
+    def loadData(self,timestart,timeend,include_prono=True,forecast_timeend=None,cache=None):
+        logging.debug("Load data for observed node: %i" % (self.id))
+        for serie, task_timestart, task_timeend, error_message in self.getLoadTasks(timestart,timeend,include_prono,forecast_timeend):
+            try:
+                serie.loadData(task_timestart,task_timeend,cache=cache)
+            except Exception as e:
+                raise Exception("%s: %s" % (error_message,str(e)))
+        self.setDataFromSeries()
     def removeOutliers(self):
         found_outliers = False
         for serie in self.series:
@@ -586,14 +841,20 @@ class ObservedNodeVariable(NodeVariable):
         for serie in self.series:
             serie.applyOffset()
     def regularize(self,interpolate=False):
+        time_grid = self._node.getTimeGrid()
+        store = self._node.getColumnarStore(time_grid)
         for serie in self.series:
-            serie.regularize(self._node.timestart,self._node.timeend,self._node.time_interval,self._node.time_offset,self.interpolation_limit,interpolate=interpolate)
+            serie.regularize(self._node.timestart,self._node.timeend,self._node.time_interval,self._node.time_offset,self.interpolation_limit,interpolate=interpolate,time_grid=time_grid,store=store)
+        self.regularizeProno(interpolate=interpolate)
+    def regularizeProno(self,interpolate=False):
         if self.series_prono is not None:
+            forecast_time_grid = self._node.getTimeGrid(forecast=True)
+            forecast_store = self._node.getColumnarStore(forecast_time_grid)
             for serie in self.series_prono:
                 if self._node.forecast_timeend is not None:
-                    serie.regularize(self._node.timestart,self._node.forecast_timeend,self._node.time_interval,self._node.time_offset,self.interpolation_limit,interpolate=interpolate)
+                    serie.regularize(self._node.timestart,self._node.forecast_timeend,self._node.time_interval,self._node.time_offset,self.interpolation_limit,interpolate=interpolate,time_grid=forecast_time_grid,store=forecast_store)
                 else:
-                    serie.regularize(self._node.timestart,self._node.timeend,self._node.time_interval,self._node.time_offset,self.interpolation_limit,interpolate=interpolate)
+                    serie.regularize(self._node.timestart,self._node.timeend,self._node.time_interval,self._node.time_offset,self.interpolation_limit,interpolate=interpolate,time_grid=forecast_time_grid,store=forecast_store)
     def fillNulls(self,inline=True,fill_value=None):
         """
         Copies data of first series and fills its null values with the other series
@@ -601,20 +862,138 @@ class ObservedNodeVariable(NodeVariable):
         If inline=True, saves result in self.data
         """
         fill_value = fill_value if fill_value is not None else self.fill_value
-        data = self.series[0].data[["valor","tag"]]
-        if len(self.series) > 1:
-            i = 2
-            for serie in self.series[1:]:
-                # if last, fills  
-                fill_value_this = fill_value if i == len(self.series) else None 
-                data = util.serieFillNulls(data,serie.data,fill_value=fill_value_this,tag_column="tag")
-                i = i + 1
-        else:
-            logging.warning("No other series to fill nulls with")
+        data = coalesceNodeSeries([serie.data for serie in self.series],fill_value=fill_value,time_grid=self._node.getTimeGrid())
         if inline:
             self.data = data
         else:
             return data
+    def getStateFingerprint(self,interpolate=False) -> dict:
+        """
+        returns the parameters the processed state of the variable depends on (see processSeriesIncremental)
+        """
+        return {
+            "series": [serie.getProcessParams() for serie in self.series],
+            "time_interval": self._node.time_interval,
+            "time_offset": self._node.time_offset,
+            "interpolation_limit": self.interpolation_limit,
+            "interpolate": interpolate,
+            "fill_value": self.fill_value
+        }
+    def processSeriesIncremental(self,state_cache : StateCache,key : str,interpolate=False) -> int:
+        """
+        runs removeOutliers, detectJumps, applyOffset, regularize, applyMovingAverage and fillNulls, processing only the steps of the time grid that may differ from the state saved in state_cache by the previous run (see NodeSerie.processIncremental), and saves the new state. The result is the same as running the stages. The state is discarded if the parameters of the variable changed or if the grid doesn't extend the previous one (i.e. timestart moved)
+
+        :param state_cache: state store
+        :param key: key of the variable in state_cache
+        :returns: first processed step
+        """
+        time_grid = self._node.getTimeGrid()
+        store = self._node.getColumnarStore(time_grid)
+        fingerprint = self.getStateFingerprint(interpolate)
+        state = state_cache.read(key)
+        if state is not None and (state["fingerprint"] != fingerprint or len(state["grid"]) > len(time_grid) or not np.array_equal(state["grid"],time_grid.values[:len(state["grid"])])):
+            logging.debug("State of variable %s doesn't match, processing the whole series" % self.name)
+            state = None
+        series_states = []
+        start = len(time_grid)
+        for i, serie in enumerate(self.series):
+            serie_state, serie_start = serie.processIncremental(state["series"][i] if state is not None else None,time_grid,self.interpolation_limit,interpolate=interpolate,store=store)
+            series_states.append(serie_state)
+            start = min(start,serie_start)
+        self.regularizeProno(interpolate=interpolate)
+        if state is None or start == 0:
+            self.data = coalesceNodeSeries([serie.data for serie in self.series],fill_value=self.fill_value,time_grid=time_grid)
+        else:
+            previous = util.unpackDataFrame(state["data"])
+            # coalesce is computed step by step, so only the processed steps are coalesced again
+            tail = coalesceNodeSeries([serie.data.iloc[start:] for serie in self.series],fill_value=self.fill_value,time_grid=time_grid.slice(start)) if start < len(time_grid) else previous.iloc[start:]
+            self.data = util.concatRegular(previous.iloc[:start],tail,time_grid)
+        logging.debug("Variable %s: processed %i of %i steps" % (self.name,len(time_grid) - start,len(time_grid)))
+        state_cache.write(key,{
+            "fingerprint": fingerprint,
+            "grid": time_grid.values,
+            "series": series_states,
+            "data": util.packDataFrame(self.data)
+        })
+        return start
+    def getProcessPayload(self) -> dict:
+        """
+        returns the series data (as arrays, see util.packDataFrame) and the parameters needed to run removeOutliers, detectJumps, applyOffset, regularize, applyMovingAverage and fillNulls of the variable in a worker process (see processVariableSeries)
+        """
+        return {
+            "series": [(serie.getProcessParams(),util.packDataFrame(serie.data)) for serie in self.series],
+            "series_prono": [util.packDataFrame(serie.data) for serie in self.series_prono] if self.series_prono is not None else None,
+            "timestart": self._node.timestart,
+            "timeend": self._node.timeend,
+            "forecast_timeend": self._node.forecast_timeend,
+            "time_interval": self._node.time_interval,
+            "time_offset": self._node.time_offset,
+            "interpolation_limit": self.interpolation_limit,
+            "fill_value": self.fill_value
+        }
+    def setProcessResult(self,result : dict):
+        """
+        sets the data of the series and of the variable returned by processVariableSeries, as the processing stages would
+        """
+        time_grid = self._node.getTimeGrid()
+        store = self._node.getColumnarStore(time_grid)
+        for serie, serie_result in zip(self.series,result["series"]):
+            serie.outliers_data = util.unpackDataFrame(serie_result["outliers_data"])
+            serie.jumps_data = util.unpackDataFrame(serie_result["jumps_data"])
+            serie.data = util.unpackDataFrame(serie_result["data"],time_grid)
+            if store is not None:
+                serie.setStore(store)
+        if self.series_prono is not None:
+            forecast_time_grid = self._node.getTimeGrid(forecast=True)
+            forecast_store = self._node.getColumnarStore(forecast_time_grid)
+            for serie, serie_result in zip(self.series_prono,result["series_prono"]):
+                serie.data = util.unpackDataFrame(serie_result,forecast_time_grid)
+                if forecast_store is not None:
+                    serie.setStore(forecast_store)
+        self.data = util.unpackDataFrame(result["data"],time_grid)
+
+def coalesceNodeSeries(data : list,fill_value=None,time_grid : util.TimeGrid=None) -> pandas.DataFrame:
+    """
+    returns the data of the first series with its nulls filled with the data of the other series, by priority, and then with fill_value (see ObservedNodeVariable.fillNulls)
+    """
+    if len(data) > 1:
+        # coalesces all series by priority in a single pass. If last, fills
+        return util.coalesceSeries(data,fill_value=fill_value,tag_column="tag",time_grid=time_grid)
+    logging.warning("No other series to fill nulls with")
+    return data[0][["valor","tag"]]
+
+def processVariableSeries(payload : dict) -> dict:
+    """
+    runs removeOutliers, detectJumps, applyOffset, regularize and applyMovingAverage of the series of an observed variable, and fillNulls, in a worker process (see Topology.processes). payload is returned by ObservedNodeVariable.getProcessPayload and the result is read by ObservedNodeVariable.setProcessResult. Both are made of arrays, so that nodes are not pickled
+    """
+    time_grid = util.TimeGrid(payload["timestart"],payload["timeend"],payload["time_interval"],payload["time_offset"])
+    series = []
+    for params, data in payload["series"]:
+        serie = NodeSerie({"series_id": params["series_id"]})
+        for key, value in params.items():
+            setattr(serie,key,value)
+        serie.data = util.unpackDataFrame(data)
+        serie.removeOutliers()
+        serie.detectJumps()
+        serie.applyOffset()
+        serie.regularize(payload["timestart"],payload["timeend"],payload["time_interval"],payload["time_offset"],payload["interpolation_limit"],time_grid=time_grid)
+        serie.applyMovingAverage()
+        series.append(serie)
+    series_prono = None
+    if payload["series_prono"] is not None:
+        timeend = payload["forecast_timeend"] if payload["forecast_timeend"] is not None else payload["timeend"]
+        forecast_time_grid = util.TimeGrid(payload["timestart"],timeend,payload["time_interval"],payload["time_offset"])
+        series_prono = []
+        for data in payload["series_prono"]:
+            serie = NodeSerie({"series_id": None})
+            serie.data = util.unpackDataFrame(data)
+            serie.regularize(payload["timestart"],timeend,payload["time_interval"],payload["time_offset"],payload["interpolation_limit"],time_grid=forecast_time_grid)
+            series_prono.append(util.packDataFrame(serie.data))
+    return {
+        "series": [{"data": util.packDataFrame(serie.data), "outliers_data": util.packDataFrame(serie.outliers_data), "jumps_data": util.packDataFrame(serie.jumps_data)} for serie in series],
+        "series_prono": series_prono,
+        "data": util.packDataFrame(coalesceNodeSeries([serie.data for serie in series],fill_value=payload["fill_value"],time_grid=time_grid))
+    }
 
 class DerivedNodeVariable(NodeVariable):
     def __init__(self,params,node=None):
@@ -624,22 +1003,39 @@ class DerivedNodeVariable(NodeVariable):
             if self.series_output is None:
                 raise Exception("missing series_output for derived node %s variable %s" % (str(self._node.id),str(self.id)))
             for serie in self.series_output:
-                self.series.append(DerivedNodeSerie({"series_id":serie.series_id, "derived_from": params["derived_from"]},self._node._topology))
+                self.series.append(DerivedNodeSerie({"series_id":serie.series_id, "derived_from": params["derived_from"]}))
         elif "interpolated_from" in params:
             if self.series_output is None:
                 raise Exception("missing series_output for derived node %s variable %s" % (str(self._node.id),str(self.id)))
             for serie in self.series_output:
-                self.series.append(DerivedNodeSerie({"series_id":serie.series_id, "interpolated_from": params["interpolated_from"]},self._node._topology))
+                self.series.append(DerivedNodeSerie({"series_id":serie.series_id, "interpolated_from": params["interpolated_from"]}))
         if "series" in params:
             self.series.extend([NodeSerie(x) for x in params["series"]])
         if "series_prono" in params:
             self.series_prono = [NodeSerieProno(x) for x in params["series_prono"]]
         else:
             self.series_prono = None
+        self.setKeepOriginalData(self.keep_original_data)
+    def setOrigins(self,topology):
+        """
+        sets the origin variables of the derived series from the nodes of topology. Origins are resolved once all the nodes of the topology are created, so that they may be defined in any order
+        """
+        for serie in self.series:
+            if isinstance(serie,DerivedNodeSerie):
+                serie.setOrigins(topology)
+    def getOrigins(self) -> list:
+        """
+        returns the variables this variable derives or interpolates from
+        """
+        origins = []
+        for serie in self.series:
+            if isinstance(serie,DerivedNodeSerie):
+                origins.extend(serie.getOrigins())
+        return list(dict.fromkeys(origins))
     def derive(self):
-        self.series[0].derive()
+        self.series[0].derive(time_grid=self._node.getTimeGrid())
         self.data = self.series[0].data
-        self.original_data = self.data.copy(deep=True)
+        self.original_data = self.data
         if hasattr(self.series[0],"max_obs_date"):
             self.max_obs_date = self.series[0].max_obs_date
        
@@ -667,6 +1063,21 @@ class Node:
         if "variables" in params:
             for variable in params["variables"]:
                 self.variables[variable["id"]] = DerivedNodeVariable(variable,self) if "derived" in variable and variable["derived"] == True else ObservedNodeVariable(variable,self)
+    def getTimeGrid(self,forecast=False):
+        """
+        returns the regular time grid of the node (from timestart to timeend, or to forecast_timeend if forecast=True and forecast_timeend is set), shared with the other nodes of the topology with equal time_interval and time_offset
+        """
+        timeend = self.forecast_timeend if forecast and self.forecast_timeend is not None else self.timeend
+        if self._topology is not None:
+            return self._topology.getTimeGrid(self.time_interval,self.time_offset,self.timestart,timeend)
+        return util.TimeGrid(self.timestart,timeend,self.time_interval,self.time_offset)
+    def getColumnarStore(self,time_grid : util.TimeGrid):
+        """
+        returns the columnar store of the topology for time_grid, or None if columnar storage is disabled
+        """
+        if self._topology is not None:
+            return self._topology.getColumnarStore(time_grid)
+        return None
     def createDatetimeIndex(self):
         return util.createDatetimeSequence(None, self.time_interval, self.timestart, self.timeend, self.time_offset)
     def toCSV(self,include_series_id=False,include_header=True):
@@ -684,7 +1095,7 @@ class Node:
         data = a5.createEmptyObsDataFrame(extra_columns={"tag":"str"})
         for variable in self.variables.values():
             data = data.join(variable.mergeOutputData())
-        return data.to_csv(header=include_header) # self.series[0].toCSV()
+        return util.decodeTags(data).to_csv(header=include_header) # self.series[0].toCSV()
     def variablesToSeries(self,include_series_id=False,use_node_id=False):
         """
         return node variables as array of Series objects using self.variables.data as observaciones
@@ -713,9 +1124,25 @@ class Node:
     def setOutputData(self):
         for variable in self.variables.values():
             variable.setOutputData()
-    def uploadData(self,include_prono=False):
+    def uploadData(self,include_prono=False,chunk_size=None,chunk_retries=0):
+        created = []
+        for variable in self.variables.values():
+            created.extend(variable.uploadData(include_prono=include_prono,chunk_size=chunk_size,chunk_retries=chunk_retries))
+        return created
+    def getUploadTasks(self,include_prono=False):
+        tasks = []
         for variable in self.variables.values():
-            variable.uploadData(include_prono=include_prono)
+            tasks.extend(variable.getUploadTasks(include_prono=include_prono))
+        return tasks
+    def outputToList(self,flatten=True):
+        """
+        returns series_output of the variables as list of dict (see NodeVariable.outputToList). Variables without series_output are skipped
+        """
+        output = []
+        for variable in self.variables.values():
+            if variable.series_output is not None and variable.data is not None:
+                output.extend(variable.outputToList(flatten=flatten))
+        return output
     def pivotData(self,include_prono=True):
         data = a5.createEmptyObsDataFrame()
         for variable in self.variables.values():
@@ -758,10 +1185,20 @@ class Node:
     def plotProno(self,output_dir=None,figsize=None,title=None,markersize=None,obs_label=None,tz=None,prono_label=None,footnote=None,errorBandLabel=None,obsLine=None,prono_annotation=None,obs_annotation=None,forecast_date_annotation=None,ylim=None,station_name=None,ydisplay=None,text_xoffset=None,xytext=None,datum_template_string=None,title_template_string=None,x_label=None,y_label=None,xlim=None):
         for variable in self.variables.values():
             variable.plotProno(output_dir=output_dir,figsize=figsize,title=title,markersize=markersize,obs_label=obs_label,tz=tz,prono_label=prono_label,footnote=footnote,errorBandLabel=errorBandLabel,obsLine=obsLine,prono_annotation=prono_annotation,obs_annotation=obs_annotation,forecast_date_annotation=forecast_date_annotation,ylim=ylim,station_name=station_name,ydisplay=ydisplay,text_xoffset=text_xoffset,xytext=xytext,datum_template_string=datum_template_string,title_template_string=title_template_string,x_label=x_label,y_label=y_label,xlim=xlim)
-    def loadData(self,timestart,timeend,include_prono=True,forecast_timeend=None):
+    def loadData(self,timestart,timeend,include_prono=True,forecast_timeend=None,cache=None):
+        for variable in self.variables.values():
+            if isinstance(variable,ObservedNodeVariable):
+                variable.loadData(timestart,timeend,include_prono,forecast_timeend,cache=cache)
+    def getLoadTasks(self,timestart,timeend,include_prono=True,forecast_timeend=None):
+        tasks = []
         for variable in self.variables.values():
             if isinstance(variable,ObservedNodeVariable):
-                variable.loadData(timestart,timeend,include_prono,forecast_timeend)
+                tasks.extend(variable.getLoadTasks(timestart,timeend,include_prono,forecast_timeend))
+        return tasks
+    def setDataFromSeries(self):
+        for variable in self.variables.values():
+            if isinstance(variable,ObservedNodeVariable):
+                variable.setDataFromSeries()
     def removeOutliers(self):
         found_outliers = False
         for variable in self.variables.values():
@@ -788,6 +1225,10 @@ class Node:
         for variable in self.variables.values():
             if isinstance(variable,ObservedNodeVariable):
                 variable.fillNulls(inline,fill_value)
+    def setOrigins(self,topology):
+        for variable in self.variables.values():
+            if isinstance(variable,DerivedNodeVariable):
+                variable.setOrigins(topology)
     def derive(self):
         for variable in self.variables.values():
             if isinstance(variable,DerivedNodeVariable):
@@ -795,6 +1236,20 @@ class Node:
     def applyMovingAverage(self):
         for variable in self.variables.values():
             variable.applyMovingAverage()
+    def submitProcessSeries(self,executor : ProcessPoolExecutor) -> dict:
+        """
+        submits the processing of the series of the observed variables (removeOutliers to fillNulls, see processVariableSeries) to executor. Returns futures by variable id
+        """
+        return {variable.id: executor.submit(processVariableSeries,variable.getProcessPayload()) for variable in self.variables.values() if isinstance(variable,ObservedNodeVariable)}
+    def setProcessResults(self,futures : dict):
+        """
+        waits for the futures returned by submitProcessSeries and sets their results. Moving averages of derived variables are applied here
+        """
+        for variable in self.variables.values():
+            if variable.id in futures:
+                variable.setProcessResult(futures[variable.id].result())
+            else:
+                variable.applyMovingAverage()
 
 class DerivedOrigin:
     def __init__(self,params,topology=None):
@@ -802,15 +1257,18 @@ class DerivedOrigin:
         self.var_id = params["var_id"]
         self.x_offset = util.interval2timedelta(params["x_offset"]) if isinstance(params["x_offset"],dict) else params["x_offset"]
         self.y_offset = params["y_offset"]
+        self.origin = None
         if topology is not None:
-            from_nodes = [x for x in topology.nodes if x.id == self.node_id]
-            if not len(from_nodes):
-                raise Exception("origin node not found for derived variable, id: %i" % self.node_id)
-            if self.var_id not in from_nodes[0].variables:
-                raise Exception("origin variable not found for derived variable, node:id; %i, var_id: %i" % (self.node_id,self.var_id))
-            self.origin = from_nodes[0].variables[self.var_id]
-        else:
-            self.origin = None
+            self.setOrigin(topology)
+    def setOrigin(self,topology):
+        """
+        sets origin from the nodes of topology
+        """
+        if topology.getNode(self.node_id) is None:
+            raise Exception("origin node not found for derived variable, id: %i" % self.node_id)
+        self.origin = topology.getVariable(self.node_id,self.var_id)
+        if self.origin is None:
+            raise Exception("origin variable not found for derived variable, node:id; %i, var_id: %i" % (self.node_id,self.var_id))
 
 class InterpolatedOrigin:
     def __init__(self,params,topology=None):
@@ -821,22 +1279,24 @@ class InterpolatedOrigin:
         self.x_offset = {"hours":0} if "x_offset" not in params else util.interval2timedelta(params["x_offset"]) if isinstance(params["x_offset"],dict) else params["x_offset"]
         self.y_offset = params["y_offset"] if "y_offset" in params else 0
         self.interpolation_coefficient = params["interpolation_coefficient"]
+        self.origin_1 = None
+        self.origin_2 = None
         if topology is not None:
-            from_nodes = [x for x in topology.nodes if x.id == self.node_id_1]
-            if not len(from_nodes):
-                raise Exception("origin node not found for interpolated variable, id: %i" % self.interpolated_from.node_id_1)
-            if self.var_id_1 not in from_nodes[0].variables:
-                raise Exception("origin variable not found for interpolated variable, node:id; %i, var_id: %i" % (self.node_id_1,self.var_id_1))
-            self.origin_1 = from_nodes[0].variables[self.var_id_1]
-            from_nodes = [x for x in topology.nodes if x.id == self.node_id_2]
-            if not len(from_nodes):
-                raise Exception("origin node not found for interpolated node, id: %i" % self.node_id_2)
-            if self.var_id_2 not in from_nodes[0].variables:
-                raise Exception("origin variable not found for interpolated variable, node:id; %i, var_id: %i" % (self.node_id_2,self.var_id_2))
-            self.origin_2 = from_nodes[0].variables[self.var_id_2]
-        else:
-            self.origin_1 = None
-            self.origin_2 = None
+            self.setOrigin(topology)
+    def setOrigin(self,topology):
+        """
+        sets origin_1 and origin_2 from the nodes of topology
+        """
+        if topology.getNode(self.node_id_1) is None:
+            raise Exception("origin node not found for interpolated variable, id: %i" % self.node_id_1)
+        self.origin_1 = topology.getVariable(self.node_id_1,self.var_id_1)
+        if self.origin_1 is None:
+            raise Exception("origin variable not found for interpolated variable, node:id; %i, var_id: %i" % (self.node_id_1,self.var_id_1))
+        if topology.getNode(self.node_id_2) is None:
+            raise Exception("origin node not found for interpolated node, id: %i" % self.node_id_2)
+        self.origin_2 = topology.getVariable(self.node_id_2,self.var_id_2)
+        if self.origin_2 is None:
+            raise Exception("origin variable not found for interpolated variable, node:id; %i, var_id: %i" % (self.node_id_2,self.var_id_2))
 
 # class BordeSetIterator:
 #     def __init__(self,borde_set):
@@ -864,61 +1324,392 @@ class Topology():
         if self.timestart >= self.timeend:
             raise("Bad timestart, timeend parameters. timestart must be before timeend")
         self.interpolation_limit = None if "interpolation_limit" not in params else util.interval2timedelta(params["interpolation_limit"]) if isinstance(params["interpolation_limit"],dict) else params["interpolation_limit"]
+        self.time_grids = {}
+        self.columnar_storage = params["columnar_storage"] if "columnar_storage" in params else False
+        self.columnar_stores = {}
+        self.keep_original_data = params["keep_original_data"] if "keep_original_data" in params else "eager"
+        self.scheduler = params["scheduler"] if "scheduler" in params else "stages"
+        self.processes = params["processes"] if "processes" in params else None
+        self._lock = threading.Lock()
         self.nodes = []
+        self.node_index = {}
+        self.variable_index = {}
         for node in params["nodes"]:
-            self.nodes.append(Node(params=node,timestart=self.timestart,timeend=self.timeend,forecast_timeend=self.forecast_timeend,plan=plan,time_offset=self.time_offset_start,topology=self))
+            self.addNode(node,plan=plan,set_origins=False)
+        # variable metadata read by the nodes is written to the metadata cache store once
+        a5.metadata_cache.flush()
+        self.setOrigins()
         self.cal_id = params["cal_id"] if "cal_id" in params else None
         self.plot_params = params["plot_params"] if "plot_params" in params else None
         self.report_file = params["report_file"] if "report_file" in params else None 
-    def addNode(self,node,plan=None):
-        self.nodes.append(Node(params=node,timestart=self.timestart,timeend=self.timeend,forecast_timeend=self.forecast_timeend,plan=plan,time_offset=self.time_offset_start,topology=self))
-    def batchProcessInput(self,include_prono=False):
+        self.max_workers = params["max_workers"] if "max_workers" in params else None
+        self.batch_size = params["batch_size"] if "batch_size" in params else None
+        self.upload_chunk_size = params["upload_chunk_size"] if "upload_chunk_size" in params else None
+        self.upload_chunk_retries = params["upload_chunk_retries"] if "upload_chunk_retries" in params else 0
+        self.upload_summary = None
+        self.obs_cache = ObservacionesCache(
+            path = os.path.join(os.environ["PYDRODELTA_DIR"],params["obs_cache"]["path"]),
+            ttl = util.interval2timedelta(params["obs_cache"]["ttl"]) if "ttl" in params["obs_cache"] else None,
+            refresh_window = util.interval2timedelta(params["obs_cache"]["refresh_window"]) if "refresh_window" in params["obs_cache"] else None
+        ) if "obs_cache" in params else None
+        self.state_cache = StateCache(
+            path = os.path.join(os.environ["PYDRODELTA_DIR"],params["state_cache"]["path"])
+        ) if "state_cache" in params else None
+        if self.state_cache is not None and self.obs_cache is None:
+            logging.warning("state_cache is set without obs_cache: observed series are downloaded entirely on each run")
+    def getTimeGrid(self,time_interval : timedelta,time_offset : timedelta=None,timestart=None,timeend=None) -> util.TimeGrid:
+        """
+        returns the regular time grid for (time_interval, time_offset), from timestart (default self.timestart) to timeend (default self.timeend). Grids are created once and shared by all nodes
+        """
+        timestart = timestart if timestart is not None else self.timestart
+        timeend = timeend if timeend is not None else self.timeend
+        key = (time_interval,time_offset,timestart,timeend)
+        with self._lock:
+            if key not in self.time_grids:
+                self.time_grids[key] = util.TimeGrid(timestart,timeend,time_interval,time_offset)
+            return self.time_grids[key]
+    def getColumnarStore(self,time_grid : util.TimeGrid) -> util.ColumnarStore:
+        """
+        returns the columnar store of regularized series for time_grid, or None if self.columnar_storage is False
+        """
+        if not self.columnar_storage:
+            return None
+        with self._lock:
+            if time_grid not in self.columnar_stores:
+                self.columnar_stores[time_grid] = util.ColumnarStore(time_grid)
+            return self.columnar_stores[time_grid]
+    def addNode(self,node,plan=None,set_origins=True):
+        """
+        creates a Node from params node, appends it to self.nodes and adds it to the node and variable indexes. If a node with the same id already exists, lookups keep returning the first one
+
+        :param node: node params
+        :type node: dict
+        :param set_origins: if True, sets the origins of the derived variables of the node (see setOrigins). They must be variables of nodes of the topology, including the new one
+        :type set_origins: bool
+        :returns: Node
+        """
+        node = Node(params=node,timestart=self.timestart,timeend=self.timeend,forecast_timeend=self.forecast_timeend,plan=plan,time_offset=self.time_offset_start,topology=self)
+        self.nodes.append(node)
+        if node.id not in self.node_index:
+            self.node_index[node.id] = node
+            for variable in node.variables.values():
+                self.variable_index[(node.id,variable.id)] = variable
+        if set_origins:
+            self.setOrigins(nodes=[node])
+        return node
+    def setOrigins(self,nodes : list=None):
+        """
+        sets the origins of the derived variables of nodes (default: all nodes) and checks that the derivation graph has no cycles (see getDerivationGraph)
+        """
+        for node in nodes if nodes is not None else self.nodes:
+            node.setOrigins(self)
+        self.getDerivationGraph()
+    def getDerivationGraph(self) -> TaskGraph:
+        """
+        returns the graph of derivation tasks: one task per derived variable, with key ("deriveVariable", node index, var id), which depends on the tasks of its derived origin variables. Raises if the graph has a cycle
+        """
+        graph = TaskGraph()
+        position = {id(node): i for i, node in enumerate(self.nodes)}
+        for i, node in enumerate(self.nodes):
+            for variable in node.variables.values():
+                if not isinstance(variable,DerivedNodeVariable):
+                    continue
+                graph.addTask(("deriveVariable",i,variable.id),variable.derive)
+                for origin in variable.getOrigins():
+                    if isinstance(origin,DerivedNodeVariable):
+                        graph.addDependency(("deriveVariable",i,variable.id),("deriveVariable",position[id(origin._node)],origin.id))
+        cyclic = graph.getCyclic()
+        if len(cyclic):
+            raise Exception("Derivation cycle found. Variables in or depending on the cycle: %s" % ", ".join(["node_id: %s, var_id: %s" % (str(self.nodes[key[1]].id),str(key[2])) for key in cyclic]))
+        return graph
+    def getNode(self,node_id):
+        """
+        returns the node with id node_id, or None if not found
+        """
+        return self.node_index[node_id] if node_id in self.node_index else None
+    def getVariable(self,node_id,var_id : int):
+        """
+        returns the variable var_id of node node_id, or None if not found
+        """
+        key = (node_id,var_id)
+        return self.variable_index[key] if key in self.variable_index else None
+    def batchProcessInput(self,include_prono=False,max_workers=None,batch_size=None,scheduler=None,processes=None):
+        """
+        Loads and processes the series of all nodes (loadData, removeOutliers, detectJumps, applyOffset, regularize, applyMovingAverage, fillNulls, adjust, concatenateProno, derive, interpolate, setOutputData, plotProno)
+
+        :param include_prono: if True, concatenates series_prono
+        :type include_prono: bool
+        :param max_workers: number of worker threads. If None, uses self.max_workers
+        :type max_workers: int
+        :param batch_size: see loadData
+        :type batch_size: int
+        :param scheduler: stages: each stage runs over all nodes before the next one starts. dag: each node goes through the stages as soon as its series are loaded and the nodes it derives from are ready (see getProcessGraph). If None, uses self.scheduler
+        :type scheduler: str
+        :param processes: if set, the series processing stages (removeOutliers to fillNulls) of the observed variables run on a pool of processes worker processes (see processSeries). If None, uses self.processes. Ignored if state_cache is set
+        :type processes: int
+        """
+        scheduler = scheduler if scheduler is not None else self.scheduler
+        processes = processes if processes is not None else self.processes
+        if processes is not None and self.state_cache is not None:
+            logging.warning("state_cache is set: processes is ignored, the series processing stages run incrementally in this process")
+            processes = None
+        executor = self.getProcessPool(processes) if processes is not None else None
+        try:
+            if scheduler == "dag":
+                self.processGraph(include_prono=include_prono,max_workers=max_workers,batch_size=batch_size,executor=executor)
+            else:
+                self.processStages(include_prono=include_prono,max_workers=max_workers,batch_size=batch_size,executor=executor)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        if(self.report_file is not None):
+            report = self.printReport()
+            f = open(self.report_file,"w")
+            json.dump(report,f,indent=2)
+            f.close()
+    def processStages(self,include_prono=False,max_workers=None,batch_size=None,executor : ProcessPoolExecutor=None):
         logging.debug("loadData")
-        self.loadData()
-        logging.debug("removeOutliers")
-        self.removeOutliers()
-        logging.debug("detectJumps")
-        self.detectJumps()
-        logging.debug("applyOffset")
-        self.applyOffset()
-        logging.debug("regularize")
-        self.regularize()
-        logging.debug("applyMovingAverage")
-        self.applyMovingAverage()
-        logging.debug("fillNulls")
-        self.fillNulls()
+        self.loadData(max_workers=max_workers,batch_size=batch_size)
+        if self.state_cache is not None:
+            logging.debug("processSeriesIncremental")
+            self.processSeriesIncremental()
+        elif executor is not None:
+            logging.debug("processSeries")
+            self.processSeries(executor)
+        else:
+            logging.debug("removeOutliers")
+            self.removeOutliers()
+            logging.debug("detectJumps")
+            self.detectJumps()
+            logging.debug("applyOffset")
+            self.applyOffset()
+            logging.debug("regularize")
+            self.regularize()
+            logging.debug("applyMovingAverage")
+            self.applyMovingAverage()
+            logging.debug("fillNulls")
+            self.fillNulls()
         logging.debug("adjust")
         self.adjust()
         if include_prono:
             logging.debug("concatenateProno")
             self.concatenateProno()
         logging.debug("derive")
-        self.derive()
+        self.derive(max_workers=max_workers)
         logging.debug("interpolate")
         self.interpolate(limit=self.interpolation_limit)
         self.setOutputData()
         self.plotProno()
-        if(self.report_file is not None):
-            report = self.printReport()
-            f = open(self.report_file,"w")
-            json.dump(report,f,indent=2)
-            f.close()
-    def loadData(self,include_prono=True):
+    def getProcessPool(self,processes : int) -> ProcessPoolExecutor:
+        """
+        returns a pool of processes worker processes for processSeries. Where available, workers are forked from a server process which imports pydrodelta.analysis once (forkserver), so that forking is safe while scheduler threads run. Else they are spawned
+        """
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(["pydrodelta.analysis"])
+        else:
+            context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=processes,mp_context=context)
+    def processSeries(self,executor : ProcessPoolExecutor,nodes : list=None):
+        """
+        runs removeOutliers, detectJumps, applyOffset, regularize, applyMovingAverage and fillNulls of the observed variables of nodes (default: all nodes) on executor, one task per variable, and sets the results. Only arrays are sent to and from the worker processes (see ObservedNodeVariable.getProcessPayload)
+        """
+        nodes = nodes if nodes is not None else self.nodes
+        futures = [node.submitProcessSeries(executor) for node in nodes]
+        for node, node_futures in zip(nodes,futures):
+            node.setProcessResults(node_futures)
+    def processSeriesIncremental(self,nodes : list=None):
+        """
+        runs removeOutliers, detectJumps, applyOffset, regularize, applyMovingAverage and fillNulls of the observed variables of nodes (default: all nodes) only over the steps of the time grid reached by new or revised observations since the previous run, with the state saved in self.state_cache (see ObservedNodeVariable.processSeriesIncremental). The moving averages of the other variables are applied as usual
+        """
+        position = {id(node): i for i, node in enumerate(self.nodes)}
+        for node in nodes if nodes is not None else self.nodes:
+            for variable in node.variables.values():
+                if isinstance(variable,ObservedNodeVariable):
+                    variable.processSeriesIncremental(self.state_cache,"%i_%s_%i" % (position[id(node)],str(node.id),variable.id))
+                else:
+                    variable.applyMovingAverage()
+    def getProcessGraph(self,include_prono=False,batch_size=None,executor : ProcessPoolExecutor=None) -> TaskGraph:
+        """
+        returns the task graph of batchProcessInput: one task per load job, with key ("loadData", job index) (see getLoadJobs), and one task per node and stage, with key (stage, node index). If self.state_cache is set, the stages removeOutliers to fillNulls are replaced by one processSeriesIncremental task per node. Else, if executor is set, they are replaced by one processSeries task per node, which runs them on executor. The stages of each node run in order, after the load jobs of its series. Derived variables are derived by the tasks of the derivation graph (see getDerivationGraph), after the stages preceding interpolate of their own node and of their origin nodes, and before these nodes interpolate, as with scheduler=stages
+        """
+        graph = self.getDerivationGraph()
+        jobs = self.getLoadJobs(include_prono=True,batch_size=self.getLoadBatchSize(batch_size))
+        serie_jobs = {id(task[0]): j for j, job in enumerate(jobs) for task in job[1]}
+        stages = []
+        for i, node in enumerate(self.nodes):
+            node_stages = [("setDataFromSeries",node.setDataFromSeries,False)]
+            if self.state_cache is not None:
+                node_stages.append(("processSeriesIncremental",partial(self.processSeriesIncremental,nodes=[node]),False))
+            elif executor is not None:
+                node_stages.append(("processSeries",partial(self.processSeries,executor,nodes=[node]),False))
+            else:
+                node_stages.extend([
+                    ("removeOutliers",node.removeOutliers,False),
+                    ("detectJumps",node.detectJumps,False),
+                    ("applyOffset",node.applyOffset,False),
+                    ("regularize",node.regularize,False),
+                    ("applyMovingAverage",node.applyMovingAverage,False),
+                    ("fillNulls",node.fillNulls,False)
+                ])
+            node_stages.append(("adjust",partial(self.adjust,nodes=[node]),True))
+            if include_prono:
+                node_stages.append(("concatenateProno",partial(self.concatenateProno,nodes=[node]),False))
+            node_stages.extend([
+                ("interpolate",partial(node.interpolate,limit=self.interpolation_limit),False),
+                ("setOutputData",node.setOutputData,False),
+                ("plotProno",partial(self.plotProno,nodes=[node]),True)
+            ])
+            previous = list(dict.fromkeys([("loadData",serie_jobs[id(task[0])]) for task in node.getLoadTasks(self.timestart,self.timeend,include_prono=True,forecast_timeend=self.forecast_timeend)]))
+            # load jobs are added next to the stages of their first node, so that ready stages of a node are started before the load jobs of the nodes that follow
+            for key in previous:
+                if key not in graph:
+                    graph.addTask(key,jobs[key[1]][0])
+            for name, function, exclusive in node_stages:
+                graph.addTask((name,i),function,previous,exclusive=exclusive)
+                previous = [(name,i)]
+            stages.append([x[0] for x in node_stages])
+        position = {id(node): i for i, node in enumerate(self.nodes)}
+        for i, node in enumerate(self.nodes):
+            for variable in node.variables.values():
+                if not isinstance(variable,DerivedNodeVariable):
+                    continue
+                key = ("deriveVariable",i,variable.id)
+                for j in dict.fromkeys([i] + [position[id(origin._node)] for origin in variable.getOrigins()]):
+                    graph.addDependency(key,(stages[j][stages[j].index("interpolate") - 1],j))
+                    graph.addDependency(("interpolate",j),key)
+        return graph
+    def processGraph(self,include_prono=False,max_workers=None,batch_size=None,executor : ProcessPoolExecutor=None):
+        """
+        runs the task graph of batchProcessInput (see getProcessGraph) on a pool of max_workers threads (if None, uses self.max_workers). Load jobs and node stages share the pool, so that the processing of a node overlaps with the download of the others. Raises if a task failed
+        """
+        max_workers = max_workers if max_workers is not None else self.max_workers
+        graph = self.getProcessGraph(include_prono=include_prono,batch_size=batch_size,executor=executor)
+        logging.debug("Processing %i nodes: %i tasks, %i workers" % (len(self.nodes),len(graph),max_workers if max_workers is not None else 1))
+        failed = graph.run(max_workers=max_workers)
+        load_failed = [key for key in failed if key[0] == "loadData"]
+        if len(load_failed):
+            jobs = self.getLoadJobs(include_prono=True,batch_size=self.getLoadBatchSize(batch_size))
+            self.checkLoadErrors([task for job in jobs for task in job[1]],[failed[("loadData",i)] if ("loadData",i) in failed else None for i, job in enumerate(jobs) for task in job[1]])
+        for key, e in failed.items():
+            if key[0] != "loadData":
+                logging.error("Node %s: %s failed: %s" % (str(self.nodes[key[1]].id),key[0],str(e)))
+        if len(failed):
+            raise list(failed.values())[0]
+    def getLoadBatchSize(self,batch_size : int=None) -> int:
+        """
+        returns batch_size, or self.batch_size if None. Returns None if self.obs_cache is set, since cached series are loaded one by one
+        """
+        batch_size = batch_size if batch_size is not None else self.batch_size
+        if batch_size is not None and self.obs_cache is not None:
+            logging.warning("obs_cache is set: batch loading disabled")
+            return None
+        return batch_size
+    def getLoadJobs(self,include_prono=True,batch_size=None) -> list:
+        """
+        returns the load jobs of all nodes as list of (function, tasks): one job per batch of observed series if batch_size is set (see getLoadBatches), and one job per series otherwise
+        """
+        tasks = []
+        for node in self.nodes:
+            tasks.extend(node.getLoadTasks(self.timestart,self.timeend,include_prono=include_prono,forecast_timeend=self.forecast_timeend))
+        jobs = []
+        if batch_size is not None:
+            for batch in self.getLoadBatches([task for task in tasks if type(task[0]) == NodeSerie],batch_size):
+                jobs.append((partial(self.loadBatch,batch),batch))
+            tasks = [task for task in tasks if type(task[0]) != NodeSerie]
+        for task in tasks:
+            jobs.append((partial(task[0].loadData,task[1],task[2],cache=self.obs_cache),[task]))
+        return jobs
+    def loadData(self,include_prono=True,max_workers=None,batch_size=None):
+        """
+        Loads series data of all nodes from a5 API. If self.obs_cache is set, observed series are read through the on-disk cache
+
+        :param include_prono: if True, loads also series_prono
+        :type include_prono: bool
+        :param max_workers: maximum number of concurrent requests. If None, uses self.max_workers. If None or 1, series are loaded sequentially
+        :type max_workers: int
+        :param batch_size: if set, observed series sharing tipo and time window are read in batches of batch_size series per request (see a5.readSeriesObservaciones). If None, uses self.batch_size. Ignored if self.obs_cache is set
+        :type batch_size: int
+        """
+        max_workers = max_workers if max_workers is not None else self.max_workers
+        batch_size = self.getLoadBatchSize(batch_size)
+        if (max_workers is None or max_workers <= 1) and batch_size is None:
+            for node in self.nodes:
+                if hasattr(node,"loadData"):
+                    node.loadData(self.timestart,self.timeend,forecast_timeend=self.forecast_timeend,include_prono=include_prono,cache=self.obs_cache)
+            return
+        jobs = self.getLoadJobs(include_prono=include_prono,batch_size=batch_size)
+        if max_workers is None or max_workers <= 1:
+            logging.debug("Loading %i series using %i requests" % (sum([len(job[1]) for job in jobs]),len(jobs)))
+            exceptions = []
+            for job in jobs:
+                try:
+                    job[0]()
+                    exceptions.append(None)
+                except Exception as e:
+                    exceptions.append(e)
+        else:
+            logging.debug("Loading %i series using %i requests and %i workers" % (sum([len(job[1]) for job in jobs]),len(jobs),max_workers))
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(job[0]) for job in jobs]
+            exceptions = [future.exception() for future in futures]
+        self.checkLoadErrors([task for job in jobs for task in job[1]],[e for job, e in zip(jobs,exceptions) for task in job[1]])
         for node in self.nodes:
-            if hasattr(node,"loadData"):
-                node.loadData(self.timestart,self.timeend,forecast_timeend=self.forecast_timeend,include_prono=include_prono)
-            # for serie in node.series:
-            #     if isinstance(serie,NodeSerie):
-            #         serie.loadData(self.timestart,self.timeend)
-                # if include_prono and node.series_prono is not None and len(node.series_prono):
-                #     for serie in node.series_prono:
-                #         if isinstance(serie,NodeSerieProno):
-                #             if self.forecast_timeend is not None:
-                #                 serie.loadData(self.timestart,self.forecast_timeend)
-                #             else:
-                #                 serie.loadData(self.timestart,self.timeend)
-            # if isinstance(node,observedNode):
-            #     node.loadData(self.timestart,self.timeend)
+            node.setDataFromSeries()
+    def getLoadBatches(self,tasks : list,batch_size : int) -> list:
+        """
+        groups load tasks of observed series by tipo and time window and splits each group into batches of at most batch_size distinct series
+        """
+        groups = {}
+        for task in tasks:
+            key = (task[0].type,task[1],task[2])
+            if key not in groups:
+                groups[key] = []
+            groups[key].append(task)
+        batches = []
+        for group in groups.values():
+            series_ids = list(dict.fromkeys([task[0].series_id for task in group]))
+            for i in range(0,len(series_ids),batch_size):
+                batch_ids = series_ids[i:i+batch_size]
+                batches.append([task for task in group if task[0].series_id in batch_ids])
+        return batches
+    def loadBatch(self,tasks : list):
+        """
+        loads observed series of tasks (sharing tipo and time window) with a single batch request
+        """
+        serie, timestart, timeend, error_message = tasks[0]
+        series = a5.readSeriesObservaciones([task[0].series_id for task in tasks],timestart,timeend,tipo=serie.type,batch_size=None)
+        for task in tasks:
+            task[0].setLoadedData(dict(series[task[0].series_id]))
+    async def aloadData(self,include_prono=True,max_concurrency=100):
+        """
+        Loads series data of all nodes from a5 API using asyncio (requires aiohttp). Same result as loadData (without self.obs_cache)
+
+        :param include_prono: if True, loads also series_prono
+        :type include_prono: bool
+        :param max_concurrency: maximum number of requests in flight
+        :type max_concurrency: int
+        """
+        tasks = []
+        for node in self.nodes:
+            tasks.extend(node.getLoadTasks(self.timestart,self.timeend,include_prono=include_prono,forecast_timeend=self.forecast_timeend))
+        logging.debug("Async loading %i series with max_concurrency %i" % (len(tasks),max_concurrency))
+        async with a5.AsyncA5Client(max_concurrency=max_concurrency) as client:
+            results = await asyncio.gather(*[serie.aloadData(timestart,timeend,client=client) for serie, timestart, timeend, error_message in tasks],return_exceptions=True)
+        self.checkLoadErrors(tasks,[result if isinstance(result,BaseException) else None for result in results])
+        for node in self.nodes:
+            node.setDataFromSeries()
+    def checkLoadErrors(self,tasks : list,exceptions : list):
+        """
+        logs each failed load task with its node/variable/series attribution and raises if any failed
+        """
+        errors = []
+        for e, task in zip(exceptions,tasks):
+            if e is not None:
+                logging.error("%s: %s" % (task[3],str(e)))
+                errors.append("%s: %s" % (task[3],str(e)))
+        if len(errors):
+            raise Exception("%i series failed loadData. First error: %s" % (len(errors),errors[0]))
     def removeOutliers(self):
         found_outliers = False
         for node in self.nodes:
@@ -943,16 +1734,23 @@ class Topology():
     def fillNulls(self):
         for node in self.nodes:
             node.fillNulls()
-    def derive(self):
-        for node in self.nodes:
-            node.derive()
-    def adjust(self):
-        for node in self.nodes:
+    def derive(self,max_workers : int=None):
+        """
+        derives the derived variables in topological order of the derivation graph (see getDerivationGraph), so that variables derived from derived variables run after them whatever the order of the nodes. Independent derivation chains run concurrently on max_workers threads (if None, uses self.max_workers). Raises if a derivation failed
+        """
+        max_workers = max_workers if max_workers is not None else self.max_workers
+        failed = self.getDerivationGraph().run(max_workers=max_workers)
+        for key, e in failed.items():
+            logging.error("Node %s: derivation of variable %s failed: %s" % (str(self.nodes[key[1]].id),str(key[2]),str(e)))
+        if len(failed):
+            raise list(failed.values())[0]
+    def adjust(self,nodes : list=None):
+        for node in nodes if nodes is not None else self.nodes:
             node.adjust()
             node.apply_linear_combination()
             node.adjustProno()
-    def concatenateProno(self):
-        for node in self.nodes:
+    def concatenateProno(self,nodes : list=None):
+        for node in nodes if nodes is not None else self.nodes:
             for variable in node.variables.values():
                 if variable.series_prono is not None:
                     variable.concatenateProno()
@@ -964,7 +1762,7 @@ class Topology():
             node.setOutputData()
     def toCSV(self,pivot=False):
         if pivot:
-            data = self.pivotData()
+            data = util.decodeTags(self.pivotData())
             data["timestart"] = [x.isoformat() for x in data.index]
             # data.reset_index(inplace=True)
             return data.to_csv(index=False)    
@@ -972,7 +1770,7 @@ class Topology():
         return header + "\n" + "\n".join([node.toCSV(True,False) for node in self.nodes])
     def outputToCSV(self,pivot=False):
         if pivot:
-            data = self.pivotOutputData()
+            data = util.decodeTags(self.pivotOutputData())
             data["timestart"] = [x.isoformat() for x in data.index]
             # data.reset_index(inplace=True)
             return data.to_csv(index=False)    
@@ -992,7 +1790,7 @@ class Topology():
         flatten: boolean        if set to false, returns list of series objects:[{"series_id":int,observaciones:[obs,obs,...]},...] (ignored if pivot=True)
         """
         if pivot:
-            data = self.pivotData()
+            data = util.decodeTags(self.pivotData())
             data["timestart"] = [x.isoformat() for x in data.index]
             data.reset_index
             data["timeend"] = data["timestart"]
@@ -1006,7 +1804,7 @@ class Topology():
         return obs_list
     def outputToList(self,pivot=False,flatten=False):
         if pivot:
-            data = self.pivotOutputData()
+            data = util.decodeTags(self.pivotOutputData())
             data["timestart"] = [x.isoformat() for x in data.index]
             data.reset_index
             data["timeend"] = data["timestart"]
@@ -1036,14 +1834,43 @@ class Topology():
         f.write(self.outputToCSV(pivot))
         f.close
         return
-    def uploadData(self):
+    def uploadData(self,include_prono=False,max_workers=None,chunk_size=None,chunk_retries=None):
         """
-        Uploads analysis data of all nodes
+        Uploads analysis data (series_output) of all nodes. A summary of uploaded and created observations per series is logged and saved into self.upload_summary
+
+        :param include_prono: if True, uploads also data after max_obs_date
+        :param max_workers: number of series uploaded concurrently. If None, uses self.max_workers. If None or 1, series are uploaded sequentially
+        :param chunk_size: maximum number of observations per request. If None, uses self.upload_chunk_size
+        :param chunk_retries: number of times a failed chunk is sent again. If None, uses self.upload_chunk_retries
+        :returns: list of created observations
         """
-        created = []
+        max_workers = max_workers if max_workers is not None else self.max_workers
+        chunk_size = chunk_size if chunk_size is not None else self.upload_chunk_size
+        chunk_retries = chunk_retries if chunk_retries is not None else self.upload_chunk_retries
+        tasks = []
         for node in self.nodes:
-            obs_created = node.uploadData()
-            created.extend(obs_created)
+            tasks.extend(node.getUploadTasks(include_prono=include_prono))
+        uploads = [partial(a5.createObservaciones,obs_list,series_id=serie.series_id,tipo=serie.type,chunk_size=chunk_size,chunk_retries=chunk_retries,raise_on_error=False) for serie, obs_list in tasks]
+        if max_workers is None or max_workers <= 1:
+            results = []
+            for upload in uploads:
+                try:
+                    results.append(upload())
+                except Exception as e:
+                    results.append(e)
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(upload) for upload in uploads]
+            results = [future.exception() if future.exception() is not None else future.result() for future in futures]
+        created = []
+        self.upload_summary = []
+        for (serie, obs_list), result in zip(tasks,results):
+            if isinstance(result,Exception):
+                logging.error("series_id %i: failed upload: %s" % (serie.series_id,str(result)))
+                result = []
+            created.extend(result)
+            self.upload_summary.append({"series_id": serie.series_id, "observaciones": len(obs_list), "created": len(result)})
+            logging.info("series_id %i: uploaded %i observations, created %i" % (serie.series_id,len(obs_list),len(result)))
         return created
     def uploadDataAsProno(self):
         if self.cal_id is None:
@@ -1106,7 +1933,7 @@ class Topology():
                 if hasattr(node,"max_obs_date"):
                     ax.axvline(node.max_obs_date, color='k', linestyle='--')
         plt.show()
-    def plotProno(self,output_dir:str=None,figsize=None,title=None,markersize=None,obs_label=None,tz=None,prono_label=None,footnote=None,errorBandLabel=None,obsLine=None,prono_annotation=None,obs_annotation=None,forecast_date_annotation=None,ylim=None,datum_template_string=None,title_template_string=None,x_label=None,y_label=None,xlim=None,text_xoffset=None):
+    def plotProno(self,output_dir:str=None,figsize=None,title=None,markersize=None,obs_label=None,tz=None,prono_label=None,footnote=None,errorBandLabel=None,obsLine=None,prono_annotation=None,obs_annotation=None,forecast_date_annotation=None,ylim=None,datum_template_string=None,title_template_string=None,x_label=None,y_label=None,xlim=None,text_xoffset=None,nodes : list=None):
         output_dir = util.getParamOrDefaultTo("output_dir",output_dir,self.plot_params)
         footnote = util.getParamOrDefaultTo("footnote",footnote,self.plot_params)
         figsize = util.getParamOrDefaultTo("figsize",figsize,self.plot_params)
@@ -1128,7 +1955,7 @@ class Topology():
         y_label = util.getParamOrDefaultTo("y_label",y_label,self.plot_params)
         xlim = util.getParamOrDefaultTo("xlim",xlim,self.plot_params)
         text_xoffset = util.getParamOrDefaultTo("text_xoffset",text_xoffset,self.plot_params)
-        for node in self.nodes:
+        for node in nodes if nodes is not None else self.nodes:
             node.plotProno(output_dir,figsize=figsize,title=title,markersize=markersize,obs_label=obs_label,tz=tz,prono_label=prono_label,footnote=footnote,errorBandLabel=errorBandLabel,obsLine=obsLine,prono_annotation=prono_annotation,obs_annotation=obs_annotation,forecast_date_annotation=forecast_date_annotation,ylim=ylim,datum_template_string=datum_template_string,title_template_string=title_template_string,x_label=x_label,y_label=y_label,xlim=xlim,text_xoffset=text_xoffset)
     def printReport(self):
         report = {"nodes":[]}
@@ -1153,7 +1980,7 @@ class Topology():
                                 "outliers": [(x[0].isoformat(), x[1], x[2]) for x in list(serie.outliers_data.itertuples(name=None))] if serie.outliers_data is not None else None,
                                 "jumps": [(x[0].isoformat(), x[1], x[2]) for x in list(serie.jumps_data.itertuples(name=None))] if serie.jumps_data is not None else None,
                                 "nulls": int(serie.data["valor"].isna().sum()),
-                                "tag_counts": serie.data.groupby("tag").size().to_dict(),
+                                "tag_counts": util.decodeTags(serie.data,"tag").groupby("tag").size().to_dict(),
                                 "min_date": serie_notnull.index[0].isoformat() if len(serie_notnull) else None,
                                 "max_date": serie_notnull.index[-1].isoformat() if len(serie_notnull) else None
                             }
@@ -1167,7 +1994,7 @@ class Topology():
                                 "series_id": serie.series_id,
                                 "len": len(serie.data),
                                 "nulls": int(serie.data["valor"].isna().sum()),
-                                "tag_counts": serie.data.groupby("tag").size().to_dict(),
+                                "tag_counts": util.decodeTags(serie.data,"tag").groupby("tag").size().to_dict(),
                                 "min_date": serie_notnull.index[0].isoformat() if len(serie_notnull) else None,
                                 "max_date": serie_notnull.index[-1].isoformat() if len(serie_notnull) else None
                             }
@@ -1184,7 +2011,7 @@ class Topology():
                             "outliers": [(x[0].isoformat(), x[1], x[2]) for x in list(serie.outliers_data.itertuples(name=None))] if serie.outliers_data is not None else None,
                             "jumps": [(x[0].isoformat(), x[1], x[2]) for x in list(serie.jumps_data.itertuples(name=None))] if serie.jumps_data is not None else None,
                             "nulls": int(serie.data["valor"].isna().sum()),
-                            "tag_counts": serie.data.groupby("tag").size().to_dict(),
+                            "tag_counts": util.decodeTags(serie.data,"tag").groupby("tag").size().to_dict(),
                             "min_date": serie_notnull.index[0].isoformat() if len(serie_notnull) else None,
                             "max_date": serie_notnull.index[-1].isoformat() if len(serie_notnull) else None,
                             "adjust_results": {
@@ -1200,7 +2027,7 @@ class Topology():
                     variable_report["result"] = {
                         "len": len(variable.data),
                         "nulls": int(variable.data["valor"].isna().sum()),
-                        "tag_counts": variable.data.groupby("tag").size().to_dict(),
+                        "tag_counts": util.decodeTags(variable.data,"tag").groupby("tag").size().to_dict(),
                         "min_date": serie_notnull.index[0].isoformat() if len(serie_notnull) else None,
                         "max_date": serie_notnull.index[-1].isoformat() if len(serie_notnull) else None
                     }
@@ -1221,7 +2048,8 @@ class Topology():
 @click.option("--upload", "-u", is_flag=True, help="Upload output to database API", default=False, show_default=True)
 @click.option("--include_prono", "-P", is_flag=True, help="Concatenate series_prono to output series",type=bool, default=False, show_default=True)
 @click.option("--verbose", "-v", is_flag=True, help="log to stdout", default=False, show_default=True)
-def run_analysis(self,config_file,csv,json,pivot,upload,include_prono,verbose):
+@click.option("--max_workers", "-w", help="Maximum number of concurrent series download/upload requests (overrides topology max_workers)", type=int, default=None)
+def run_analysis(self,config_file,csv,json,pivot,upload,include_prono,verbose,max_workers):
     """
     run analysis of border conditions from topology file
     
@@ -1237,13 +2065,13 @@ def run_analysis(self,config_file,csv,json,pivot,upload,include_prono,verbose):
         root.addHandler(handler)
     t_config = yaml.load(open(config_file),yaml.CLoader)
     topology = Topology(t_config)
-    topology.batchProcessInput(include_prono=include_prono)
+    topology.batchProcessInput(include_prono=include_prono,max_workers=max_workers)
     if csv is not None:
         topology.saveData(csv,pivot=pivot)
     if json is not None:
         topology.saveData(json,format="json",pivot=pivot)
     if upload:
-        uploaded = topology.uploadData()
+        uploaded = topology.uploadData(max_workers=max_workers)
         if include_prono:
             uploaded_prono = topology.uploadDataAsProno()
 
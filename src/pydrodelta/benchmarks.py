@@ -0,0 +1,502 @@
+import pydrodelta.a5 as a5
+import pydrodelta.util as util
+from pydrodelta.cache import arraysToDataFrame, ObservacionesCache, StateCache
+import pandas
+import numpy as np
+import time
+import tracemalloc
+import sys
+import os
+import threading
+from types import SimpleNamespace
+from datetime import timedelta, datetime
+
+## BENCHMARKS
+# uso: python -m pydrodelta.benchmarks [nombre] [filas]
+
+def syntheticObservaciones(n : int=1000000,freq : str="H",timestart : str="1990-01-01T03:00:00.000Z") -> list:
+    """
+    returns synthetic a5 observaciones list [{timestart: str, valor: float},...] of n rows
+    """
+    index = pandas.date_range(timestart,periods=n,freq=freq)
+    valor = np.random.default_rng(0).normal(size=n)
+    return [{"timestart": t, "valor": v} for t, v in zip(index.strftime("%Y-%m-%dT%H:%M:%S.000Z"),valor.tolist())]
+
+def timeit(function,*args,**kwargs) -> tuple:
+    start = time.perf_counter()
+    result = function(*args,**kwargs)
+    return result, time.perf_counter() - start
+
+def observacionesListToDataFrameRowwise(data : list,tag : str=None) -> pandas.DataFrame:
+    """
+    per-row date parsing implementation of a5.observacionesListToDataFrame, kept as benchmark baseline
+    """
+    data = pandas.DataFrame.from_dict(data)
+    data["valor"] = data["valor"].astype(float)
+    data.index = data["timestart"].apply(util.tryParseAndLocalizeDate)
+    data.sort_index(inplace=True)
+    if tag is not None:
+        data["tag"] = tag
+        return data[["valor","tag"]]
+    else:
+        return data[["valor",]]
+
+def benchmarkObservacionesListToDataFrame(n : int=1000000) -> dict:
+    """
+    compares rows/second of per-row and vectorized a5.observacionesListToDataFrame on a synthetic payload of n rows, and checks that results are equal
+    """
+    observaciones = syntheticObservaciones(n)
+    before, before_seconds = timeit(observacionesListToDataFrameRowwise,observaciones,tag="obs")
+    after, after_seconds = timeit(a5.observacionesListToDataFrame,observaciones,tag="obs")
+    pandas.testing.assert_frame_equal(before,after)
+    result = {
+        "rows": n,
+        "before_rows_per_second": n / before_seconds,
+        "after_rows_per_second": n / after_seconds,
+        "speedup": before_seconds / after_seconds
+    }
+    print("observacionesListToDataFrame, %i rows: before %.0f rows/s, after %.0f rows/s, speedup %.1fx" % (n,result["before_rows_per_second"],result["after_rows_per_second"],result["speedup"]))
+    return result
+
+def syntheticSerie(n : int=1000000,freq : str="min",null_fraction : float=0.2) -> pandas.DataFrame:
+    """
+    returns synthetic observations DataFrame (valor, tag) of n rows with a fraction of null values, indexed by timestart
+    """
+    rng = np.random.default_rng(0)
+    index = pandas.date_range("2000-01-01T03:00:00Z",periods=n,freq=freq).tz_convert(util.localtz).rename("timestart")
+    valor = rng.normal(size=n)
+    valor[rng.random(n) < null_fraction] = np.nan
+    return pandas.DataFrame({"valor": valor, "tag": "obs"},index=index)
+
+def interpolationTagsRowwise(data : pandas.DataFrame,column="valor",tag_column="tag",min_obs_date=None,max_obs_date=None) -> list:
+    """
+    iterrows implementation of util.interpolationTags, kept as benchmark baseline
+    """
+    return [x[tag_column] if pandas.isna(x["interpolated"]) else "extrapolated" if i < min_obs_date or i > max_obs_date else "interpolated" if pandas.isna(x[column]) else x[tag_column] for (i, x) in data.iterrows()]
+
+def benchmarkInterpolationTags(sizes : list=[10000,100000,1000000]) -> list:
+    """
+    compares rows/second of iterrows and vectorized tagging of interpolated/extrapolated values (as in util.serieRegular(interpolate=True) and util.interpolateData), and checks that tags are equal
+    """
+    if isinstance(sizes,int):
+        sizes = [sizes]
+    results = []
+    for n in sizes:
+        data = syntheticSerie(n)
+        min_obs_date, max_obs_date = data[data.valor.notna()].index.min(), data[data.valor.notna()].index.max()
+        data["interpolated"] = data["valor"].interpolate(method='time',limit=1,limit_direction='both',limit_area='inside')
+        before, before_seconds = timeit(interpolationTagsRowwise,data,"valor","tag",min_obs_date,max_obs_date)
+        after, after_seconds = timeit(util.interpolationTags,data,"valor","tag",min_obs_date,max_obs_date)
+        assert list(before) == list(after)
+        _, serie_regular_seconds = timeit(util.serieRegular,data[["valor","tag"]],timedelta(minutes=30),interpolate=True,tag_column="tag")
+        results.append({
+            "rows": n,
+            "before_rows_per_second": n / before_seconds,
+            "after_rows_per_second": n / after_seconds,
+            "speedup": before_seconds / after_seconds,
+            "serie_regular_seconds": serie_regular_seconds
+        })
+        print("interpolationTags, %i rows: before %.0f rows/s, after %.0f rows/s, speedup %.1fx. serieRegular(interpolate=True): %.2f s" % (n,results[-1]["before_rows_per_second"],results[-1]["after_rows_per_second"],results[-1]["speedup"],serie_regular_seconds))
+    return results
+
+def roundDateIterative(date,timeInterval : timedelta,timeOffset : timedelta=None,to="up"):
+    """
+    step-by-step implementation of util.roundDate, kept as benchmark baseline
+    """
+    date_0 = util.tryParseAndLocalizeDate(datetime.combine(date.date(),datetime.min.time()))
+    if timeOffset is not None:
+        date_0 = date_0 + timeOffset
+    while date_0 < date:
+        date_0 = date_0 + timeInterval
+    if to == "up":
+        return date_0
+    else:
+        return date_0 - timeInterval
+
+def benchmarkCreateDatetimeSequence(n : int=1000) -> dict:
+    """
+    compares iterative and arithmetic util.roundDate on n random dates with 1-minute interval, and times util.createDatetimeSequence for n series sharing the same time window (cached grid)
+    """
+    rng = np.random.default_rng(0)
+    dates = [util.tryParseAndLocalizeDate(datetime(2000,1,1) + timedelta(seconds=int(s))) for s in rng.integers(0,20*365*86400,n)]
+    interval = timedelta(minutes=1)
+    before, before_seconds = timeit(lambda: [roundDateIterative(d,interval,None,to) for d in dates for to in ("up","down")])
+    after, after_seconds = timeit(lambda: [util.roundDate(d,interval,None,to) for d in dates for to in ("up","down")])
+    assert before == after
+    timestart = util.tryParseAndLocalizeDate("2022-01-01T00:00:00-03:00")
+    timeend = util.tryParseAndLocalizeDate("2022-03-01T00:00:00-03:00")
+    util.datetime_sequence_cache.clear()
+    _, first_sequence_seconds = timeit(util.createDatetimeSequence,None,interval,timestart,timeend)
+    _, sequence_seconds = timeit(lambda: [util.createDatetimeSequence(None,interval,timestart,timeend) for i in range(n)])
+    result = {
+        "dates": n,
+        "before_seconds": before_seconds,
+        "after_seconds": after_seconds,
+        "speedup": before_seconds / after_seconds,
+        "first_sequence_seconds": first_sequence_seconds,
+        "cached_sequence_seconds": sequence_seconds / n
+    }
+    print("roundDate, %i dates: before %.3f s, after %.3f s, speedup %.1fx. createDatetimeSequence: first call %.4f s, cached %.6f s per call" % (n,before_seconds,after_seconds,result["speedup"],first_sequence_seconds,result["cached_sequence_seconds"]))
+    return result
+
+def benchmarkColumnarStore(n : int=200,steps : int=8760,reads : int=10) -> dict:
+    """
+    compares memory of n regularized series (hourly grid of steps timesteps, 20% nulls) kept as one DataFrame per series (each with its own index, as before TimeGrid) against util.ColumnarStore, and checks that stored series read back equal. Then compares memory and time of reading each stored series reads times with and without the cached row frames
+    """
+    rng = np.random.default_rng(0)
+    timestart = util.tryParseAndLocalizeDate("2000-01-01T00:00:00-03:00")
+    time_grid = util.TimeGrid(timestart,timestart + timedelta(hours=steps),timedelta(hours=1))
+    frames = []
+    tracemalloc.start()
+    for i in range(n):
+        valor = rng.normal(size=len(time_grid))
+        valor[rng.random(len(time_grid)) < 0.2] = np.nan
+        frames.append(pandas.DataFrame({"valor": valor, "tag": util.encodeTags(pandas.Series(np.where(np.isnan(valor),None,"obs")))},index=time_grid.index.copy(deep=True)))
+    frames_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    store = util.ColumnarStore(time_grid,capacity=n)
+    rows = []
+    for frame in frames:
+        frame.index = time_grid.index
+        rows.append(store.allocate())
+        store.setRow(rows[-1],frame)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    for row, frame in zip(rows,frames):
+        pandas.testing.assert_frame_equal(util.decodeTags(store.getRow(row)),util.decodeTags(frame))
+    # reads of each row (as the stages read serie.data), keeping the frames alive. Uncached reads drop the cached frame first, so that each read builds a new one
+    read_bytes = {}
+    read_seconds = {}
+    for cached in [False,True]:
+        tracemalloc.start()
+        start = time.perf_counter()
+        read = []
+        for i in range(reads):
+            for row in rows:
+                if not cached:
+                    store.frames.pop(row,None)
+                read.append(store.getRow(row))
+        read_seconds[cached] = time.perf_counter() - start
+        read_bytes[cached] = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del read
+    result = {
+        "series": n,
+        "steps": len(time_grid),
+        "frames_bytes": frames_bytes,
+        "store_bytes": store_bytes,
+        "ratio": frames_bytes / store_bytes,
+        "uncached_read_bytes": read_bytes[False],
+        "cached_read_bytes": read_bytes[True],
+        "uncached_read_seconds": read_seconds[False],
+        "cached_read_seconds": read_seconds[True]
+    }
+    print("ColumnarStore, %i series x %i steps: DataFrames %.1f MB, store %.1f MB, ratio %.1fx. %i reads per series: uncached %.1f MB %.3f s, cached %.1f MB %.3f s" % (n,len(time_grid),frames_bytes / 1e6,store_bytes / 1e6,result["ratio"],reads,read_bytes[False] / 1e6,read_seconds[False],read_bytes[True] / 1e6,read_seconds[True]))
+    return result
+
+def benchmarkOffsetIndex(n : int=1000000) -> dict:
+    """
+    compares row-wise (DataFrame.apply axis=1) and vectorized (util.offsetIndex) time offset of the index of a synthetic series of n rows, as in NodeSerie.applyOffset and DerivedNodeSerie.derive
+    """
+    data = syntheticSerie(n)
+    x_offset = timedelta(hours=3)
+    before, before_seconds = timeit(data.apply,lambda row: row.name + x_offset,axis=1)
+    after, after_seconds = timeit(util.offsetIndex,data.index,x_offset)
+    pandas.testing.assert_index_equal(pandas.DatetimeIndex(before),after)
+    result = {
+        "rows": n,
+        "before_rows_per_second": n / before_seconds,
+        "after_rows_per_second": n / after_seconds,
+        "speedup": before_seconds / after_seconds
+    }
+    print("offsetIndex, %i rows: before %.0f rows/s, after %.0f rows/s, speedup %.1fx" % (n,result["before_rows_per_second"],result["after_rows_per_second"],result["speedup"]))
+    return result
+
+def benchmarkCoalesceSeries(steps : int=100000,n : int=5) -> dict:
+    """
+    compares chained util.serieFillNulls (one join per series) and util.coalesceSeries on n aligned series of steps timesteps with 50% nulls, and checks that results are equal
+    """
+    rng = np.random.default_rng(0)
+    timestart = util.tryParseAndLocalizeDate("2000-01-01T00:00:00-03:00")
+    time_grid = util.TimeGrid(timestart,timestart + timedelta(minutes=steps),timedelta(minutes=1))
+    data = []
+    for i in range(n):
+        valor = rng.normal(size=len(time_grid))
+        valor[rng.random(len(time_grid)) < 0.5] = np.nan
+        data.append(pandas.DataFrame({"valor": valor, "tag": util.encodeTags(pandas.Series(np.where(np.isnan(valor),None,"obs")))},index=time_grid.index))
+    before, before_seconds = timeit(util.coalesceSeries,data,fill_value=0,tag_column="tag")
+    after, after_seconds = timeit(util.coalesceSeries,data,fill_value=0,tag_column="tag",time_grid=time_grid)
+    pandas.testing.assert_frame_equal(util.decodeTags(before),util.decodeTags(after),check_freq=False)
+    result = {
+        "steps": len(time_grid),
+        "series": n,
+        "before_seconds": before_seconds,
+        "after_seconds": after_seconds,
+        "speedup": before_seconds / after_seconds
+    }
+    print("coalesceSeries, %i series x %i steps: before %.3f s, after %.3f s, speedup %.1fx" % (n,len(time_grid),before_seconds,after_seconds,result["speedup"]))
+    return result
+
+def benchmarkMovingAverage(n : int=1000000,window : timedelta=timedelta(hours=96),appended : int=60) -> dict:
+    """
+    compares pandas rolling mean, util.serieMovingAverage (rolling, with tags) and the util.movingAverageArrays kernel on a synthetic series of n rows (1-minute steps, 20% nulls), and times the incremental update of the moving average when appended rows are added (util.MovingAverage) against a full recompute
+    """
+    data = syntheticSerie(n)
+    data["tag"] = util.encodeTags(data["tag"])
+    before, before_seconds = timeit(lambda: data["valor"].rolling(window,min_periods=1).mean())
+    after, after_seconds = timeit(util.serieMovingAverage,data,window,tag_column="tag")
+    kernel, kernel_seconds = timeit(util.movingAverageArrays,data.index.asi8,data["valor"].values,int(pandas.Timedelta(window).value))
+    assert np.allclose(before.values,after["valor"].values,equal_nan=True,rtol=0,atol=1e-9)
+    assert np.allclose(before.values,kernel,equal_nan=True,rtol=0,atol=1e-9)
+    moving_average = util.MovingAverage(window)
+    util.serieMovingAverage(data.iloc[:-appended],window,moving_average=moving_average)
+    incremental, incremental_seconds = timeit(util.serieMovingAverage,data.iloc[-appended:],window,moving_average=moving_average)
+    assert np.allclose(incremental["valor"].values,after["valor"].values[-appended:],equal_nan=True,rtol=0,atol=1e-9)
+    result = {
+        "rows": n,
+        "rolling_seconds": before_seconds,
+        "serie_seconds": after_seconds,
+        "kernel_seconds": kernel_seconds,
+        "incremental_seconds": incremental_seconds
+    }
+    print("moving average, %i rows: pandas rolling %.3f s, serieMovingAverage (with tags) %.3f s, movingAverageArrays kernel %.3f s, incremental update of %i rows %.4f s" % (n,before_seconds,after_seconds,kernel_seconds,appended,incremental_seconds))
+    return result
+
+class SyntheticObsSource():
+    """
+    stands in for ObservacionesCache (Topology.obs_cache) in benchmarks: readSerie waits latencies[series_id] seconds, as a download would, and returns a synthetic irregular series (one observation every 15 minutes on average)
+    """
+    def __init__(self,latencies : dict):
+        self.latencies = latencies
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual") -> tuple:
+        time.sleep(self.latencies[series_id])
+        rng = np.random.default_rng(series_id)
+        timestart, timeend = pandas.Timestamp(timestart).value, pandas.Timestamp(timeend).value
+        n = int((timeend - timestart) / 900e9)
+        data = arraysToDataFrame(np.sort(rng.integers(timestart,timeend,n)),rng.normal(size=n),tag="obs")
+        return {"id": series_id, "tipo": tipo, "estacion": {"nombre": "synthetic", "nivel_alerta": None, "nivel_evacuacion": None, "nivel_aguas_bajas": None}}, data
+
+def syntheticTopology(n : int,days : int=62) -> dict:
+    """
+    returns config of a synthetic topology of n observed nodes (two hourly series each) and n / 4 nodes derived from them
+    """
+    nodes = []
+    for i in range(1,n + 1):
+        nodes.append({"id": i, "name": "node %i" % i, "time_interval": {"hours": 1}, "variables": [{"id": 2, "series": [{"series_id": i * 10 + 1}, {"series_id": i * 10 + 2}]}]})
+    for i in range(1,n // 4 + 1):
+        nodes.append({"id": n + i, "name": "derived node %i" % i, "time_interval": {"hours": 1}, "variables": [{"id": 2, "derived": True, "derived_from": {"node_id": i * 4, "var_id": 2, "x_offset": {"hours": 3}, "y_offset": 0.5}, "series_output": [{"series_id": (n + i) * 10}]}]})
+    return {"timestart": (datetime.now() - timedelta(days=days)).isoformat(), "timeend": datetime.now().isoformat(), "time_offset": {"hours": 0}, "nodes": nodes}
+
+def benchmarkProcessGraph(n : int=100,max_workers : int=8,latency : float=0.2) -> dict:
+    """
+    compares batchProcessInput with scheduler=stages and scheduler=dag on a synthetic topology of n observed nodes (see syntheticTopology), with simulated downloads lasting latency seconds on average (exponential distribution), and checks that results are equal
+    """
+    import pydrodelta.analysis as analysis
+    config = syntheticTopology(n)
+    if a5.metadata_cache.get("var",2) is None:
+        # in-memory only, so that the benchmark runs offline
+        a5.metadata_cache.setEntry("var",2,{"id": 2, "timeSupport": {"hours": 0}})
+    rng = np.random.default_rng(0)
+    latencies = {serie["series_id"]: rng.exponential(latency) for node in config["nodes"] for variable in node["variables"] for serie in variable.get("series",[])}
+    results = {}
+    seconds = {}
+    for scheduler in ["stages","dag"]:
+        topology = analysis.Topology(config)
+        topology.obs_cache = SyntheticObsSource(latencies)
+        results[scheduler], seconds[scheduler] = timeit(topology.batchProcessInput,max_workers=max_workers,scheduler=scheduler)
+        results[scheduler] = topology
+    for node_stages, node_dag in zip(results["stages"].nodes,results["dag"].nodes):
+        for var_id, variable in node_stages.variables.items():
+            pandas.testing.assert_frame_equal(util.decodeTags(variable.data),util.decodeTags(node_dag.variables[var_id].data))
+    result = {
+        "nodes": len(config["nodes"]),
+        "max_workers": max_workers,
+        "stages_seconds": seconds["stages"],
+        "dag_seconds": seconds["dag"],
+        "speedup": seconds["stages"] / seconds["dag"]
+    }
+    print("batchProcessInput, %i nodes, %i workers, mean download latency %.2f s: stages %.2f s, dag %.2f s, speedup %.1fx" % (result["nodes"],max_workers,latency,seconds["stages"],seconds["dag"],result["speedup"]))
+    return result
+
+def benchmarkProcessPool(n : int=288,processes : list=None) -> list:
+    """
+    times batchProcessInput on a synthetic topology of n observed nodes (see syntheticTopology, downloads without latency) sequentially and with the series processing stages on pools of 1, 2, 4... worker processes (up to the number of cores), and checks that results are equal
+    """
+    import pydrodelta.analysis as analysis
+    config = syntheticTopology(n)
+    if a5.metadata_cache.get("var",2) is None:
+        # in-memory only, so that the benchmark runs offline
+        a5.metadata_cache.setEntry("var",2,{"id": 2, "timeSupport": {"hours": 0}})
+    latencies = {serie["series_id"]: 0 for node in config["nodes"] for variable in node["variables"] for serie in variable.get("series",[])}
+    if processes is None:
+        processes = [2 ** i for i in range(int(np.log2(os.cpu_count() or 1)) + 1)]
+    results = []
+    reference = None
+    for count in [None] + processes:
+        topology = analysis.Topology(config)
+        topology.obs_cache = SyntheticObsSource(latencies)
+        result, seconds = timeit(topology.batchProcessInput,processes=count)
+        if reference is None:
+            reference = topology
+        else:
+            for node, reference_node in zip(topology.nodes,reference.nodes):
+                for var_id, variable in node.variables.items():
+                    pandas.testing.assert_frame_equal(util.decodeTags(variable.data),util.decodeTags(reference_node.variables[var_id].data))
+        results.append({"processes": count, "seconds": seconds})
+        print("batchProcessInput, %i nodes, %s: %.2f s" % (len(config["nodes"]),"%i processes" % count if count is not None else "sequential",seconds))
+    return results
+
+def benchmarkDerivationGraph(n : int=50,depth : int=8,max_workers : int=8) -> dict:
+    """
+    times Topology.derive sequentially and with max_workers threads on a synthetic topology of n observed nodes (see syntheticTopology), each origin of a chain of depth nodes derived one from the other, and checks that results are equal. Checks also that batchProcessInput gives the same results with the chains defined in reverse order (each node before the node it derives from)
+    """
+    import pydrodelta.analysis as analysis
+    config = syntheticTopology(n)
+    config["nodes"] = config["nodes"][:n]
+    for level in range(1,depth + 1):
+        for i in range(1,n + 1):
+            node_id = n * level + i
+            config["nodes"].append({"id": node_id, "name": "derived node %i" % node_id, "time_interval": {"hours": 1}, "variables": [{"id": 2, "derived": True, "derived_from": {"node_id": node_id - n, "var_id": 2, "x_offset": {"hours": 1}, "y_offset": 0.1}, "series_output": [{"series_id": node_id * 10}]}]})
+    if a5.metadata_cache.get("var",2) is None:
+        # in-memory only, so that the benchmark runs offline
+        a5.metadata_cache.setEntry("var",2,{"id": 2, "timeSupport": {"hours": 0}})
+    latencies = {serie["series_id"]: 0 for node in config["nodes"] for variable in node["variables"] for serie in variable.get("series",[])}
+    results = {}
+    for order in ["forward","reverse"]:
+        topology, construction_seconds = timeit(analysis.Topology,{**config, "nodes": config["nodes"] if order == "forward" else config["nodes"][::-1]})
+        topology.obs_cache = SyntheticObsSource(latencies)
+        topology.batchProcessInput()
+        results[order] = {(node.id,var_id): util.decodeTags(variable.data) for node in topology.nodes for var_id, variable in node.variables.items()}
+    for key, data in results["forward"].items():
+        pandas.testing.assert_frame_equal(data,results["reverse"][key])
+    seconds = {}
+    for workers in [1,max_workers]:
+        result, seconds[workers] = timeit(topology.derive,max_workers=workers)
+        results[workers] = {(node.id,var_id): util.decodeTags(variable.data) for node in topology.nodes for var_id, variable in node.variables.items()}
+    for key, data in results[1].items():
+        pandas.testing.assert_frame_equal(data,results[max_workers][key])
+    result = {
+        "nodes": len(config["nodes"]),
+        "construction_seconds": construction_seconds,
+        "sequential_seconds": seconds[1],
+        "parallel_seconds": seconds[max_workers],
+        "speedup": seconds[1] / seconds[max_workers]
+    }
+    print("derive, %i nodes (%i chains of %i derived nodes): construction %.2f s, sequential %.2f s, %i workers %.2f s, speedup %.1fx" % (result["nodes"],n,depth,construction_seconds,seconds[1],max_workers,seconds[max_workers],result["speedup"]))
+    return result
+
+class SyntheticArchive():
+    """
+    stands in for the a5 API in benchmarks (read_function of ObservacionesCache): each series has one observation every 15 minutes (with jitter, some nulls and outliers), which depends only on its time, so that reading a longer time range returns the same observations plus the new ones. Observations can be revised. Counts the observations read
+    """
+    def __init__(self):
+        self.revisions = {}
+        self.count = 0
+        self._lock = threading.Lock()
+    def revise(self,series_id : int,time,valor : float):
+        """
+        sets the value of the observation of series_id at or after time
+        """
+        self.revisions.setdefault(series_id,{})[int(-(-pandas.Timestamp(time).value // 900000000000))] = valor
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual") -> dict:
+        timestart, timeend = pandas.Timestamp(timestart).value, pandas.Timestamp(timeend).value
+        steps = np.arange(timestart // 900000000000 - 1,timeend // 900000000000 + 1)
+        times = steps * 900000000000 + (steps * 7919 + series_id * 104729) % 600 * 1000000000
+        values = np.sin(steps / 96 + series_id) + ((steps * 31 + series_id) % 17 - 8) / 40
+        values[(steps + series_id) % 11 == 0] = np.nan
+        values[(steps * 13 + series_id) % 97 == 0] = 5
+        for step, valor in self.revisions.get(series_id,{}).items():
+            values[steps == step] = valor
+        mask = (times >= timestart) & (times <= timeend)
+        with self._lock:
+            self.count += int(mask.sum())
+        return {"id": series_id, "tipo": tipo, "estacion": {"nombre": "synthetic", "nivel_alerta": None, "nivel_evacuacion": None, "nivel_aguas_bajas": None}, "observaciones": SimpleNamespace(timestart=times[mask],valor=values[mask])}
+
+class SyntheticObsCache(ObservacionesCache):
+    """
+    ObservacionesCache reading from a SyntheticArchive instead of the a5 API
+    """
+    def __init__(self,path : str,archive : SyntheticArchive,refresh_window : timedelta=None):
+        super().__init__(path,refresh_window=refresh_window)
+        self.archive = archive
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual",refresh_window : timedelta=None,read_function=None) -> tuple:
+        return super().readSerie(series_id,timestart,timeend,tipo=tipo,refresh_window=refresh_window,read_function=self.archive.readSerie)
+
+def benchmarkIncremental(n : int=100,hours : int=3,days : int=365) -> dict:
+    """
+    runs batchProcessInput on a synthetic topology of n observed nodes (see syntheticTopology; outliers are removed from the first series and the second one is averaged over 6 hours), then moves timeend hours ahead, revises one observation per series within the refresh window, and runs again incrementally (state_cache and obs_cache) and with a full recompute. Checks that results are equal and compares times and downloaded observations
+    """
+    import pydrodelta.analysis as analysis
+    import tempfile
+    import shutil
+    config = syntheticTopology(n,days=days)
+    for node in config["nodes"]:
+        for variable in node["variables"]:
+            if "series" in variable:
+                variable["series"][0]["lim_outliers"] = [-2,2]
+                variable["series"][1]["moving_average"] = {"hours": 6}
+    today = datetime.now().replace(hour=0,minute=0,second=0,microsecond=0)
+    config["timestart"] = (today - timedelta(days=days)).isoformat()
+    config["timeend"] = today.isoformat()
+    config["time_offset_start"] = {"hours": 0}
+    if a5.metadata_cache.get("var",2) is None:
+        # in-memory only, so that the benchmark runs offline
+        a5.metadata_cache.setEntry("var",2,{"id": 2, "timeSupport": {"hours": 0}})
+    archive = SyntheticArchive()
+    refresh_window = timedelta(hours=6)
+    path = tempfile.mkdtemp()
+    try:
+        def run(time_offset_end,cache_path,state_path=None):
+            topology = analysis.Topology({**config, "time_offset_end": {"hours": time_offset_end}})
+            topology.obs_cache = SyntheticObsCache(os.path.join(path,cache_path),archive,refresh_window=refresh_window)
+            topology.state_cache = StateCache(os.path.join(path,state_path)) if state_path is not None else None
+            count = archive.count
+            result, seconds = timeit(topology.batchProcessInput)
+            return topology, seconds, archive.count - count
+        run(0,"obs","state")
+        for node in config["nodes"]:
+            for variable in node["variables"]:
+                for serie in variable.get("series",[]):
+                    archive.revise(serie["series_id"],today - timedelta(hours=2),-1.5)
+        incremental, incremental_seconds, incremental_count = run(hours,"obs","state")
+        full, full_seconds, full_count = run(hours,"obs_full")
+    finally:
+        shutil.rmtree(path)
+    for node, full_node in zip(incremental.nodes,full.nodes):
+        for var_id, variable in node.variables.items():
+            pandas.testing.assert_frame_equal(util.decodeTags(variable.data),util.decodeTags(full_node.variables[var_id].data),rtol=1e-9)
+            for serie, full_serie in zip(variable.series,full_node.variables[var_id].series):
+                if isinstance(serie,analysis.NodeSerie):
+                    pandas.testing.assert_frame_equal(util.decodeTags(serie.data),util.decodeTags(full_serie.data),rtol=1e-9)
+    result = {
+        "nodes": len(config["nodes"]),
+        "incremental_seconds": incremental_seconds,
+        "full_seconds": full_seconds,
+        "incremental_observations": incremental_count,
+        "full_observations": full_count
+    }
+    print("batchProcessInput, %i nodes, %i days, %i hours later: incremental %.2f s (%i observations downloaded), full recompute %.2f s (%i observations downloaded). Results are equal" % (result["nodes"],days,hours,incremental_seconds,incremental_count,full_seconds,full_count))
+    return result
+
+benchmarks = {
+    "observacionesListToDataFrame": benchmarkObservacionesListToDataFrame,
+    "interpolationTags": benchmarkInterpolationTags,
+    "createDatetimeSequence": benchmarkCreateDatetimeSequence,
+    "columnarStore": benchmarkColumnarStore,
+    "offsetIndex": benchmarkOffsetIndex,
+    "coalesceSeries": benchmarkCoalesceSeries,
+    "movingAverage": benchmarkMovingAverage,
+    "processGraph": benchmarkProcessGraph,
+    "processPool": benchmarkProcessPool,
+    "derivationGraph": benchmarkDerivationGraph,
+    "incremental": benchmarkIncremental
+}
+
+if __name__ == "__main__":
+    names = [sys.argv[1]] if len(sys.argv) > 1 else list(benchmarks.keys())
+    for name in names:
+        if len(sys.argv) > 2:
+            benchmarks[name](int(sys.argv[2]))
+        else:
+            benchmarks[name]()
@@ -0,0 +1,291 @@
+import numpy as np
+import pandas
+import json
+import os
+import time
+import threading
+import logging
+import copy
+import pickle
+import atexit
+from collections import OrderedDict
+from datetime import timedelta
+import pydrodelta.util as util
+
+class ObservacionesCache():
+    """
+    Persistent on-disk cache of a5 observations, keyed by (tipo, series_id). Each entry is stored as a columnar .npz file (timestart as int64 UTC nanoseconds, valor as float64) together with the time range already fetched (coverage), the time of its first download and the series metadata. On read, only the time ranges not covered by the entry (plus a trailing refresh window, since late-arriving observations get revised) are requested from a5 and merged into the entry
+
+    :param path: cache directory
+    :param ttl: maximum age of an entry, counted from its first download. Older entries are discarded and fully downloaded again. If None, entries never expire
+    :type ttl: timedelta
+    :param refresh_window: trailing window of the cached coverage which is always downloaded again
+    :type refresh_window: timedelta
+    """
+    def __init__(self,path : str,ttl : timedelta=None,refresh_window : timedelta=None):
+        self.path = path
+        self.ttl = ttl
+        self.refresh_window = refresh_window if refresh_window is not None else timedelta(seconds=0)
+        os.makedirs(self.path,exist_ok=True)
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+    def getLock(self,tipo : str,series_id : int) -> threading.Lock:
+        with self._locks_lock:
+            if (tipo,series_id) not in self._locks:
+                self._locks[(tipo,series_id)] = threading.Lock()
+            return self._locks[(tipo,series_id)]
+    def getFilePath(self,tipo : str,series_id : int) -> str:
+        return os.path.join(self.path,"%s_%i.npz" % (tipo,series_id))
+    def read(self,tipo : str,series_id : int) -> dict:
+        """
+        returns cache entry {timestart: int64 array, valor: float64 array, coverage: (int, int), created: float, metadata: dict} or None if not found
+        """
+        file_path = self.getFilePath(tipo,series_id)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with np.load(file_path,allow_pickle=False) as npz:
+                return {
+                    "timestart": npz["timestart"],
+                    "valor": npz["valor"],
+                    "coverage": (int(npz["coverage"][0]),int(npz["coverage"][1])),
+                    "created": float(npz["created"]),
+                    "metadata": json.loads(str(npz["metadata"]))
+                }
+        except Exception as e:
+            logging.warning("Invalid cache entry %s, ignoring: %s" % (file_path,str(e)))
+            return None
+    def write(self,tipo : str,series_id : int,entry : dict):
+        file_path = self.getFilePath(tipo,series_id)
+        tmp_path = "%s.%i.tmp" % (file_path,threading.get_ident())
+        with open(tmp_path,"wb") as f:
+            np.savez(f,
+                timestart = entry["timestart"],
+                valor = entry["valor"],
+                coverage = np.array(entry["coverage"],dtype=np.int64),
+                created = np.float64(entry["created"]),
+                metadata = np.str_(json.dumps(entry["metadata"])))
+        os.replace(tmp_path,file_path)
+    def invalidate(self,tipo : str,series_id : int):
+        """
+        removes cache entry of series
+        """
+        file_path = self.getFilePath(tipo,series_id)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+    def clear(self):
+        """
+        removes all cache entries
+        """
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".npz"):
+                os.remove(os.path.join(self.path,file_name))
+    def isExpired(self,entry : dict) -> bool:
+        return self.ttl is not None and time.time() - entry["created"] > self.ttl.total_seconds()
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual",refresh_window : timedelta=None,read_function=None) -> tuple:
+        """
+        Reads observations of series from cache, downloading only the missing time ranges from a5
+
+        :param series_id: series identifier
+        :param timestart: begin date
+        :param timeend: end date
+        :param tipo: series type (puntual, areal, raster)
+        :param refresh_window: overrides self.refresh_window for this call, e.g. to force the download of a longer trailing window
+        :param read_function: function used to download the series. Defaults to a5.readSerie
+        :returns: (metadata : dict, data : DataFrame with valor and tag columns, indexed by timestart)
+        """
+        if read_function is None:
+            import pydrodelta.a5 as a5
+            read_function = a5.readSerie
+        timestart = util.tryParseAndLocalizeDate(timestart)
+        timeend = util.tryParseAndLocalizeDate(timeend)
+        timestart_ns = pandas.Timestamp(timestart).value
+        timeend_ns = pandas.Timestamp(timeend).value
+        refresh_window = refresh_window if refresh_window is not None else self.refresh_window
+        with self.getLock(tipo,series_id):
+            entry = self.read(tipo,series_id)
+            if entry is not None and self.isExpired(entry):
+                logging.debug("Cache entry for %s series %i expired" % (tipo,series_id))
+                entry = None
+            if entry is None or timestart_ns > entry["coverage"][1] or timeend_ns < entry["coverage"][0]:
+                entry = {
+                    "timestart": np.array([],dtype=np.int64),
+                    "valor": np.array([],dtype=np.float64),
+                    "coverage": (timestart_ns,timeend_ns),
+                    "created": time.time(),
+                    "metadata": None
+                }
+                ranges = [(timestart_ns,timeend_ns)]
+            else:
+                ranges = []
+                if timestart_ns < entry["coverage"][0]:
+                    ranges.append((timestart_ns,entry["coverage"][0]))
+                refresh_start = max(entry["coverage"][1] - int(refresh_window.total_seconds() * 1e9),entry["coverage"][0],timestart_ns)
+                if timeend_ns > refresh_start:
+                    ranges.append((refresh_start,timeend_ns))
+                entry["coverage"] = (min(entry["coverage"][0],timestart_ns),max(entry["coverage"][1],timeend_ns))
+            for range_start, range_end in ranges:
+                logging.debug("Cache miss for %s series %i, downloading %s to %s" % (tipo,series_id,nsToDate(range_start).isoformat(),nsToDate(range_end).isoformat()))
+                serie = read_function(series_id,nsToDate(range_start),nsToDate(range_end),tipo=tipo)
+                observaciones = serie["observaciones"]
+                del serie["observaciones"]
+                entry["metadata"] = serie
+                keep = (entry["timestart"] < range_start) | (entry["timestart"] > range_end)
+                new_timestart, new_valor = observacionesToArrays(observaciones)
+                entry["timestart"] = np.concatenate([entry["timestart"][keep],new_timestart])
+                entry["valor"] = np.concatenate([entry["valor"][keep],new_valor])
+            if len(ranges):
+                order = np.argsort(entry["timestart"],kind="stable")
+                entry["timestart"] = entry["timestart"][order]
+                entry["valor"] = entry["valor"][order]
+                self.write(tipo,series_id,entry)
+        mask = (entry["timestart"] >= timestart_ns) & (entry["timestart"] <= timeend_ns)
+        data = arraysToDataFrame(entry["timestart"][mask],entry["valor"][mask],tag="obs")
+        return dict(entry["metadata"]), data
+
+def nsToDate(value : int):
+    return pandas.Timestamp(value,tz="UTC").tz_convert(util.localtz).to_pydatetime()
+
+def observacionesToArrays(observaciones : list) -> tuple:
+    """
+    converts list of observaciones [{timestart: str, valor: float},...] (or a5.ObservacionesArrays) to (int64 UTC nanoseconds array, float64 array)
+    """
+    if hasattr(observaciones,"timestart") and hasattr(observaciones,"valor"):
+        return observaciones.timestart, observaciones.valor
+    if not len(observaciones):
+        return np.array([],dtype=np.int64), np.array([],dtype=np.float64)
+    timestart = util.tryParseAndLocalizeDates([x["timestart"] for x in observaciones]).asi8
+    valor = np.array([np.nan if x["valor"] is None else x["valor"] for x in observaciones],dtype=np.float64)
+    return timestart, valor
+
+def arraysToDataFrame(timestart : np.ndarray,valor : np.ndarray,tag : str=None) -> pandas.DataFrame:
+    """
+    builds observations DataFrame (timestart index localized to America/Argentina/Buenos_Aires) from int64 UTC nanoseconds and float64 arrays
+    """
+    index = pandas.DatetimeIndex(pandas.to_datetime(timestart,utc=True)).tz_convert(util.localtz).rename("timestart")
+    data = pandas.DataFrame({"valor": valor},index=index)
+    if tag is not None:
+        data["tag"] = tag
+    return data
+
+class StateCache():
+    """
+    Persistent on-disk store of the processed state of the observed variables of a topology (see ObservedNodeVariable.processSeriesIncremental): one pickle file per variable, keyed by node position, node id and variable id. On the next run, only the part of the time grid reached by new or revised observations is processed again
+
+    :param path: state directory
+    """
+    def __init__(self,path : str):
+        self.path = path
+        os.makedirs(self.path,exist_ok=True)
+    def getFilePath(self,key : str) -> str:
+        return os.path.join(self.path,"%s.pkl" % key)
+    def read(self,key : str) -> dict:
+        """
+        returns state entry or None if not found
+        """
+        file_path = self.getFilePath(key)
+        if not os.path.exists(file_path):
+            return None
+        try:
+            with open(file_path,"rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            logging.warning("Invalid state entry %s, ignoring: %s" % (file_path,str(e)))
+            return None
+    def write(self,key : str,entry : dict):
+        file_path = self.getFilePath(key)
+        tmp_path = "%s.%i.tmp" % (file_path,threading.get_ident())
+        with open(tmp_path,"wb") as f:
+            pickle.dump(entry,f,protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path,file_path)
+    def clear(self):
+        """
+        removes all state entries, so that the next run processes all the series
+        """
+        for file_name in os.listdir(self.path):
+            if file_name.endswith(".pkl"):
+                os.remove(os.path.join(self.path,file_name))
+
+class MetadataCache():
+    """
+    Process-wide LRU cache of a5 metadata, keyed by (kind, id), with optional persistent backing store (json file). Currently only variable metadata (kind "var", see a5.readVar) goes through it: series metadata comes in the same response as the observations (a5.readSerie, a5.readSeriesObservaciones) and is persisted by ObservacionesCache when obs_cache is set. When a backing store is set, entries survive between runs, so that the variables of a topology can be read offline from a warm cache. New entries are written to the backing store by flush (called at exit), not on each set
+
+    :param path: json file of the persistent backing store. If None, the cache lives only in memory
+    :param maxsize: maximum number of entries kept in memory
+    """
+    def __init__(self,path : str=None,maxsize : int=1024):
+        self.path = path
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.store = None
+        self.pending = {}
+        self._lock = threading.Lock()
+        if self.path is not None:
+            atexit.register(self.flush)
+    def loadStore(self):
+        if self.store is not None:
+            return
+        self.store = {}
+        if self.path is not None and os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.store = json.load(f)
+            except Exception as e:
+                logging.warning("Invalid metadata cache file %s, ignoring: %s" % (self.path,str(e)))
+    def writeStore(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)),exist_ok=True)
+        tmp_path = "%s.%i.%i.tmp" % (self.path,os.getpid(),threading.get_ident())
+        with open(tmp_path,"w") as f:
+            json.dump(self.store,f)
+        os.replace(tmp_path,self.path)
+    def get(self,kind : str,key):
+        """
+        returns a copy of the cached metadata or None if not found
+        """
+        with self._lock:
+            if (kind,str(key)) in self.entries:
+                self.entries.move_to_end((kind,str(key)))
+                return copy.deepcopy(self.entries[(kind,str(key))])
+            if self.path is None:
+                return None
+            self.loadStore()
+            if kind in self.store and str(key) in self.store[kind]:
+                value = self.store[kind][str(key)]
+                self.setEntry(kind,key,value)
+                return copy.deepcopy(value)
+            return None
+    def set(self,kind : str,key,value):
+        with self._lock:
+            self.setEntry(kind,key,copy.deepcopy(value))
+            if self.path is not None:
+                self.loadStore()
+                self.store.setdefault(kind,{})[str(key)] = self.entries[(kind,str(key))]
+                self.pending.setdefault(kind,{})[str(key)] = self.entries[(kind,str(key))]
+    def flush(self):
+        """
+        writes the entries set since the last flush to the backing store. The file is read again first, so that entries written meanwhile by other processes are kept
+        """
+        with self._lock:
+            if self.path is None or not len(self.pending):
+                return
+            self.store = None
+            self.loadStore()
+            for kind, values in self.pending.items():
+                self.store.setdefault(kind,{}).update(values)
+            self.writeStore()
+            self.pending = {}
+    def setEntry(self,kind : str,key,value):
+        self.entries[(kind,str(key))] = value
+        self.entries.move_to_end((kind,str(key)))
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+    def clear(self):
+        """
+        removes all entries from memory and from the backing store
+        """
+        with self._lock:
+            self.entries.clear()
+            self.store = {}
+            self.pending = {}
+            if self.path is not None and os.path.exists(self.path):
+                os.remove(self.path)
@@ -0,0 +1,156 @@
+import heapq
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class TaskGraph():
+    """
+    Directed acyclic graph of tasks. Each task runs as soon as all the tasks it depends on are done, on a pool of worker threads. Ready tasks are started in order of insertion
+
+    Tasks marked as exclusive never run concurrently with each other (e.g. tasks using matplotlib.pyplot, which is not thread-safe)
+    """
+    def __init__(self):
+        self.tasks = {}
+        self.order = {}
+        self.dependencies = {}
+        self.dependents = {}
+        self.exclusive = set()
+        self._exclusive_lock = threading.Lock()
+    def __len__(self):
+        return len(self.tasks)
+    def __contains__(self,key):
+        return key in self.tasks
+    def addTask(self,key,function,dependencies : list=None,exclusive : bool=False):
+        """
+        adds task. function is called without arguments
+
+        :param key: task identifier (hashable)
+        :param function: callable
+        :param dependencies: keys of tasks that must be done before this task starts. They may be added later
+        :param exclusive: if True, the task doesn't run concurrently with other exclusive tasks
+        """
+        dependencies = dependencies if dependencies is not None else []
+        if key in self.tasks:
+            raise Exception("Duplicate task: %s" % str(key))
+        self.tasks[key] = function
+        self.order[key] = len(self.order)
+        self.dependencies.setdefault(key,set())
+        self.dependents.setdefault(key,set())
+        if exclusive:
+            self.exclusive.add(key)
+        for dependency in dependencies:
+            self.addDependency(key,dependency)
+    def addDependency(self,key,dependency):
+        """
+        makes task key wait for task dependency
+        """
+        if key == dependency:
+            return
+        self.dependencies.setdefault(key,set()).add(dependency)
+        self.dependents.setdefault(dependency,set()).add(key)
+    def check(self):
+        """
+        raises if a dependency is not a task of the graph
+        """
+        for key, dependencies in self.dependencies.items():
+            if key not in self.tasks:
+                raise Exception("Task %s not found (dependent: %s)" % (str(key),", ".join([str(x) for x in self.dependents[key]])))
+    def getOrder(self) -> list:
+        """
+        returns task keys in topological order (ties broken by order of insertion). Raises if the graph has a cycle
+        """
+        order = self.sortTasks()
+        if len(order) < len(self.tasks):
+            raise Exception("Dependency cycle found among tasks: %s" % ", ".join([str(key) for key in self.getCyclic(order)]))
+        return order
+    def getCyclic(self,order : list=None) -> list:
+        """
+        returns the keys of the tasks that are part of a dependency cycle or depend on one, in order of insertion
+
+        :param order: result of sortTasks. If None, it is computed
+        """
+        order = set(order if order is not None else self.sortTasks())
+        return [key for key in self.tasks if key not in order]
+    def sortTasks(self) -> list:
+        """
+        returns task keys in topological order (ties broken by order of insertion), leaving out the tasks that are part of a dependency cycle or depend on one
+        """
+        self.check()
+        pending = {key: len(dependencies) for key, dependencies in self.dependencies.items()}
+        ready = [(self.order[key],key) for key, count in pending.items() if count == 0]
+        heapq.heapify(ready)
+        order = []
+        while len(ready):
+            key = heapq.heappop(ready)[1]
+            order.append(key)
+            for dependent in self.dependents[key]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    heapq.heappush(ready,(self.order[dependent],dependent))
+        return order
+    def runTask(self,key):
+        if key in self.exclusive:
+            with self._exclusive_lock:
+                return self.tasks[key]()
+        return self.tasks[key]()
+    def run(self,max_workers : int=None) -> dict:
+        """
+        runs all tasks. When a task fails, the tasks that depend on it (directly or not) are skipped. The other tasks still run
+
+        :param max_workers: number of worker threads. If None or 1, tasks run sequentially in topological order
+        :type max_workers: int
+        :returns: dict of failed tasks {key: exception}, in order of insertion
+        """
+        order = self.getOrder()
+        failed = {}
+        skipped = set()
+        if max_workers is None or max_workers <= 1:
+            for key in order:
+                if key in skipped:
+                    continue
+                try:
+                    self.runTask(key)
+                except Exception as e:
+                    failed[key] = e
+                    skipped.update(self.getDescendants(key))
+            return self.sortFailed(failed,skipped)
+        pending = {key: len(self.dependencies[key]) for key in self.tasks}
+        ready = [(self.order[key],key) for key in order if pending[key] == 0]
+        heapq.heapify(ready)
+        running = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while len(ready) or len(running):
+                while len(ready) and len(running) < max_workers:
+                    key = heapq.heappop(ready)[1]
+                    if key in skipped:
+                        continue
+                    running[executor.submit(self.runTask,key)] = key
+                if not len(running):
+                    continue
+                done, not_done = wait(running,return_when=FIRST_COMPLETED)
+                for future in done:
+                    key = running.pop(future)
+                    if future.exception() is not None:
+                        failed[key] = future.exception()
+                        skipped.update(self.getDescendants(key))
+                    for dependent in self.dependents[key]:
+                        pending[dependent] -= 1
+                        if pending[dependent] == 0:
+                            heapq.heappush(ready,(self.order[dependent],dependent))
+        return self.sortFailed(failed,skipped)
+    def getDescendants(self,key) -> set:
+        """
+        returns keys of the tasks that depend (directly or not) on task key
+        """
+        descendants = set()
+        stack = list(self.dependents[key])
+        while len(stack):
+            dependent = stack.pop()
+            if dependent not in descendants:
+                descendants.add(dependent)
+                stack.extend(self.dependents[dependent])
+        return descendants
+    def sortFailed(self,failed : dict,skipped : set) -> dict:
+        if len(skipped):
+            logging.warning("%i tasks skipped because of failed dependencies" % len(skipped))
+        return {key: failed[key] for key in sorted(failed,key=lambda key: self.order[key])}
@@ -50,15 +50,17 @@ class Plan():
             self.topology = analysis.Topology(yaml.load(f,yaml.CLoader),plan=self)
             f.close()
         self.procedures = [Procedure(x,self) for x in params["procedures"]]
-    def execute(self,include_prono=True):
+    def execute(self,include_prono=True,max_workers=None):
         """
         Runs analysis and then each procedure sequentially
 
         :param include_prono: if True (default), concatenates observed and forecasted boundary conditions. Else, reads only observed data.
         :type include_prono: bool
+        :param max_workers: maximum number of concurrent series download requests. If None, uses topology.max_workers
+        :type max_workers: int
         :returns: None
         """
-        self.topology.batchProcessInput(include_prono=include_prono)
+        self.topology.batchProcessInput(include_prono=include_prono,max_workers=max_workers)
         for procedure in self.procedures:
             procedure.run()
 
@@ -90,13 +92,10 @@ class ProcedureBoundary():
             self._variable = None
             self._node = None
     def setNodeVariable(self,plan):
-        for t_node in plan.topology.nodes:
-            if t_node.id == self.node_id:
-                self._node = t_node
-                if self.var_id in t_node.variables:
-                    self._variable = t_node.variables[self.var_id]
-                    return
-        raise("ProcedureBoundary.setNodeVariable error: node with id: %s , var %i not found in topology" % (str(self.node_id), self.var_id))
+        self._node = plan.topology.getNode(self.node_id)
+        self._variable = plan.topology.getVariable(self.node_id,self.var_id)
+        if self._variable is None:
+            raise Exception("ProcedureBoundary.setNodeVariable error: node with id: %s , var %i not found in topology" % (str(self.node_id), self.var_id))
 
 class Procedure():
     """
@@ -247,7 +246,8 @@ procedureFunctionDict = {
 @click.option("--upload", "-u", is_flag=True, help="Upload output to database API", default=False, show_default=True)
 @click.option("--include_prono", "-P", is_flag=True, help="Concatenate series_prono to output series",type=bool, default=False, show_default=True)
 @click.option("--verbose", "-v", is_flag=True, help="log to stdout", default=False, show_default=True)
-def run_plan(self,config_file,csv,json,pivot,upload,include_prono,verbose):
+@click.option("--max_workers", "-w", help="Maximum number of concurrent series download/upload requests (overrides topology max_workers)", type=int, default=None)
+def run_plan(self,config_file,csv,json,pivot,upload,include_prono,verbose,max_workers):
     """
     run plan from plan config file
     
@@ -263,13 +263,13 @@ def run_plan(self,config_file,csv,json,pivot,upload,include_prono,verbose):
         root.addHandler(handler)
     t_config = yaml.load(open(config_file),yaml.CLoader)
     plan = Plan(t_config)
-    plan.execute(include_prono=include_prono)
+    plan.execute(include_prono=include_prono,max_workers=max_workers)
     if csv is not None:
         plan.topology.saveData(csv,pivot=pivot)
     if json is not None:
         plan.topology.saveData(json,format="json",pivot=pivot)
     if upload:
-        plan.topology.uploadData()
+        plan.topology.uploadData(max_workers=max_workers)
         if include_prono:
             plan.topology.uploadDataAsProno()
 
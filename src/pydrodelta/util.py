@@ -10,6 +10,8 @@ import matplotlib.pyplot as plt
 import logging
 import matplotlib.dates as mdates
 from matplotlib.dates import DateFormatter
+import threading
+from collections import OrderedDict
 
 def interval2timedelta(interval):
     days = 0
@@ -69,6 +71,24 @@ def tryParseAndLocalizeDate(date_string,timezone='America/Argentina/Buenos_Aires
         date = date.astimezone(pytz.timezone(timezone))
     return date
 
+def tryParseAndLocalizeDates(dates,timezone='America/Argentina/Buenos_Aires') -> pandas.DatetimeIndex:
+    """
+    Vectorized tryParseAndLocalizeDate. ISO 8601 strings with explicit UTC offset (or Z) are parsed in a single pandas.to_datetime call and converted to timezone. Other values (naive strings, datetime objects, malformed strings) fall back to tryParseAndLocalizeDate one by one
+
+    :param dates: sequence of date strings or datetime objects
+    :param timezone: time zone of the result (and of naive dates)
+    :returns: DatetimeIndex localized to timezone. Nonexistent local times are set to NaT
+    """
+    dates = pandas.Series(dates,dtype=object).reset_index(drop=True)
+    is_str = dates.map(lambda x: isinstance(x,str)).astype(bool)
+    has_offset = is_str & dates.where(is_str,"").astype(str).str.contains(r"[T ]\d{2}.*(?:Z|[+-]\d{2}(?::?\d{2})?)$",regex=True)
+    parsed = pandas.Series(pandas.NaT,index=dates.index,dtype="datetime64[ns, UTC]")
+    parsed[has_offset] = pandas.to_datetime(dates[has_offset],utc=True,errors="coerce")
+    fallback = parsed.isna()
+    if fallback.any():
+        parsed[fallback] = pandas.to_datetime([tryParseAndLocalizeDate(x,timezone) for x in dates[fallback]],utc=True)
+    return pandas.DatetimeIndex(parsed).tz_convert(pytz.timezone(timezone))
+
 def roundDownDate(date : datetime,timeInterval : timedelta,timeOffset : timedelta=None) -> datetime:
     if timeInterval.microseconds == 0:
         date = date.replace(microsecond=0)
@@ -83,27 +103,356 @@ def roundDownDate(date : datetime,timeInterval : timedelta,timeOffset : timedelt
     return date
 
 def roundDate(date : datetime,timeInterval : timedelta,timeOffset : timedelta=None, to="up") -> datetime:
+    """
+    rounds date to the regular grid that starts at local midnight (+ timeOffset) of the same day with step timeInterval. With to="up" returns the first grid step not earlier than date, else the grid step before it. The number of steps is computed by integer division of the elapsed time since the grid origin (the origin is localized, so DST transitions are taken into account)
+    """
     date_0 = tryParseAndLocalizeDate(datetime.combine(date.date(),datetime.min.time()))
     if timeOffset is not None:
-        date_0 = date_0 + timeOffset 
-    while date_0 < date:
-        date_0 = date_0 + timeInterval
+        date_0 = date_0 + timeOffset
+    if date_0 < date:
+        steps = -((date_0 - date) // timeInterval)
+        date_0 = date_0 + timeInterval * int(steps)
+        if date_0 < date:
+            date_0 = date_0 + timeInterval
     if to == "up":
         return date_0
     else:
         return date_0 - timeInterval
 
+datetime_sequence_cache = OrderedDict()
+datetime_sequence_cache_maxsize = 256
+datetime_sequence_cache_lock = threading.Lock()
+
 def createDatetimeSequence(datetime_index : pandas.DatetimeIndex=None, timeInterval=timedelta(days=1), timestart=None, timeend=None, timeOffset=None):
     #Fechas desde timestart a timeend con un paso de timeInterval
     #data: dataframe con index tipo datetime64[ns, America/Argentina/Buenos_Aires]
     #timeOffset sólo para timeInterval n days
+    #las secuencias se guardan en datetime_sequence_cache, de modo que las series con igual timestart, timeend, timeInterval y timeOffset comparten el mismo DatetimeIndex (inmutable)
     if datetime_index is None and (timestart is None or timeend is None):
         raise Exception("Missing datetime_index or timestart+timeend")
     timestart = timestart if timestart is not None else datetime_index.min()
-    timestart = roundDate(timestart,timeInterval,timeOffset,"up")
     timeend = timeend if timeend  is not None else datetime_index.max()
+    key = (timestart, str(timestart.tzinfo), timeend, str(timeend.tzinfo), timeInterval, timeOffset)
+    with datetime_sequence_cache_lock:
+        if key in datetime_sequence_cache:
+            datetime_sequence_cache.move_to_end(key)
+            return datetime_sequence_cache[key].copy()
+    timestart = roundDate(timestart,timeInterval,timeOffset,"up")
     timeend = roundDate(timeend,timeInterval,timeOffset,"down")
-    return pandas.date_range(start=timestart, end=timeend, freq=pandas.DateOffset(days=timeInterval.days, hours=timeInterval.seconds // 3600, minutes = (timeInterval.seconds // 60) % 60))
+    # sub-daily intervals step in absolute time (Timedelta), as roundDate does. DateOffset steps in wall time and fails at DST transitions
+    freq = pandas.Timedelta(timeInterval) if timeInterval.days == 0 else pandas.DateOffset(days=timeInterval.days, hours=timeInterval.seconds // 3600, minutes = (timeInterval.seconds // 60) % 60)
+    sequence = pandas.date_range(start=timestart, end=timeend, freq=freq)
+    with datetime_sequence_cache_lock:
+        datetime_sequence_cache[key] = sequence
+        while len(datetime_sequence_cache) > datetime_sequence_cache_maxsize:
+            datetime_sequence_cache.popitem(last=False)
+    # shallow copy: shares the values array, but name changes of the caller (i.e. rename(inplace=True)) do not reach the cache
+    return sequence.copy()
+
+class TimeGrid():
+    """
+    Regular time grid (DatetimeIndex named timestart) shared by the series of a topology with equal timestart, timeend, time_interval and time_offset. Series regularized to the grid share its index, so that they can be combined by position instead of by index alignment
+
+    :param timestart: begin date (rounded up to the grid)
+    :param timeend: end date (rounded down to the grid)
+    :param time_interval: grid step
+    :param time_offset: offset of the grid origin from local midnight
+    """
+    def __init__(self,timestart,timeend,time_interval : timedelta,time_offset : timedelta=None):
+        self.timestart = timestart
+        self.timeend = timeend
+        self.time_interval = time_interval
+        self.time_offset = time_offset
+        self.index = createDatetimeSequence(None,time_interval,timestart,timeend,time_offset).rename("timestart")
+        self.values = self.index.asi8
+    def __len__(self):
+        return len(self.index)
+    def isAligned(self,data) -> bool:
+        """
+        returns True if index of data (DataFrame or Series) is equal to the grid
+        """
+        return data.index is self.index or data.index.equals(self.index)
+    def positionsIn(self,index : pandas.Index) -> np.ndarray:
+        """
+        returns positions of the grid steps in index (-1 where not found)
+        """
+        if index is self.index:
+            return np.arange(len(self.index))
+        if isinstance(index,pandas.DatetimeIndex) and index.tz is not None and index.is_monotonic_increasing:
+            values = index.asi8
+            positions = np.searchsorted(values,self.values)
+            found = positions < len(values)
+            found[found] = values[positions[found]] == self.values[found]
+            positions[~found] = -1
+            return positions
+        return index.get_indexer(self.index)
+    def slice(self,start : int):
+        """
+        returns the grid from step start to the end
+        """
+        return TimeGrid(self.index[start],self.timeend,self.time_interval,self.time_offset)
+    def take(self,data : pandas.DataFrame) -> pandas.DataFrame:
+        """
+        returns the rows of data at the grid steps, indexed by the grid (same as reindexing data to the grid). data index must be unique
+        """
+        positions = self.positionsIn(data.index)
+        if (positions < 0).any():
+            return data.reindex(self.index)
+        data = data.take(positions)
+        data.index = self.index
+        return data
+
+class ColumnarStore():
+    """
+    Columnar storage of series aligned to a TimeGrid: one 2D float64 array of values [series x timesteps] and one 2D array of tag codes (-1 = missing) with tag categories shared by all rows. Rows are read back as DataFrames whose value column is a view of the store (no copy). The frame of each row is built once and reused until the row is set again, so that repeated reads don't allocate. Row access is thread-safe
+
+    :param time_grid: grid of the stored series
+    :param capacity: initial number of rows. Arrays grow by doubling
+    """
+    def __init__(self,time_grid : TimeGrid,capacity : int=8):
+        self.time_grid = time_grid
+        self.values = np.full((capacity,len(time_grid)),np.nan)
+        self.codes = np.full((capacity,len(time_grid)),-1,dtype=np.int8)
+        self.categories = []
+        self.category_codes = {}
+        self.columns = []
+        self.free_rows = []
+        self.frames = {}
+        self._lock = threading.RLock()
+    def __len__(self):
+        return len(self.columns) - len(self.free_rows)
+    def allocate(self) -> int:
+        """
+        returns index of a new (empty) row
+        """
+        with self._lock:
+            if len(self.free_rows):
+                return self.free_rows.pop()
+            row = len(self.columns)
+            if row >= self.values.shape[0]:
+                capacity = max(1,self.values.shape[0]) * 2
+                values = np.full((capacity,len(self.time_grid)),np.nan)
+                values[:row] = self.values[:row]
+                codes = np.full((capacity,len(self.time_grid)),-1,dtype=self.codes.dtype)
+                codes[:row] = self.codes[:row]
+                self.values, self.codes = values, codes
+                # cached frames view the old arrays
+                self.frames.clear()
+            self.columns.append(None)
+            return row
+    def release(self,row : int):
+        """
+        marks row as free. Values are not cleared, since frames returned by getRow may still view them
+        """
+        with self._lock:
+            self.columns[row] = None
+            self.frames.pop(row,None)
+            self.free_rows.append(row)
+    def canStore(self,data,column : str="valor",tag_column : str="tag") -> bool:
+        """
+        returns True if data is a DataFrame aligned to the grid with a float64 value column and (optionally) a categorical tag column, and no other columns
+        """
+        if not isinstance(data,pandas.DataFrame) or column not in data.columns or not set(data.columns) <= set([column,tag_column]) or not data.columns.is_unique:
+            return False
+        if data[column].dtype != np.float64 or (tag_column in data.columns and not isinstance(data[tag_column].dtype,pandas.CategoricalDtype)):
+            return False
+        return self.time_grid.isAligned(data)
+    def getCategoryCodes(self,categories) -> np.ndarray:
+        """
+        returns store codes of categories, adding the new ones to the store
+        """
+        codes = []
+        for category in categories:
+            if category not in self.category_codes:
+                self.category_codes[category] = len(self.categories)
+                self.categories.append(category)
+            codes.append(self.category_codes[category])
+        if len(self.categories) > np.iinfo(self.codes.dtype).max:
+            self.codes = self.codes.astype(np.int16 if len(self.categories) <= np.iinfo(np.int16).max else np.int32)
+            self.frames.clear()
+        return np.array(codes,dtype=self.codes.dtype)
+    def setRow(self,row : int,data : pandas.DataFrame,column : str="valor",tag_column : str="tag"):
+        """
+        copies data (see canStore) into row
+        """
+        with self._lock:
+            self.values[row] = data[column].values
+            if tag_column in data.columns:
+                tags = data[tag_column]
+                lookup = self.getCategoryCodes(tags.cat.categories)
+                codes = tags.cat.codes.values
+                self.codes[row] = np.where(codes >= 0,lookup[np.maximum(codes,0)] if len(lookup) else -1,-1)
+            else:
+                self.codes[row] = -1
+            self.columns[row] = list(data.columns)
+            self.frames.pop(row,None)
+    def getRow(self,row : int,column : str="valor",tag_column : str="tag") -> pandas.DataFrame:
+        """
+        returns row as DataFrame indexed by the grid. The value column is a view of the store. The frame is cached until the row is set or released, and shared by all reads: callers must not add columns to it (use a shallow copy). A cached frame whose columns were changed anyway is rebuilt
+        """
+        with self._lock:
+            if row in self.frames and self.frames[row][0] == (column,tag_column) and list(self.frames[row][1].columns) == self.columns[row]:
+                return self.frames[row][1]
+            data = {}
+            for name in self.columns[row]:
+                if name == column:
+                    data[name] = self.values[row]
+                else:
+                    data[name] = pandas.Categorical.from_codes(self.codes[row],categories=self.categories)
+            frame = pandas.DataFrame(data,index=self.time_grid.index,copy=False)
+            self.frames[row] = ((column,tag_column),frame)
+            return frame
+
+class DataSnapshot():
+    """
+    Copy-on-write snapshot of a DataFrame (keep_original_data="lazy"). Holds a reference to the frame, which is copied only when protect() is called, i.e. before the frame is mutated in place
+    """
+    def __init__(self,data : pandas.DataFrame):
+        self.data = data
+        self.copied = False
+    def protect(self):
+        if not self.copied and self.data is not None:
+            self.data = self.data.copy(deep=True)
+            self.copied = True
+
+def packDataFrame(data : pandas.DataFrame) -> dict:
+    """
+    returns data as dict of numpy arrays, to be sent to another process: the index as int64 nanoseconds (if it is a DatetimeIndex) and each column as values array, or as codes array and dtype if categorical. None is returned as None
+    """
+    if data is None:
+        return None
+    if isinstance(data.index,pandas.DatetimeIndex):
+        index = {"values": data.index.asi8, "tz": data.index.tz, "name": data.index.name}
+    else:
+        index = {"index": data.index}
+    columns = []
+    for name in data.columns:
+        values = data[name]
+        if isinstance(values.dtype,pandas.CategoricalDtype):
+            columns.append((name,values.cat.codes.values,values.dtype))
+        else:
+            columns.append((name,values.values,None))
+    return {"index": index, "columns": columns}
+
+def unpackDataFrame(payload : dict,time_grid : TimeGrid=None) -> pandas.DataFrame:
+    """
+    rebuilds DataFrame packed with packDataFrame. If time_grid is set and the index matches the grid, the grid index is used
+    """
+    if payload is None:
+        return None
+    if "index" in payload["index"]:
+        index = payload["index"]["index"]
+    elif time_grid is not None and np.array_equal(payload["index"]["values"],time_grid.values) and payload["index"]["name"] == time_grid.index.name and str(payload["index"]["tz"]) == str(time_grid.index.tz):
+        index = time_grid.index
+    else:
+        index = pandas.DatetimeIndex(payload["index"]["values"].view("M8[ns]"),name=payload["index"]["name"])
+        if payload["index"]["tz"] is not None:
+            index = index.tz_localize("UTC").tz_convert(payload["index"]["tz"])
+    data = {}
+    for name, values, dtype in payload["columns"]:
+        data[name] = pandas.Categorical.from_codes(values,dtype=dtype) if dtype is not None else values
+    return pandas.DataFrame(data,index=index,columns=[column[0] for column in payload["columns"]])
+
+def concatRegular(head : pandas.DataFrame,tail : pandas.DataFrame,time_grid : TimeGrid,column : str="valor",tag_column : str="tag") -> pandas.DataFrame:
+    """
+    returns the rows of head followed by the rows of tail (both with column and categorical tag_column), indexed by time_grid. The rows of head and tail must be the consecutive steps of the grid
+    """
+    if len(head) + len(tail) != len(time_grid):
+        raise Exception("concatRegular: %i + %i rows don't match grid of %i steps" % (len(head),len(tail),len(time_grid)))
+    tags = [encodeTags(head[tag_column]),encodeTags(tail[tag_column])]
+    categories = tags[0].cat.categories.union(tags[1].cat.categories)
+    codes = []
+    for x in tags:
+        lookup = categories.get_indexer(x.cat.categories)
+        codes.append(np.where(x.cat.codes.values >= 0,lookup[np.maximum(x.cat.codes.values,0)] if len(lookup) else -1,-1))
+    return pandas.DataFrame({
+        column: np.concatenate([head[column].values,tail[column].values]).astype(np.float64),
+        tag_column: pandas.Categorical.from_codes(np.concatenate(codes),categories=categories)
+    },index=time_grid.index)
+
+def firstChange(data : pandas.DataFrame,other : pandas.DataFrame,columns : list=["valor","tag"]):
+    """
+    returns the first time (int64 UTC nanoseconds) at which data and other (indexed by sorted DatetimeIndex) differ: rows found in only one of them, or with different values of columns (nulls are equal). Returns None if they are equal. If an index is not sorted, returns the first time of both
+    """
+    times = [data.index.asi8,other.index.asi8]
+    if not data.index.is_monotonic_increasing or not other.index.is_monotonic_increasing or not all([column in data.columns and column in other.columns for column in columns]):
+        starts = [x[0] for x in times if len(x)]
+        return min(starts) if len(starts) else None
+    n = min(len(times[0]),len(times[1]))
+    changed = times[0][:n] != times[1][:n]
+    for column in columns:
+        values = [np.asarray(data[column].values[:n]),np.asarray(other[column].values[:n])]
+        if isinstance(data[column].dtype,pandas.CategoricalDtype) and isinstance(other[column].dtype,pandas.CategoricalDtype):
+            # compare codes mapped to the categories of data (missing is -1, categories not in data are -2)
+            lookup = data[column].cat.categories.get_indexer(other[column].cat.categories)
+            codes = np.asarray(other[column].cat.codes.values[:n])
+            changed |= data[column].cat.codes.values[:n] != np.where(codes >= 0,np.where(lookup >= 0,lookup,-2)[np.maximum(codes,0)] if len(lookup) else -2,-1)
+        elif isinstance(data[column].dtype,pandas.CategoricalDtype) or values[0].dtype == object:
+            values = [np.asarray(pandas.Series(x).astype(str)) for x in values]
+            changed |= values[0] != values[1]
+        else:
+            changed |= ~((values[0] == values[1]) | (pandas.isna(values[0]) & pandas.isna(values[1])))
+    if changed.any():
+        position = int(np.argmax(changed))
+        return int(min(times[0][position],times[1][position]))
+    if len(times[0]) != len(times[1]):
+        return int(times[0][n] if len(times[0]) > n else times[1][n])
+    return None
+
+## TAGS
+# tag columns are stored as pandas Categorical: each distinct tag string ("obs", "obs,adjusted", "interpolated,derived", ...) is stored once and rows hold integer codes. Tags are decoded to strings only at output (toList, toCSV, printReport)
+
+def encodeTags(tags) -> pandas.Series:
+    """
+    returns tags as categorical Series. Missing values (None, NaN) are kept as NaN
+    """
+    if isinstance(tags,pandas.Series):
+        return tags if isinstance(tags.dtype,pandas.CategoricalDtype) else tags.astype("category")
+    return pandas.Series(tags,dtype="category")
+
+def decodeTags(data,tag_column : str=None):
+    """
+    decodes categorical tags to strings. If data is a Series, returns it as object Series. If data is a DataFrame, returns a copy with categorical columns (or only tag_column, if set) converted to object
+    """
+    if isinstance(data,pandas.Series):
+        return data.astype(object) if isinstance(data.dtype,pandas.CategoricalDtype) else data
+    categorical = [isinstance(dtype,pandas.CategoricalDtype) and (tag_column is None or column == tag_column) for column, dtype in zip(data.columns,data.dtypes)]
+    if not any(categorical):
+        return data
+    # by position, since pivoted frames may have duplicate column names
+    return pandas.concat([data.iloc[:,i].astype(object) if categorical[i] else data.iloc[:,i] for i in range(len(data.columns))],axis=1)
+
+def setTag(tags,mask,tag : str) -> pandas.Series:
+    """
+    returns categorical tags with tag set where mask is True
+    """
+    tags = encodeTags(tags)
+    if tag not in tags.cat.categories:
+        tags = tags.cat.add_categories([tag])
+    codes = tags.cat.codes.values.copy()
+    codes[np.asarray(mask,dtype=bool)] = tags.cat.categories.get_loc(tag)
+    return pandas.Series(pandas.Categorical.from_codes(codes,categories=tags.cat.categories),index=tags.index,name=tags.name)
+
+def appendTag(tags,tag : str,missing : str=None) -> pandas.Series:
+    """
+    returns categorical tags with tag appended (comma-separated) to each tag. Only categories are renamed, rows are not visited. Missing tags are set to missing (or kept missing if None)
+    """
+    tags = encodeTags(tags)
+    tags = tags.cat.rename_categories(["%s,%s" % (category,tag) for category in tags.cat.categories])
+    if missing is not None:
+        tags = setTag(tags,tags.isna(),missing)
+    return tags
+
+def fillTags(tags,other) -> pandas.Series:
+    """
+    returns categorical tags with missing values filled with other (a tag string or a Series of tags, aligned on index)
+    """
+    tags = encodeTags(tags)
+    if not isinstance(other,pandas.Series):
+        return setTag(tags,tags.isna(),other)
+    other = encodeTags(other)
+    categories = tags.cat.categories.union(other.cat.categories)
+    return tags.cat.set_categories(categories).fillna(other.cat.set_categories(categories))
 
 def f1(row,column="valor",timedelta_threshold=None):
     if -row["diff_with_next"] > timedelta_threshold:
@@ -131,13 +480,22 @@ def f4(row,column="valor",tag_column="tag"):
     else:
         return row[tag_column]
 
-def serieRegular(data : pandas.DataFrame, time_interval : timedelta, timestart=None, timeend=None, time_offset=None, column="valor", interpolate=True, interpolation_limit=1,tag_column=None, extrapolate=False):
+def joinRegular(df_regular : pandas.DataFrame, data : pandas.DataFrame, time_grid : TimeGrid=None) -> pandas.DataFrame:
+    if time_grid is not None and data.index.is_unique:
+        return time_grid.take(data)
+    return df_regular.join(data, how = 'left')
+
+def serieRegular(data : pandas.DataFrame, time_interval : timedelta, timestart=None, timeend=None, time_offset=None, column="valor", interpolate=True, interpolation_limit=1,tag_column=None, extrapolate=False, time_grid : TimeGrid=None):
     """
     genera serie regular y rellena nulos interpolando
     if interpolate=False, interpolates only to the closest timestep of the regular timeseries. If observation is equidistant to preceding and following timesteps it interpolates to both.
+    if time_grid is set, it is used as regular index (time_interval, timestart, timeend and time_offset are ignored) and the result shares its index
     """
-    df_regular = pandas.DataFrame(index = createDatetimeSequence(data.index, time_interval, timestart, timeend, time_offset))
-    df_regular.index.rename('timestart', inplace=True)
+    if time_grid is not None:
+        df_regular = pandas.DataFrame(index = time_grid.index)
+    else:
+        df_regular = pandas.DataFrame(index = createDatetimeSequence(data.index, time_interval, timestart, timeend, time_offset))
+        df_regular.index.rename('timestart', inplace=True)
     if not len(data):
         df_regular[column] = None
         if tag_column is not None:
@@ -150,10 +508,10 @@ def serieRegular(data : pandas.DataFrame, time_interval : timedelta, timestart=N
         df_join["interpolated"] = df_join[column].interpolate(method='time',limit=interpolation_limit,limit_direction='both',limit_area=None if extrapolate else 'inside')
         if tag_column is not None:
             # print("columns: " + df_join.columns)
-            df_join[tag_column] = [x[tag_column] if pandas.isna(x["interpolated"]) else "extrapolated" if i < min_obs_date or i > max_obs_date else "interpolated" if pandas.isna(x[column]) else x[tag_column] for (i, x) in df_join.iterrows()]
+            df_join[tag_column] = interpolationTags(df_join,column,tag_column,min_obs_date,max_obs_date)
         df_join[column] = df_join["interpolated"]
         del df_join["interpolated"]
-        df_regular = df_regular.join(df_join, how = 'left')
+        df_regular = joinRegular(df_regular,df_join,time_grid)
     else:
         timedelta_threshold = time_interval / 2 # takes half time interval as maximum time distance for interpolation
         df_join = df_join.reset_index()
@@ -162,14 +520,15 @@ def serieRegular(data : pandas.DataFrame, time_interval : timedelta, timestart=N
         df_join = df_join.set_index("timestart")
         df_join["interpolated_backward"] = df_join[column].interpolate(method='time',limit=1,limit_direction='backward',limit_area=None)
         df_join["interpolated_forward"] = df_join[column].interpolate(method='time',limit=1,limit_direction='forward',limit_area=None)
-        df_join["interpolated_backward_filtered"] = df_join.apply(lambda row: f1(row,column,timedelta_threshold),axis=1) #[ x[column] if -x["diff_with_next"] > timedelta_threshold else x.interpolated_backward for (i,x) in df_join.iterrows()]
-        df_join["interpolated_forward_filtered"] = df_join.apply(lambda row: f2(row,column,timedelta_threshold),axis=1)#[ x[column] if x["diff_with_previous"] > timedelta_threshold else x.interpolated_forward for (i,x) in df_join.iterrows()]
-        df_join["interpolated_final"] = df_join.apply(lambda row: f3(row,column,timedelta_threshold),axis=1) #[x.interpolated_backward_filtered if pandas.isna(x.interpolated_forward_filtered) else x.interpolated_forward_filtered for (i,x) in df_join.iterrows()]
+        # vectorized f1, f2, f3, f4: keep the observation where the neighbouring timestep is farther than half interval, else take the interpolated value
+        df_join["interpolated_backward_filtered"] = df_join[column].where(-df_join["diff_with_next"] > timedelta_threshold,df_join["interpolated_backward"])
+        df_join["interpolated_forward_filtered"] = df_join[column].where(df_join["diff_with_previous"] > timedelta_threshold,df_join["interpolated_forward"])
+        df_join["interpolated_final"] = df_join["interpolated_forward_filtered"].where(df_join["interpolated_forward_filtered"].notna(),df_join["interpolated_backward_filtered"])
         if tag_column is not None:
-            df_join["new_tag"] = df_join.apply(lambda row: f4(row,column,tag_column),axis=1) #[x[tag_column] if pandas.isna(x.interpolated_final) else "interpolated" if pandas.isna(x.valor) else x[tag_column] for (i,x) in df_join.iterrows()]
-            df_regular = df_regular.join(df_join[["interpolated_final","new_tag"]].rename(columns={"interpolated_final":column,"new_tag":tag_column}), how = 'left')
+            df_join["new_tag"] = setTag(df_join[tag_column],df_join["interpolated_final"].notna() & df_join[column].isna(),"interpolated")
+            df_regular = joinRegular(df_regular,df_join[["interpolated_final","new_tag"]].rename(columns={"interpolated_final":column,"new_tag":tag_column}),time_grid)
         else:
-            df_regular = df_regular.join(df_join[["interpolated_final",]].rename(columns={"interpolated_final":column}), how = 'left')
+            df_regular = joinRegular(df_regular,df_join[["interpolated_final",]].rename(columns={"interpolated_final":column}),time_grid)
     return df_regular
 
 def f5(row,column="valor",tag_column="tag",min_obs_date=None,max_obs_date=None):
@@ -182,52 +541,228 @@ def f5(row,column="valor",tag_column="tag",min_obs_date=None,max_obs_date=None):
     else:
         return row[tag_column]
 
+def interpolationTags(data : pandas.DataFrame,column="valor",tag_column="tag",min_obs_date=None,max_obs_date=None) -> pandas.Series:
+    """
+    vectorized f5: returns tag_column of data (as categorical), replaced by "extrapolated" where the "interpolated" column was filled outside of (min_obs_date, max_obs_date) and by "interpolated" where it was filled inside. Selection is done on the category codes
+    """
+    tags = encodeTags(data[tag_column])
+    tags = tags.cat.add_categories([x for x in ["extrapolated","interpolated"] if x not in tags.cat.categories])
+    codes = tags.cat.codes.values
+    filled = data["interpolated"].notna().values
+    outside = ((data.index < min_obs_date) | (data.index > max_obs_date)) if not pandas.isna(min_obs_date) else np.zeros(len(data),dtype=bool)
+    codes = np.select(
+        [~filled, outside, data[column].isna().values],
+        [codes, tags.cat.categories.get_loc("extrapolated"), tags.cat.categories.get_loc("interpolated")],
+        default = codes
+    )
+    return pandas.Series(pandas.Categorical.from_codes(codes,categories=tags.cat.categories),index=data.index,name=tag_column)
+
 def interpolateData(data,column="valor",tag_column=None,interpolation_limit=1,extrapolate=False):
     min_obs_date, max_obs_date = (data[~pandas.isna(data[column])].index.min(),data[~pandas.isna(data[column])].index.max())
     data["interpolated"] = data[column].interpolate(method='time',limit=interpolation_limit,limit_direction='both',limit_area=None if extrapolate else 'inside')
     if tag_column is not None:
-        data[tag_column] = data.apply(lambda row: f5(row,column,tag_column,min_obs_date,max_obs_date),axis=1)#[x[tag_column] if pandas.isna(x["interpolated"]) else "extrapolated" if i < min_obs_date or i > max_obs_date else "interpolated" if pandas.isna(x[column]) else x[tag_column] for (i, x) in data.iterrows()]
+        data[tag_column] = interpolationTags(data,column,tag_column,min_obs_date,max_obs_date)
     data[column] = data["interpolated"]
     del data["interpolated"]
     return data
 
-def serieFillNulls(data : pandas.DataFrame, other_data : pandas.DataFrame, column : str="valor", other_column : str="valor", fill_value : float=None, shift_by : int=0, bias : float=0, extend=False, tag_column=None):
+def shiftArray(values : np.ndarray,shift_by : int,fill_value) -> np.ndarray:
+    """
+    shifts values by shift_by positions (as pandas.Series.shift), filling with fill_value
+    """
+    if shift_by == 0:
+        return values
+    result = np.full(len(values),fill_value,dtype=values.dtype)
+    if abs(shift_by) < len(values):
+        if shift_by > 0:
+            result[shift_by:] = values[:-shift_by]
+        else:
+            result[:shift_by] = values[-shift_by:]
+    return result
+
+def coalesceSeries(data : list, column : str="valor", fill_value : float=None, shift_by : list=None, bias : list=None, tag_column : str=None, time_grid : TimeGrid=None) -> pandas.DataFrame:
+    """
+    rellena nulos de data[0] con los valores de data[1], data[2], ... en orden de prioridad (equivale a encadenar serieFillNulls, aplicando fill_value al final). Opcionalmente aplica a cada serie traslado en x (shift_by: lista de n registros) y en y (bias: lista de float)
+
+    si todas las series están alineadas a time_grid (con column float64 y tag_column categórica), el resultado se calcula sobre arrays, en una sola asignación de salida. Caso contrario encadena serieFillNulls
+    """
+    shift_by = shift_by if shift_by is not None else [0] * len(data)
+    bias = bias if bias is not None else [0] * len(data)
+    columns = [column,tag_column] if tag_column is not None else [column]
+    vectorized = time_grid is not None and all([
+        isinstance(x,pandas.DataFrame)
+        and time_grid.isAligned(x)
+        and column in x.columns
+        and x[column].dtype == np.float64
+        and (tag_column is None or (tag_column in x.columns and isinstance(x[tag_column].dtype,pandas.CategoricalDtype)))
+        for x in data])
+    if not vectorized:
+        result = data[0][columns]
+        for i in range(1,len(data)):
+            result = serieFillNulls(result,data[i],column=column,fill_value=fill_value if i == len(data) - 1 else None,shift_by=shift_by[i],bias=bias[i],tag_column=tag_column,time_grid=time_grid)
+        return result
+    values = data[0][column].values.copy()
+    for i in range(1,len(data)):
+        missing = np.isnan(values)
+        if not missing.any():
+            break
+        other = shiftArray(data[i][column].values,shift_by[i],np.nan)
+        np.copyto(values,other + bias[i] if bias[i] != 0 else other,where=missing)
+    if fill_value is not None and len(data) > 1:
+        np.copyto(values,fill_value,where=np.isnan(values))
+    result = {column: values}
+    if tag_column is not None:
+        categories = data[0][tag_column].cat.categories
+        for x in data[1:]:
+            categories = categories.union(x[tag_column].cat.categories)
+        if fill_value is not None and len(data) > 1 and "filled" not in categories:
+            categories = categories.append(pandas.Index(["filled"]))
+        codes = np.full(len(values),-1,dtype=np.int32)
+        for i, x in enumerate(data):
+            missing = codes == -1
+            if not missing.any():
+                break
+            tags = x[tag_column]
+            lookup = categories.get_indexer(tags.cat.categories)
+            other = shiftArray(np.where(tags.cat.codes.values >= 0,lookup[np.maximum(tags.cat.codes.values,0)] if len(lookup) else -1,-1),shift_by[i],-1)
+            np.copyto(codes,other,where=missing)
+        if fill_value is not None and len(data) > 1:
+            np.copyto(codes,categories.get_loc("filled"),where=codes == -1)
+        result[tag_column] = pandas.Categorical.from_codes(codes,categories=categories)
+    return pandas.DataFrame(result,index=data[0].index)
+
+def serieFillNulls(data : pandas.DataFrame, other_data : pandas.DataFrame, column : str="valor", other_column : str="valor", fill_value : float=None, shift_by : int=0, bias : float=0, extend=False, tag_column=None, time_grid : TimeGrid=None):
     """
     rellena nulos de data con valores de other_data donde coincide el index. Opcionalmente aplica traslado rígido en x (shift_by: n registros) y en y (bias: float)
 
     si extend=True el índice del dataframe resultante será la unión de los índices de data y other_data (caso contrario será igual al índice de data)
+
+    si data y other_data están alineados a time_grid, las columnas se combinan por posición (sin join)
     """
     mapper = {}
     mapper[other_column] = "valor_fillnulls"
     how = "outer" if extend else "left"
+    positional = time_grid is not None and not extend and time_grid.isAligned(data) and time_grid.isAligned(other_data)
     if tag_column is not None:
         mapper[tag_column] = "tag_fillnulls"
-        data = data.join(other_data[[other_column,tag_column]].rename(mapper,axis=1), how = how)
+        if positional:
+            data = data.copy()
+            data["valor_fillnulls"] = other_data[other_column].values
+            data["tag_fillnulls"] = other_data[tag_column].values
+        else:
+            data = data.join(other_data[[other_column,tag_column]].rename(mapper,axis=1), how = how)
         data[column] = data[column].fillna(data["valor_fillnulls"].shift(shift_by, axis = 0) + bias)    
-        data[tag_column] = data[tag_column].fillna(data["tag_fillnulls"].shift(shift_by, axis = 0))
+        data[tag_column] = fillTags(data[tag_column],data["tag_fillnulls"].shift(shift_by, axis = 0))
         if fill_value is not None:
             data[column] = data[column].fillna(fill_value)
-            data[tag_column] = data[tag_column].fillna("filled")
+            data[tag_column] = fillTags(data[tag_column],"filled")
         del data["valor_fillnulls"]
         del data["tag_fillnulls"]
     else:
-        data = data.join(other_data[[other_column,]].rename(mapper,axis=1), how = how)
+        if positional:
+            data = data.copy()
+            data["valor_fillnulls"] = other_data[other_column].values
+        else:
+            data = data.join(other_data[[other_column,]].rename(mapper,axis=1), how = how)
         data[column] = data[column].fillna(data["valor_fillnulls"].shift(shift_by, axis = 0) + bias)
         del data["valor_fillnulls"]
         if fill_value is not None:
             data[column] = data[column].fillna(fill_value)
     return data
 
-def serieMovingAverage(obs_df : pandas.DataFrame,offset : timedelta, column : str="valor", tag_column : str=None):
-    data = obs_df[column].rolling(offset, min_periods=1).mean()
+def movingAverageArrays(times : np.ndarray, values : np.ndarray, window : int) -> np.ndarray:
+    """
+    trailing moving average of values over the time window (t - window, t] (as pandas rolling(window, min_periods=1).mean()). Null values are skipped. Computed with cumulative sums and counts: each step adds one value and removes the values leaving the window, so cost is linear in the number of values (plus a binary search for the window starts)
+
+    :param times: int64 nanoseconds, non-decreasing
+    :param values: float64
+    :param window: window length in nanoseconds
+    :returns: float64 array (NaN where the window has no values)
+    """
+    if not len(times):
+        return np.array([],dtype=np.float64)
+    steps = np.diff(times)
+    if (steps < 0).any():
+        raise Exception("times must be monotonic increasing")
+    valid = ~np.isnan(values)
+    # values are centered to keep the cumulative sum small, which reduces rounding error
+    reference = values[valid].mean() if valid.any() else 0.0
+    sums = np.concatenate([[0.0],np.cumsum(np.where(valid,values - reference,0.0))])
+    counts = np.concatenate([[0],np.cumsum(valid)])
+    right = np.arange(1,len(times) + 1)
+    if len(steps) and steps[0] > 0 and (steps == steps[0]).all():
+        # regular series: the window holds the last ceil(window / step) values
+        left = np.maximum(right - int(-(-window // steps[0])),0)
+    else:
+        left = np.searchsorted(times,times - window,side="right")
+    count = counts[right] - counts[left]
+    with np.errstate(invalid="ignore",divide="ignore"):
+        return np.where(count > 0,(sums[right] - sums[left]) / count + reference,np.nan)
+
+class MovingAverage():
+    """
+    Trailing moving average over a time window, for regular or irregular series. Keeps the values of the last window, so that observations appended later (update) are averaged without recomputing the whole series
+
+    :param window: window length
+    """
+    def __init__(self,window : timedelta):
+        self.window = int(pandas.Timedelta(window).value)
+        self.times = np.array([],dtype=np.int64)
+        self.values = np.array([],dtype=np.float64)
+    def seed(self,times : np.ndarray,values : np.ndarray):
+        """
+        sets the window to the values (at times, int64 nanoseconds) preceding the ones that will be appended, without averaging them. Used to resume the average from already averaged data (e.g. the steps before the first changed step of an incremental run)
+        """
+        times = np.asarray(times,dtype=np.int64)
+        values = np.asarray(values,dtype=np.float64)
+        keep = times > times[-1] - self.window if len(times) else np.zeros(0,dtype=bool)
+        self.times, self.values = times[keep], values[keep]
+    def update(self,times : np.ndarray,values : np.ndarray) -> np.ndarray:
+        """
+        returns moving average at times (int64 nanoseconds, not earlier than the last appended time) of values appended to the window
+        """
+        times = np.asarray(times,dtype=np.int64)
+        values = np.asarray(values,dtype=np.float64)
+        if len(self.times) and len(times) and times[0] < self.times[-1]:
+            raise Exception("appended times must not be earlier than the last appended time")
+        all_times = np.concatenate([self.times,times])
+        all_values = np.concatenate([self.values,values])
+        result = movingAverageArrays(all_times,all_values,self.window)[len(self.times):]
+        if len(all_times):
+            keep = all_times > all_times[-1] - self.window
+            self.times, self.values = all_times[keep], all_values[keep]
+        return result
+
+def serieMovingAverage(obs_df : pandas.DataFrame,offset : timedelta, column : str="valor", tag_column : str=None, moving_average : MovingAverage=None) -> pandas.DataFrame:
+    """
+    returns copy of obs_df with column replaced by its trailing moving average over offset. Missing tags are set to "moving_average" where the average is not null. obs_df is not modified. The whole series is averaged with pandas rolling, which is faster than movingAverageArrays on a full recompute
+
+    :param moving_average: MovingAverage holding the previous window. If set, obs_df must only contain observations appended after the ones already averaged, and only these are averaged (see MovingAverage.update)
+    """
+    data = obs_df.copy()
+    if not len(data):
+        return data
+    if moving_average is not None:
+        data[column] = moving_average.update(data.index.asi8,data[column].values.astype(np.float64))
+    else:
+        data[column] = data[column].astype(np.float64).rolling(offset,min_periods=1).mean()
     if tag_column is not None:
-        obs_df[tag_column] = [x if not pandas.isna(x) else "moving_average" for x in obs_df[tag_column]]
+        tags = encodeTags(data[tag_column])
+        data[tag_column] = setTag(tags,tags.isna().values & data[column].notna().values,"moving_average")
     return data
 
+def offsetIndex(index : pandas.Index,x_offset : timedelta) -> pandas.DatetimeIndex:
+    """
+    returns index shifted by x_offset (unnamed, without freq), computed on the int64 values of the DatetimeIndex instead of per element
+    """
+    if not isinstance(index,pandas.DatetimeIndex):
+        index = pandas.DatetimeIndex(index)
+    return pandas.DatetimeIndex(index + x_offset,freq=None).rename(None)
+
 def applyTimeOffsetToIndex(obs_df,x_offset):
     original_df = obs_df[["valor",]]
     del original_df["valor"]
-    obs_df.index = [x + x_offset for x in obs_df.index]
+    obs_df.index = offsetIndex(obs_df.index,x_offset)
     obs_df = original_df.join(obs_df,how='outer')
     obs_df.interpolate(method='time',limit=1,inplace=True)
     obs_df = original_df.join(obs_df,how='left')
@@ -286,7 +821,7 @@ def adjustSeries(sim_df,truth_df,method="lfit",plot=True,return_adjusted_series=
             plt.figtext(0.5, 0.01, "r2: %.04f, coef: %s, intercept: %.04f" % (r2,",".join(["%.04f" % x for x in coef]), intercept))
         if return_adjusted_series:
             if tag_column is not None:
-                aux_df["tag_adj"] = [None if pandas.isna(x) else "%s,adjusted" % x for x in aux_df["tag_sim"]]
+                aux_df["tag_adj"] = appendTag(aux_df["tag_sim"],"adjusted")
                 return (aux_df["adj"], aux_df["tag_adj"],{"lr": lr, "quant_Err": quant_Err, "r2": r2, "coef": coef, "intercept": intercept})
             else:
                 return (aux_df["adj"], None, {"lr": lr, "quant_Err": quant_Err, "r2": r2, "coef": coef, "intercept": intercept})
@@ -310,7 +845,7 @@ def linearCombination(sim_df : pandas.DataFrame,params : dict,plot=True,tag_colu
         plt.plot(sim_df)
         plt.legend(sim_df.columns)
     if tag_column is not None:
-        sim_df[tag_column] = ["%s,linear_combination" % x if ~pandas.isna(x) else None for x in sim_df[tag_column]]
+        sim_df[tag_column] = appendTag(sim_df[tag_column],"linear_combination")
         return (sim_df["predict"], sim_df[tag_column])
     else:
         return sim_df["predict"]
@@ -0,0 +1,128 @@
+import os
+import json
+import tempfile
+import yaml
+
+# pydrodelta reads config/config.yml and data/schemas from PYDRODELTA_DIR at import. If not set, a scratch dir is built from config/config_empty.yml and the data dir of the repo
+if "PYDRODELTA_DIR" not in os.environ:
+    repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    pydrodelta_dir = tempfile.mkdtemp(prefix="pydrodelta_")
+    for path in ["config","log","data/schemas/yaml"]:
+        os.makedirs(os.path.join(pydrodelta_dir,path))
+    for name in os.listdir(os.path.join(repo_dir,"data")):
+        if name != "schemas":
+            os.symlink(os.path.join(repo_dir,"data",name),os.path.join(pydrodelta_dir,"data",name))
+    os.symlink(os.path.join(repo_dir,"data","schemas","json"),os.path.join(pydrodelta_dir,"data","schemas","json"))
+    serie_schema = os.path.join(repo_dir,"data","schemas","yaml","serie.yml")
+    if os.path.exists(serie_schema):
+        os.symlink(serie_schema,os.path.join(pydrodelta_dir,"data","schemas","yaml","serie.yml"))
+    else:
+        with open(os.path.join(pydrodelta_dir,"data","schemas","yaml","serie.yml"),"w") as f:
+            json.dump({"type": "object"},f)
+    with open(os.path.join(repo_dir,"config","config_empty.yml")) as f:
+        config = yaml.load(f,yaml.CLoader)
+    config["api"]["url"] = "http://127.0.0.1:9"
+    config["metadata_cache"] = None
+    with open(os.path.join(pydrodelta_dir,"config","config.yml"),"w") as f:
+        yaml.dump(config,f)
+    os.environ["PYDRODELTA_DIR"] = pydrodelta_dir
+
+import threading
+import numpy as np
+import pandas
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pydrodelta.a5 as a5
+import pydrodelta.analysis as analysis
+from pydrodelta.cache import ObservacionesCache, arraysToDataFrame
+
+class SyntheticObsSource():
+    """
+    stands in for ObservacionesCache (Topology.obs_cache): readSerie returns a synthetic irregular series (one observation every 15 minutes on average), which depends only on series_id and the time range
+    """
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual") -> tuple:
+        rng = np.random.default_rng(series_id)
+        timestart, timeend = pandas.Timestamp(timestart).value, pandas.Timestamp(timeend).value
+        n = int((timeend - timestart) / 900e9)
+        data = arraysToDataFrame(np.sort(rng.integers(timestart,timeend,n)),rng.normal(size=n),tag="obs")
+        return {"id": series_id, "tipo": tipo, "estacion": {"nombre": "synthetic", "nivel_alerta": None, "nivel_evacuacion": None, "nivel_aguas_bajas": None}}, data
+
+class SyntheticArchive():
+    """
+    stands in for the a5 API (read_function of ObservacionesCache): each series has one observation every 15 minutes (with jitter, some nulls and outliers), which depends only on its time, so that reading a longer time range returns the same observations plus the new ones. Observations can be revised
+    """
+    def __init__(self):
+        self.revisions = {}
+        self._lock = threading.Lock()
+    def revise(self,series_id : int,time,valor : float):
+        """
+        sets the value of the observation of series_id at or after time
+        """
+        self.revisions.setdefault(series_id,{})[int(-(-pandas.Timestamp(time).value // 900000000000))] = valor
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual") -> dict:
+        timestart, timeend = pandas.Timestamp(timestart).value, pandas.Timestamp(timeend).value
+        steps = np.arange(timestart // 900000000000 - 1,timeend // 900000000000 + 1)
+        times = steps * 900000000000 + (steps * 7919 + series_id * 104729) % 600 * 1000000000
+        values = np.sin(steps / 96 + series_id) + ((steps * 31 + series_id) % 17 - 8) / 40
+        values[(steps + series_id) % 11 == 0] = np.nan
+        values[(steps * 13 + series_id) % 97 == 0] = 5
+        for step, valor in self.revisions.get(series_id,{}).items():
+            values[steps == step] = valor
+        mask = (times >= timestart) & (times <= timeend)
+        return {"id": series_id, "tipo": tipo, "estacion": {"nombre": "synthetic", "nivel_alerta": None, "nivel_evacuacion": None, "nivel_aguas_bajas": None}, "observaciones": SimpleNamespace(timestart=times[mask],valor=values[mask])}
+
+class SyntheticObsCache(ObservacionesCache):
+    """
+    ObservacionesCache reading from a SyntheticArchive instead of the a5 API
+    """
+    def __init__(self,path : str,archive : SyntheticArchive,refresh_window : timedelta=None):
+        super().__init__(path,refresh_window=refresh_window)
+        self.archive = archive
+    def readSerie(self,series_id : int,timestart,timeend,tipo : str="puntual",refresh_window : timedelta=None,read_function=None) -> tuple:
+        return super().readSerie(series_id,timestart,timeend,tipo=tipo,refresh_window=refresh_window,read_function=self.archive.readSerie)
+
+@pytest.fixture
+def synthetic_config():
+    """
+    returns function (n, days) -> config of a synthetic topology of n observed nodes (variable 2, two hourly series each) and n / 4 nodes derived from them, ending at timeend (default now). Metadata of variable 2 is set in the metadata cache, so that no request is made
+    """
+    a5.metadata_cache.setEntry("var",2,{"id": 2, "timeSupport": {"hours": 0}})
+    def make(n : int=4,days : int=2,timeend : datetime=None):
+        timeend = timeend if timeend is not None else datetime.now()
+        nodes = []
+        for i in range(1,n + 1):
+            nodes.append({"id": i, "name": "node %i" % i, "time_interval": {"hours": 1}, "variables": [{"id": 2, "series": [{"series_id": i * 10 + 1}, {"series_id": i * 10 + 2}]}]})
+        for i in range(1,n // 4 + 1):
+            nodes.append({"id": n + i, "name": "derived node %i" % i, "time_interval": {"hours": 1}, "variables": [{"id": 2, "derived": True, "derived_from": {"node_id": i * 4, "var_id": 2, "x_offset": {"hours": 3}, "y_offset": 0.5}, "series_output": [{"series_id": (n + i) * 10}]}]})
+        return {"timestart": (timeend - timedelta(days=days)).isoformat(), "timeend": timeend.isoformat(), "time_offset": {"hours": 0}, "nodes": nodes}
+    return make
+
+@pytest.fixture
+def obs_source():
+    return SyntheticObsSource()
+
+@pytest.fixture
+def process_topology(obs_source):
+    """
+    returns function (config) -> Topology, after batchProcessInput with observations read from SyntheticObsSource
+    """
+    def process(config : dict):
+        topology = analysis.Topology(config)
+        topology.obs_cache = obs_source
+        topology.batchProcessInput()
+        return topology
+    return process
+
+@pytest.fixture
+def archive():
+    return SyntheticArchive()
+
+@pytest.fixture
+def archive_cache(archive):
+    """
+    returns function (path, refresh_window) -> ObservacionesCache reading from the archive fixture
+    """
+    def make(path : str,refresh_window : timedelta=None):
+        return SyntheticObsCache(path,archive,refresh_window=refresh_window)
+    return make
@@ -0,0 +1,67 @@
+import pandas
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+import pydrodelta.a5 as a5
+
+class RecordingClient(a5.A5Client):
+    """
+    A5Client that records the requests instead of sending them
+    """
+    def __init__(self):
+        super().__init__(url="http://127.0.0.1:9",token="x")
+        self.requests = []
+    def request(self,method,path,params=None,json=None,use_proxy=False,timeout=None,stream=False):
+        self.requests.append({"method": method, "path": path, "params": params, "json": json})
+        body = json["observaciones"] if json is not None and "observaciones" in json else json
+        return SimpleNamespace(status_code=200,json=lambda: body,text="",url=path)
+
+@pytest.fixture
+def client():
+    previous = a5.default_client
+    client = RecordingClient()
+    a5.setDefaultClient(client)
+    yield client
+    a5.setDefaultClient(previous)
+
+def test_create_observaciones_unsorted(client):
+    index = pandas.DatetimeIndex(["2022-01-01T02:00:00","2022-01-01T00:00:00","2022-01-01T01:00:00"]).tz_localize("America/Argentina/Buenos_Aires")
+    data = pandas.DataFrame({"valor": [3.0,1.0,2.0]},index=index)
+    created = client.createObservaciones(data,series_id=1)
+    assert [x["valor"] for x in created] == [1.0,2.0,3.0]
+    # the input frame is not modified
+    assert list(data["valor"]) == [3.0,1.0,2.0] and list(data.index) == list(index)
+
+def test_create_observaciones_duplicate_times(client):
+    index = pandas.DatetimeIndex(["2022-01-01T00:00:00","2022-01-01T00:00:00"]).tz_localize("America/Argentina/Buenos_Aires")
+    with pytest.raises(Exception):
+        client.createObservaciones(pandas.DataFrame({"valor": [1.0,2.0]},index=index),series_id=1)
+    assert len(client.requests) == 0
+
+def test_validate_corrida():
+    corrida = {"cal_id": 1, "forecast_date": "2022-01-01T00:00:00-03:00", "series": [{"series_id": 1, "series_table": "series_areal", "pronosticos": []}]}
+    a5.validate(corrida,"Corrida")
+    corrida["series"][0]["series_table"] = "invalid"
+    with pytest.raises(Exception):
+        a5.validate(corrida,"Corrida")
+
+def test_upload_data_as_prono_raster(client,synthetic_config,process_topology):
+    config = synthetic_config(4,days=2)
+    config["cal_id"] = 1
+    config["nodes"][-1]["variables"][0]["series_output"] = [{"series_id": 50, "tipo": "raster"}]
+    topology = process_topology(config)
+    topology.uploadDataAsProno()
+    corrida = client.requests[-1]["json"]
+    assert client.requests[-1]["path"] == "sim/calibrados/1/corridas"
+    raster = [serie for serie in corrida["series"] if serie["series_id"] == 50]
+    assert len(raster) == 1 and raster[0]["series_table"] == "series_rast" and len(raster[0]["pronosticos"])
+
+def test_read_serie_prono_str_timeend(client,caplog):
+    client.request = lambda method,path,**kwargs: client.requests.append({"path": path, "params": kwargs["params"]}) or SimpleNamespace(status_code=200,json=lambda: {"forecast_date": "2022-01-01T00:00:00-03:00", "cal_id": 1, "cor_id": 2, "series": []},text="",url=path)
+    corrida = client.readSerieProno(1,1,timestart=datetime(2022,1,1),timeend="2022-01-05T00:00:00",stream=False)
+    assert client.requests[-1]["params"]["timeend"] == "2022-01-05T00:00:00"
+    assert corrida["pronosticos"] == [] and "series 1 from cal_id 1 not found" in caplog.text
+
+def test_read_series_observaciones_empty(client):
+    assert client.readSeriesObservaciones([],"2022-01-01T00:00:00","2022-01-02T00:00:00",batch_size=None) == {}
+    assert len(client.requests) == 0
@@ -0,0 +1,43 @@
+import numpy as np
+import pandas
+from datetime import timedelta
+import pydrodelta.util as util
+import pydrodelta.analysis as analysis
+
+def frame(time_grid,valor,tag="obs"):
+    return pandas.DataFrame({"valor": np.asarray(valor,dtype=float), "tag": util.encodeTags(pandas.Series([tag] * len(time_grid)))},index=time_grid.index)
+
+def test_row_frame_cached():
+    timestart = util.tryParseAndLocalizeDate("2000-01-01T00:00:00-03:00")
+    time_grid = util.TimeGrid(timestart,timestart + timedelta(hours=3),timedelta(hours=1))
+    store = util.ColumnarStore(time_grid,capacity=1)
+    row = store.allocate()
+    store.setRow(row,frame(time_grid,[1,2,3]))
+    data = store.getRow(row)
+    assert store.getRow(row) is data
+    # setting the row drops the cached frame
+    store.setRow(row,frame(time_grid,[5,6,7],tag="interpolated"))
+    assert store.getRow(row) is not data
+    pandas.testing.assert_frame_equal(util.decodeTags(store.getRow(row)),util.decodeTags(frame(time_grid,[5,6,7],tag="interpolated")))
+    # growing the arrays drops the cached frames, which view the old arrays
+    data = store.getRow(row)
+    other = store.allocate()
+    store.setRow(other,frame(time_grid,[0,0,0]))
+    assert store.getRow(row) is not data
+    assert np.shares_memory(store.getRow(row)["valor"].values,store.values)
+    pandas.testing.assert_frame_equal(util.decodeTags(store.getRow(row)),util.decodeTags(frame(time_grid,[5,6,7],tag="interpolated")))
+
+def test_stored_serie_to_csv():
+    timestart = util.tryParseAndLocalizeDate("2000-01-01T00:00:00-03:00")
+    time_grid = util.TimeGrid(timestart,timestart + timedelta(hours=3),timedelta(hours=1))
+    store = util.ColumnarStore(time_grid)
+    serie = analysis.NodeSerie({"series_id": 7})
+    serie.data = frame(time_grid,[1,2,3])
+    serie.setStore(store)
+    assert "series_id" in serie.toCSV(include_series_id=True)
+    assert list(serie.data.columns) == ["valor","tag"]
+    serie.data = serie.data
+    assert serie._store is store
+    # a shared frame grown in place by a caller is rebuilt on the next read
+    serie.data["extra"] = 1.0
+    assert list(serie.data.columns) == ["valor","tag"]
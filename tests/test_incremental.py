@@ -0,0 +1,106 @@
+import logging
+import pandas
+import pytest
+from datetime import datetime, timedelta
+import pydrodelta.util as util
+import pydrodelta.analysis as analysis
+from pydrodelta.cache import StateCache
+
+@pytest.fixture
+def config(synthetic_config):
+    config = synthetic_config(4,days=5,timeend=datetime.now().replace(hour=0,minute=0,second=0,microsecond=0))
+    for node in config["nodes"]:
+        for variable in node["variables"]:
+            if "series" in variable:
+                variable["series"][0]["lim_outliers"] = [-2,2]
+                variable["series"][1]["moving_average"] = {"hours": 6}
+    config["time_offset_start"] = {"hours": 0}
+    return config
+
+@pytest.fixture
+def starts(monkeypatch):
+    """
+    records the first processed step returned by ObservedNodeVariable.processSeriesIncremental
+    """
+    starts = []
+    process = analysis.ObservedNodeVariable.processSeriesIncremental
+    def record(self,*args,**kwargs):
+        start = process(self,*args,**kwargs)
+        starts.append(start)
+        return start
+    monkeypatch.setattr(analysis.ObservedNodeVariable,"processSeriesIncremental",record)
+    return starts
+
+@pytest.fixture
+def run(archive_cache):
+    """
+    returns function (config, path, state, time_offset_end) -> Topology, after batchProcessInput with observations read from the archive fixture (cached in path/obs) and, if state, state_cache in path/state
+    """
+    def process(config,path,state=True,time_offset_end=0):
+        topology = analysis.Topology({**config, "time_offset_end": {"hours": time_offset_end}})
+        topology.obs_cache = archive_cache(str(path / "obs"),refresh_window=timedelta(hours=6))
+        topology.state_cache = StateCache(str(path / "state")) if state else None
+        topology.batchProcessInput()
+        return topology
+    return process
+
+def assertEqualResults(topology,other):
+    for node, other_node in zip(topology.nodes,other.nodes):
+        for var_id, variable in node.variables.items():
+            pandas.testing.assert_frame_equal(util.decodeTags(variable.data),util.decodeTags(other_node.variables[var_id].data),rtol=1e-9)
+            for serie, other_serie in zip(variable.series,other_node.variables[var_id].series):
+                pandas.testing.assert_frame_equal(util.decodeTags(serie.data),util.decodeTags(other_serie.data),rtol=1e-9)
+
+def revise(config,archive,time):
+    for node in config["nodes"]:
+        for variable in node["variables"]:
+            for serie in variable.get("series",[]):
+                archive.revise(serie["series_id"],time,-1.5)
+
+def test_incremental_equals_full(config,starts,run,archive,tmp_path):
+    run(config,tmp_path)
+    assert len(starts) and all([start == 0 for start in starts])
+    revise(config,archive,pandas.Timestamp(config["timeend"]) - timedelta(hours=2))
+    del starts[:]
+    incremental = run(config,tmp_path,time_offset_end=3)
+    length = len(incremental.nodes[0].getTimeGrid())
+    # only the tail of the grid is processed again
+    assert len(starts) and all([0 < start < length - 3 for start in starts])
+    full = run(config,tmp_path / "full",state=False,time_offset_end=3)
+    assertEqualResults(incremental,full)
+
+def test_unchanged_rerun(config,starts,run,tmp_path):
+    first = run(config,tmp_path)
+    del starts[:]
+    second = run(config,tmp_path)
+    length = len(second.nodes[0].getTimeGrid())
+    assert all([start == length for start in starts])
+    assertEqualResults(first,second)
+
+def test_fingerprint_changed(config,starts,run,tmp_path):
+    run(config,tmp_path)
+    config["nodes"][0]["variables"][0]["series"][0]["lim_outliers"] = [-1,1]
+    del starts[:]
+    incremental = run(config,tmp_path,time_offset_end=3)
+    # the state of the changed variable is discarded, the other variables are processed incrementally
+    assert starts[0] == 0 and all([start > 0 for start in starts[1:]])
+    full = run(config,tmp_path / "full",state=False,time_offset_end=3)
+    assertEqualResults(incremental,full)
+
+def test_grid_not_prefix(config,starts,run,tmp_path):
+    run(config,tmp_path)
+    # moving timestart changes the first steps of the grid, so every state is discarded
+    config["timestart"] = (pandas.Timestamp(config["timestart"]) + timedelta(days=1)).isoformat()
+    del starts[:]
+    incremental = run(config,tmp_path,time_offset_end=3)
+    assert len(starts) and all([start == 0 for start in starts])
+    full = run(config,tmp_path / "full",state=False,time_offset_end=3)
+    assertEqualResults(incremental,full)
+
+def test_processes_ignored(config,run,tmp_path,caplog):
+    config["processes"] = 2
+    with caplog.at_level(logging.WARNING):
+        incremental = run(config,tmp_path)
+    assert "processes is ignored" in caplog.text
+    full = run(config,tmp_path / "full",state=False)
+    assertEqualResults(incremental,full)
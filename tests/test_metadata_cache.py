@@ -0,0 +1,23 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pydrodelta.cache import MetadataCache
+
+def test_flush(tmp_path):
+    path = str(tmp_path / "metadata.json")
+    cache = MetadataCache(path=path)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda i: cache.set("var",i,{"id": i}),range(100)))
+    # sets are kept in memory until flush
+    assert not os.path.exists(path)
+    assert cache.get("var",42) == {"id": 42}
+    # another process writes meanwhile
+    other = MetadataCache(path=path)
+    other.set("serie",1,{"id": 1})
+    other.flush()
+    cache.flush()
+    with open(path) as f:
+        store = json.load(f)
+    assert len(store["var"]) == 100 and store["serie"] == {"1": {"id": 1}}
+    assert MetadataCache(path=path).get("var",99) == {"id": 99}
+    assert [name for name in os.listdir(tmp_path) if name.endswith(".tmp")] == []
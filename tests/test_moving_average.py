@@ -0,0 +1,35 @@
+import numpy as np
+import pandas
+from datetime import timedelta
+import pydrodelta.util as util
+
+def syntheticSerie(n,seed=0):
+    rng = np.random.default_rng(seed)
+    times = pandas.DatetimeIndex(np.sort(rng.integers(0,n * 900,n)) * 1000000000,name="timestart").tz_localize("UTC")
+    valor = rng.normal(size=n)
+    valor[rng.random(n) < 0.2] = np.nan
+    return pandas.DataFrame({"valor": valor, "tag": util.encodeTags(pandas.Series(np.where(np.isnan(valor),None,"obs"))).values},index=times)
+
+def test_full_and_incremental_equal():
+    data = syntheticSerie(2000)
+    window = timedelta(hours=6)
+    full = util.serieMovingAverage(data,window,tag_column="tag")
+    pandas.testing.assert_series_equal(full["valor"],data["valor"].rolling(window,min_periods=1).mean())
+    moving_average = util.MovingAverage(window)
+    head = util.serieMovingAverage(data.iloc[:1500],window,tag_column="tag",moving_average=moving_average)
+    tail = util.serieMovingAverage(data.iloc[1500:],window,tag_column="tag",moving_average=moving_average)
+    incremental = pandas.concat([head,tail])
+    np.testing.assert_allclose(incremental["valor"].values,full["valor"].values,rtol=0,atol=1e-9)
+    assert list(util.decodeTags(incremental["tag"])) == list(util.decodeTags(full["tag"]))
+    # input is not modified
+    assert data["tag"].isna().sum() == np.isnan(data["valor"].values).sum()
+
+def test_seeded_window():
+    data = syntheticSerie(2000,seed=1)
+    window = timedelta(hours=6)
+    full = util.serieMovingAverage(data,window,tag_column="tag")
+    # resume from already averaged data: seed with the observations before the tail
+    moving_average = util.MovingAverage(window)
+    moving_average.seed(data.index.asi8[:1200],data["valor"].values[:1200])
+    tail = util.serieMovingAverage(data.iloc[1200:],window,tag_column="tag",moving_average=moving_average)
+    np.testing.assert_allclose(tail["valor"].values,full["valor"].values[1200:],rtol=0,atol=1e-9)
@@ -0,0 +1,42 @@
+import pandas
+import pydrodelta.util as util
+import pydrodelta.analysis as analysis
+
+def observedSeries(topology):
+    return [serie for node in topology.nodes for variable in node.variables.values() if isinstance(variable,analysis.ObservedNodeVariable) for serie in variable.series]
+
+def test_lazy_snapshot_not_copied(synthetic_config,process_topology):
+    config = synthetic_config(4,days=2)
+    config["keep_original_data"] = "lazy"
+    topology = process_topology(config)
+    series = observedSeries(topology)
+    assert len(series)
+    for serie in series:
+        assert isinstance(serie._original_data,util.DataSnapshot)
+        assert not serie._original_data.copied
+
+def test_lazy_snapshot_offset(synthetic_config,process_topology,obs_source):
+    config = synthetic_config(4,days=2)
+    config["keep_original_data"] = "lazy"
+    config["nodes"][0]["variables"][0]["series"][0]["x_offset"] = {"hours": 1}
+    config["nodes"][0]["variables"][0]["series"][0]["y_offset"] = 0.5
+    topology = process_topology(config)
+    serie = topology.nodes[0].variables[2].series[0]
+    # the offset builds a new frame, so the snapshot keeps the loaded data without being copied
+    assert not serie._original_data.copied
+    loaded = obs_source.readSerie(serie.series_id,topology.timestart,topology.timeend)[1]
+    pandas.testing.assert_series_equal(serie.original_data["valor"],loaded["valor"],check_names=False)
+
+def test_apply_offset():
+    serie = analysis.NodeSerie({"series_id": 1, "x_offset": {"hours": 1}, "y_offset": 2})
+    data = util.encodeTags(pandas.Series(["obs","obs"]))
+    original = pandas.DataFrame({"valor": [1.0,2.0], "tag": data.values},index=pandas.DatetimeIndex(["2022-01-01T00:00:00","2022-01-01T01:00:00"],name="timestart"))
+    serie.data = original
+    serie.applyOffset()
+    assert list(serie.data.index) == list(original.index + pandas.Timedelta(hours=1))
+    assert list(serie.data["valor"]) == [3.0,4.0]
+    assert list(original["valor"]) == [1.0,2.0]
+    unchanged = analysis.NodeSerie({"series_id": 1})
+    unchanged.data = original
+    unchanged.applyOffset()
+    assert unchanged.data is original
@@ -0,0 +1,31 @@
+import pytest
+from pydrodelta.scheduler import TaskGraph
+
+def test_order_and_failures():
+    done = []
+    graph = TaskGraph()
+    graph.addTask("c",lambda: done.append("c"),dependencies=["b"])
+    graph.addTask("a",lambda: done.append("a"))
+    graph.addTask("b",lambda: done.append("b"),dependencies=["a"])
+    graph.addTask("d",lambda: done.append("d"))
+    # the default dependencies list is not shared between tasks
+    assert graph.dependencies["a"] == set() and graph.dependencies["d"] == set()
+    assert graph.getOrder() == ["a","b","c","d"]
+    assert graph.run() == {} and done == ["a","b","c","d"]
+    def fail():
+        raise Exception("failed")
+    graph = TaskGraph()
+    graph.addTask("a",fail)
+    graph.addTask("b",lambda: done.append("b2"),dependencies=["a"])
+    graph.addTask("c",lambda: done.append("c2"))
+    failed = graph.run(max_workers=2)
+    assert list(failed) == ["a"] and "b2" not in done and "c2" in done
+
+def test_cycle():
+    graph = TaskGraph()
+    graph.addTask("a",lambda: None,dependencies=["b"])
+    graph.addTask("b",lambda: None,dependencies=["a"])
+    graph.addTask("c",lambda: None)
+    assert graph.getCyclic() == ["a","b"]
+    with pytest.raises(Exception):
+        graph.getOrder()